@@ -0,0 +1,113 @@
+"""
+เทียบ throughput ขั้นเตรียมไฟล์ก่อน insert ระหว่างบันทึกทีละไฟล์ (/document/save ต่อกัน) กับ /document/bulk-save
+- sequential: ทีละไฟล์ แปลงผ่าน conversion_executor แล้วเก็บ blob, แปลง OCR text, search vector, MinHash
+- bulk: _prepare_bulk_item ขนานกัน BULK_WORKERS thread (DOCX/รูปภาพแปลงผ่าน bulk_conversion_executor, PDF ไม่ต้องแปลง)
+ไม่รวมงาน DB (bulk insert + commit ครั้งเดียวต่อ batch แทน 3 commit ต่อไฟล์) และการสรุป wiki ด้วย LLM
+ที่ย้ายไป Celery แล้ว ตัวเลขนี้จึงเป็นขอบล่างของส่วนต่างจริง
+
+วิธีใช้:
+    python benchmarks/bench_bulk_prepare.py folder_of_files/ [--limit 100]
+แต่ละโหมดรันใน process แยก และใช้ blob store ชั่วคราวของตัวเอง (dedup จากโหมดก่อนไม่ทำให้เร็วขึ้น)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUPPORTED = {".pdf", ".docx", ".png", ".jpg", ".jpeg"}
+# ข้อความ OCR จำลองราวหนึ่งหน้า ให้ขั้นตัดคำ/MinHash มีงานใกล้เคียงของจริง
+SAMPLE_OCR = "<p>ข้อบังคับมหาวิทยาลัยว่าด้วยการบริหารงานบุคคล พ.ศ. ๒๕๖๗ ข้อ {i} ให้อธิการบดีเป็นผู้รักษาการตามข้อบังคับนี้</p>" * 40
+
+
+def list_files(folder: str, limit: int) -> list[Path]:
+    files = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in SUPPORTED)
+    return files[:limit]
+
+
+def item_for(path: Path, i: int) -> dict:
+    return {
+        "fileName": path.name,
+        "docName": path.stem,
+        "ocrText": SAMPLE_OCR.format(i=i),
+        "meta": {"factionName": "bench", "typeName": "ระเบียบ", "keyword": ["บุคคล"]},
+    }
+
+
+def run_sequential(files: list[Path]):
+    from controllers.document_controller import convert_bytes_to_pdf, store_pdf
+    from controllers.executor_controller import conversion_executor
+    from controllers.ocr_controller import richtext_to_plaintext
+    from controllers.search_controller import build_search_vector
+    from controllers.similarity_controller import compute_signature
+
+    for i, path in enumerate(files):
+        item = item_for(path, i)
+        store_pdf(conversion_executor.run_sync(convert_bytes_to_pdf, path.read_bytes(), path.name))
+        ocr_text, _ = richtext_to_plaintext(item["ocrText"])
+        build_search_vector(item["docName"], item["meta"]["keyword"], ocr_text)
+        compute_signature(ocr_text)
+
+
+def run_bulk(files: list[Path]):
+    from concurrent.futures import ThreadPoolExecutor
+    from controllers.document_controller import BULK_WORKERS, _prepare_bulk_item
+
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS) as pool:
+        futures = [pool.submit(_prepare_bulk_item, item_for(path, i), path) for i, path in enumerate(files)]
+        for f in futures:
+            f.result()
+
+
+def child(args):
+    files = list_files(args.folder, args.limit)
+    # import ก่อนจับเวลา (pythainlp โหลด dictionary ตอน import)
+    import controllers.document_controller  # noqa: F401
+    start = time.perf_counter()
+    if args.mode == "sequential":
+        run_sequential(files)
+    else:
+        run_bulk(files)
+    wall = time.perf_counter() - start
+    print(json.dumps({
+        "mode": args.mode,
+        "files": len(files),
+        "wall_seconds": round(wall, 2),
+        "files_per_second": round(len(files) / wall, 2) if wall else None,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--mode", choices=["sequential", "bulk"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args)
+        return
+
+    if not list_files(args.folder, args.limit):
+        sys.exit(f"ไม่พบไฟล์ {', '.join(sorted(SUPPORTED))} ใน {args.folder}")
+    results = {}
+    for mode in ("sequential", "bulk"):
+        with tempfile.TemporaryDirectory() as blob_dir:
+            env = dict(os.environ, BLOB_STORE="local", BLOB_STORE_DIR=blob_dir)
+            cmd = [sys.executable, __file__, args.folder, "--limit", str(args.limit), "--mode", mode]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True, env=env).stdout
+        line = out.strip().splitlines()[-1]
+        print(line)
+        results[mode] = json.loads(line)
+    seq, bulk = results["sequential"]["wall_seconds"], results["bulk"]["wall_seconds"]
+    if bulk:
+        print(json.dumps({"speedup": round(seq / bulk, 2)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+เทียบเวลา CPU และหน่วยความจำสูงสุดต่อหน้า ระหว่างการเตรียมภาพสำหรับ OCR แบบเดิมกับแบบใหม่ (ไม่รวมเวลาเรียก API)
+- old: pixmap -> PNG -> PIL -> numpy (gray + medianBlur ที่ไม่ได้ใช้) -> PNG ไฟล์ชั่วคราว -> PIL -> JPEG -> base64
+  (ขั้นหลังสุดคือสิ่งที่ typhoon_ocr.ocr_document ทำกับไฟล์ภาพ)
+- new: pixmap -> encode ครั้งเดียว (OCR_IMAGE_FORMAT) -> base64
+
+วิธีใช้:
+    python benchmarks/bench_rasterize.py file.pdf [--pages 20] [--format jpeg] [--dpi 144]
+แต่ละโหมดรันใน process แยก เพื่อให้ค่า peak RSS ไม่ปนกัน
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_old(path: str, pages: int):
+    import cv2
+    import fitz
+    import numpy as np
+    from PIL import Image
+
+    with fitz.open(path) as doc:
+        for page in list(doc)[:pages]:
+            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
+            with Image.open(io.BytesIO(pix.tobytes("png"))) as img:
+                img_arr = np.array(img)
+                img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BGR2GRAY)
+                img_arr = cv2.medianBlur(img_arr, 3)
+                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
+                    temp_path = tmp.name
+                img.save(temp_path)
+            try:
+                with Image.open(temp_path) as reread:
+                    buf = io.BytesIO()
+                    reread.convert("RGB").save(buf, format="JPEG")
+                    base64.b64encode(buf.getvalue())
+            finally:
+                os.remove(temp_path)
+
+
+def run_new(path: str, pages: int, image_format: str, dpi: int):
+    import fitz
+    from controllers.ocr_client_controller import encode_pixmap
+
+    with fitz.open(path) as doc:
+        for page in list(doc)[:pages]:
+            pix = page.get_pixmap(dpi=dpi)
+            data, _ = encode_pixmap(pix, image_format)
+            del pix
+            base64.b64encode(data)
+
+
+def child(args):
+    # import ก่อนจับเวลา ให้เทียบเฉพาะงานต่อหน้า
+    import cv2, fitz, numpy, PIL.Image  # noqa: F401
+    import controllers.ocr_client_controller  # noqa: F401
+    with fitz.open(args.pdf) as doc:
+        pages = min(args.pages, doc.page_count)
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    if args.mode == "old":
+        run_old(args.pdf, pages)
+    else:
+        run_new(args.pdf, pages, args.format, args.dpi)
+    cpu = time.process_time() - start_cpu
+    wall = time.perf_counter() - start_wall
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "mode": args.mode,
+        "pages": pages,
+        "cpu_ms_per_page": round(cpu * 1000 / pages, 1),
+        "wall_ms_per_page": round(wall * 1000 / pages, 1),
+        "peak_rss_mb": round(peak_kb / 1024, 1),
+        "peak_rss_growth_mb": round((peak_kb - base_kb) / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--format", default=os.getenv("OCR_IMAGE_FORMAT", "png"), choices=["png", "jpeg", "webp"])
+    parser.add_argument("--dpi", type=int, default=int(os.getenv("OCR_DPI", "144")))
+    parser.add_argument("--mode", choices=["old", "new"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        child(args)
+        return
+
+    for mode in ("old", "new"):
+        cmd = [sys.executable, __file__, args.pdf, "--pages", str(args.pages),
+               "--format", args.format, "--dpi", str(args.dpi), "--mode", mode]
+        out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        print(out.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
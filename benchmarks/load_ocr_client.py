@@ -0,0 +1,58 @@
+"""
+Load test ชั้น OCR client (token bucket, in-flight limit, retry) แบบ offline ด้วย engine จำลอง
+ต้องมี Redis (REDIS_URL) รันหลาย process พร้อมกันเพื่อจำลองหลาย worker ได้
+
+วิธีใช้:
+    OCR_ENGINE=stub OCR_STUB_ERROR_RATE=0.1 python benchmarks/load_ocr_client.py --requests 100 --threads 16
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OCR_ENGINE", "stub")
+    from controllers.ocr_client_controller import OCR_ENGINE, get_client_stats, ocr_image_bytes
+
+    if OCR_ENGINE != "stub":
+        sys.exit("ตั้ง OCR_ENGINE=stub ก่อน (ไม่ยิง API จริง)")
+
+    before = get_client_stats()
+    latencies, errors = [], 0
+    started = time.perf_counter()
+
+    def one(_):
+        t = time.perf_counter()
+        ocr_image_bytes(b"x" * 1024, "image/jpeg", 1190, 1684)
+        return time.perf_counter() - t
+
+    with ThreadPoolExecutor(args.threads) as pool:
+        futures = [pool.submit(one, i) for i in range(args.requests)]
+        for f in futures:
+            try:
+                latencies.append(f.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - started
+    after = get_client_stats()
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+    print(f"requests={args.requests} ok={len(latencies)} errors={errors} elapsed={elapsed:.1f}s "
+          f"throughput={len(latencies) / elapsed:.2f}/s")
+    print(f"latency p50={p(0.5):.2f}s p95={p(0.95):.2f}s max={latencies[-1]:.2f}s" if latencies else "no successful requests")
+    for key in ("requests", "retries", "failures", "throttled_ms"):
+        print(f"{key}: {after.get(key, 0) - before.get(key, 0)}")
+
+
+if __name__ == "__main__":
+    main()
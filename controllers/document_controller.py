@@ -1,21 +1,35 @@
-import io
+import hashlib
 import os
-import subprocess
 import sys
 import tempfile
+import uuid
+import zipfile
+import fitz  # PyMuPDF
 import img2pdf
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import formatdate, parsedate_to_datetime
 from urllib.parse import quote
-from fastapi.responses import StreamingResponse
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from controllers.wiki_controller import make_wiki_from_payload
+from datetime import date, timezone
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, contains_eager, defer, load_only
+from controllers.wiki_controller import create_pending_wiki, make_placeholder_wiki, mark_wiki_pending, start_wiki_job, WIKI_PENDING
 from models.document import Document
+from models.document_count import DocumentCount
 from models.faction import Faction
 from models.meta import Meta
 from models.type import Type
+from controllers.executor_controller import bulk_conversion_executor, conversion_executor
+from controllers.libreoffice_controller import ConverterBusy, get_libreoffice_pool
 from controllers.ocr_controller import richtext_to_plaintext
+from controllers.search_controller import build_search_vector
+from controllers.similarity_controller import compute_signature, index_document, is_current_signature, remove_document, signature_from_bytes, signature_to_bytes
+from controllers.storage_controller import get_blob_store
 from fastapi import HTTPException, UploadFile
 from sqlalchemy.orm import Session
 from pathlib import Path
@@ -35,21 +49,33 @@ except Exception:
 def convert_to_pdf(file: UploadFile) -> bytes:
     """
     แปลง DOCX/PNG/JPG/JPEG/PDF เป็น PDF แล้วคืนค่าเป็น bytes
-    - DOCX: Windows/Mac ใช้ docx2pdf; Linux/Container ใช้ libreoffice --headless
+    - DOCX: Windows/Mac ใช้ docx2pdf; Linux/Container ใช้ pool ของ libreoffice --headless
     - รูปภาพ: ใช้ img2pdf
     - PDF: ส่งผ่าน (pass-through)
     """
-    # เผื่อบางกรณีไม่มีชื่อไฟล์
-    filename = file.filename or "upload.bin"
+    # อ่านเนื้อไฟล์จาก UploadFile (pointer ของ FastAPI) เผื่อบางกรณีไม่มีชื่อไฟล์
+    data = file.file.read()
+    # แปลงใน thread pool ที่จำกัดจำนวน ถ้าคิวเต็มตอบ 503 แทนการรอ
+    try:
+        return conversion_executor.run_sync(convert_bytes_to_pdf, data, file.filename or "upload.bin")
+    except ConverterBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+
+def convert_bytes_to_pdf(data: bytes, filename: str) -> bytes:
+    """แปลงเนื้อไฟล์ (bytes) เป็น PDF ตามนามสกุลของ filename (ใช้ได้จากหลาย thread)"""
     ext = Path(filename).suffix.lower().lstrip(".")
 
+    if ext == "pdf":
+        # ส่งผ่าน
+        return data
+
     with tempfile.TemporaryDirectory() as td:
         td_path = Path(td)
         in_path = td_path / f"in.{ext if ext else 'bin'}"
         out_path = td_path / "out.pdf"
 
-        # อ่านเนื้อไฟล์จาก UploadFile (pointer ของ FastAPI)
-        in_path.write_bytes(file.file.read())
+        in_path.write_bytes(data)
 
         if ext == "docx":
             # 1) ถ้าใช้ได้ ให้ใช้ docx2pdf (ดีบน Windows/Mac)
@@ -57,18 +83,8 @@ def convert_to_pdf(file: UploadFile) -> bytes:
                 # บางเวอร์ชัน docx2pdf ต้องชี้โฟลเดอร์ output
                 docx_to_pdf(str(in_path), str(td_path))
             else:
-                # 2) Linux/container → ใช้ LibreOffice
-                cmd = [
-                    "libreoffice", "--headless",
-                    "--convert-to", "pdf",
-                    "--outdir", str(td_path),
-                    str(in_path),
-                ]
-                res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                if res.returncode != 0:
-                    raise RuntimeError(
-                        f"LibreOffice convert failed: {res.stderr.decode('utf-8', 'ignore')}"
-                    )
+                # 2) Linux/container → ใช้ pool ของ LibreOffice ที่เปิดค้างไว้
+                get_libreoffice_pool().convert(in_path, td_path)
 
             # หาไฟล์ PDF ที่ได้ (docx2pdf/LO ตั้งชื่อจากต้นฉบับ)
             pdf_files = list(td_path.glob("*.pdf"))
@@ -81,17 +97,24 @@ def convert_to_pdf(file: UploadFile) -> bytes:
             out_path.write_bytes(img2pdf.convert(str(in_path)))
             return out_path.read_bytes()
 
-        elif ext == "pdf":
-            # ส่งผ่าน
-            return in_path.read_bytes()
-
         else:
             raise ValueError("Unsupported file type. Only DOCX, images, and PDF are allowed.")
 
 
 
+def store_pdf(pdf_bytes: bytes) -> dict:
+    """
+    เก็บ PDF ลง blob store แล้วคืนค่าที่ต้องบันทึกใน Document (hash, ขนาด, จำนวนหน้า)
+    ไฟล์ที่เหมือนกันทุกไบต์จะได้ hash เดิม จึงไม่ถูกเก็บซ้ำ
+    """
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+        page_count = pdf.page_count
+    file_hash = get_blob_store().put(pdf_bytes)
+    return {"fileHash": file_hash, "fileSize": len(pdf_bytes), "pageCount": page_count}
+
+
 def save_doc(db: Session, doc_data: dict, file: UploadFile, wiki_id: int):
-    file_data = convert_to_pdf(file)
+    blob = store_pdf(convert_to_pdf(file))
 
     # Extract faction name and type name from either str or dict
     faction_raw = doc_data["meta"]["factionName"]
@@ -121,21 +144,77 @@ def save_doc(db: Session, doc_data: dict, file: UploadFile, wiki_id: int):
 
 
     # บันทึก Document พร้อม Metadata
+    signature = compute_signature(doc_data["ocrText"])
     new_doc = Document(
         docName=doc_data["docName"],
         metaId=new_meta.metaId,
         ocrText=doc_data["ocrText"],
         ocrTextWithFormat=doc_data['ocrTextWithFormat'],
         status=True,
-        file=file_data,  # เก็บไฟล์เป็นไบนารี
+        fileHash=blob["fileHash"],
+        fileSize=blob["fileSize"],
+        pageCount=blob["pageCount"],
+        searchVector=build_search_vector(doc_data["docName"], doc_data["meta"]["keyword"], doc_data["ocrText"]),
+        minhash=signature_to_bytes(signature) if signature is not None else None,
         wikiId=wiki_id
     )
     db.add(new_doc)
+    _bump_document_count(db, _count_key(new_meta), 1)
     db.commit()
     db.refresh(new_doc)
 
+    _update_lsh_index(new_doc.docId, None, signature)
     return new_doc
 
+
+def _update_lsh_index(doc_id: int, old_minhash: bytes | None, signature):
+    """อัปเดต LSH index หลัง commit (ถ้า Redis มีปัญหาไม่ทำให้การบันทึกเอกสารล้ม)"""
+    try:
+        if is_current_signature(old_minhash):
+            remove_document(doc_id, signature_from_bytes(old_minhash))
+        if signature is not None:
+            index_document(doc_id, signature)
+    except Exception as e:
+        print(f"LSH index update failed for docId={doc_id}: {e}")
+
+# ---------- ตารางสรุปจำนวนเอกสาร (document_count) ----------
+TYPE_COUNT_KEYS = {"ข้อบังคับ": "rule", "ระเบียบ": "regulation", "ประกาศ": "announcement"}
+
+
+def _as_date(value) -> date | None:
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def _count_key(meta: Meta | None) -> tuple | None:
+    """key ของแถวใน document_count (ปี, เดือน, ฝ่าย, ประเภท) หรือ None ถ้าไม่มีวันที่ประกาศ"""
+    if meta is None:
+        return None
+    published = _as_date(meta.publishedDate)
+    if published is None:
+        return None
+    return (published.year, published.month, meta.factionName or "", meta.typeName or "")
+
+
+def _bump_document_count(db: Session, key: tuple | None, delta: int):
+    """เพิ่ม/ลดจำนวนใน document_count แบบ upsert (ยังไม่ commit ให้ไปพร้อมกับการแก้เอกสาร)"""
+    if key is None or delta == 0:
+        return
+    year, month, faction_name, type_name = key
+    stmt = pg_insert(DocumentCount).values(
+        year=year, month=month, factionName=faction_name, typeName=type_name, count=delta
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[DocumentCount.year, DocumentCount.month, DocumentCount.factionName, DocumentCount.typeName],
+        set_={"count": DocumentCount.count + delta},
+    )
+    db.execute(stmt)
+
+
 def get_or_create_faction(db: Session, faction_name: str):
     """ ค้นหา factid จาก factionname ถ้าไม่เจอให้สร้างใหม่ """
     faction = db.query(Faction).filter(Faction.factionName == faction_name).first()
@@ -152,6 +231,267 @@ def get_type_id(db: Session, type_name: str):
     type_obj = db.query(Type).filter(Type.typeName == type_name).first()
     return type_obj.typeId if type_obj else None
 
+#bulk save-------------------------------------------------------------------------------------
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "8"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "500"))
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", str(1024 * 1024 * 1024)))  # รวมทุกไฟล์ใน batch
+
+
+def _meta_value(raw):
+    """factionName/typeName ส่งมาเป็น str หรือ {"value": ...} ก็ได้ (ค่าที่ไม่ใช่ str คืน None)"""
+    value = raw.get("value") if isinstance(raw, dict) else raw
+    return value if isinstance(value, str) else None
+
+
+NO_DATE = "ไม่พบวันที่"  # ค่าที่ extract_metadata ใส่มาเมื่อหาวันที่ไม่เจอ
+
+
+def _meta_date(raw) -> date | None:
+    """วันที่ใน meta ของ manifest: ค่าว่าง/NO_DATE คืน None, รูปแบบที่ไม่ใช่ YYYY-MM-DD โยน ValueError"""
+    if raw is None or raw == "" or raw == NO_DATE:
+        return None
+    if not isinstance(raw, str):
+        raise ValueError(f"invalid date {raw!r}")
+    return date.fromisoformat(raw[:10])
+
+
+def _is_str_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _prepare_bulk_item(item: dict, path: Path) -> dict:
+    """
+    งานที่ไม่ใช้ DB ของแต่ละไฟล์ (รันขนานกันใน thread pool):
+    แปลงเป็น PDF, เก็บลง blob store, แปลง OCR text, wiki ชั่วคราว, search vector และ MinHash
+    path คือไฟล์ที่ spool_bulk_files เขียนไว้ อ่านเข้าหน่วยความจำเฉพาะตอนถึงคิวของไฟล์นี้
+    """
+    data = path.read_bytes()
+    # PDF ไม่ต้องแปลง ไฟล์อื่นรอคิวในเลนของ bulk (จำกัดจำนวนเท่า /document/save แต่ไม่แย่ง slot กัน)
+    if Path(item["fileName"]).suffix.lower() == ".pdf":
+        pdf_bytes = data
+    else:
+        pdf_bytes = bulk_conversion_executor.run_sync(convert_bytes_to_pdf, data, item["fileName"])
+    blob = store_pdf(pdf_bytes)
+    ocr_text, ocr_text_with_format = richtext_to_plaintext(item.get("ocrText") or "")
+    meta = item.get("meta") or {}
+    title, summary, content = make_placeholder_wiki(
+        doc_name=item.get("docName", ""),
+        meta=meta,
+        ocr_text=ocr_text,
+    )
+    signature = compute_signature(ocr_text)
+    return {
+        "blob": blob,
+        "ocrText": ocr_text,
+        "ocrTextWithFormat": ocr_text_with_format,
+        "wiki": {"title": title, "summary": summary, "content": content,
+                 "status": WIKI_PENDING, "taskId": str(uuid.uuid4())},
+        "searchVector": build_search_vector(item.get("docName"), meta.get("keyword"), ocr_text),
+        "signature": signature,
+    }
+
+
+def bulk_save_docs(db: Session, items: list[dict], files: dict[str, Path]) -> list[dict]:
+    """
+    บันทึกเอกสารหลายฉบับในครั้งเดียว
+    - items: manifest แต่ละรายการมี fileName, docName, ocrText, meta (รูปแบบเดียวกับ /document/save)
+    - files: {fileName: path} จาก spool_bulk_files
+    - แปลงไฟล์ขนานกัน, หา factId/typeId ครั้งเดียวต่อ batch, สรุป wiki ด้วย LLM ทำใน Celery ภายหลัง
+    - insert wiki/meta/document แบบ bulk และ commit ครั้งเดียว
+    คืนสถานะรายไฟล์ตามลำดับใน manifest
+    """
+    results = [
+        {"index": i, "fileName": item.get("fileName") if isinstance(item, dict) else None, "status": "pending"}
+        for i, item in enumerate(items)
+    ]
+
+    def fail(i, error):
+        results[i]["status"] = "error"
+        results[i]["error"] = error
+
+    # 1) ตรวจ manifest ทีละรายการ (รายการที่ผิดไม่ทำให้ทั้ง batch insert ไม่ได้)
+    dates = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            fail(i, "Manifest item must be an object")
+            continue
+        meta = item.get("meta") or {}
+        if not isinstance(meta, dict):
+            fail(i, "meta must be an object")
+            continue
+        try:
+            dates[i] = (_meta_date(meta.get("publishDate")), _meta_date(meta.get("effectiveDate")))
+        except ValueError:
+            fail(i, "meta.publishDate and meta.effectiveDate must be YYYY-MM-DD")
+            continue
+        if not _is_str_list(meta.get("keyword") or []):
+            fail(i, "meta.keyword must be a list of strings")
+        elif not _is_str_list(meta.get("relateDoc") or []):
+            fail(i, "meta.relateDoc must be a list of strings")
+        elif not isinstance(item.get("fileName"), str):
+            fail(i, "fileName must be a string")
+        elif item["fileName"] not in files:
+            fail(i, "File not found in upload")
+        elif not item.get("docName") or not isinstance(item["docName"], str):
+            fail(i, "docName is required")
+        elif not _meta_value(meta.get("factionName")) or not _meta_value(meta.get("typeName")):
+            fail(i, "meta.factionName and meta.typeName are required")
+
+    # 2) หา factId/typeId ครั้งเดียวต่อ batch (ฝ่ายที่ยังไม่มีสร้างใหม่, ประเภทต้องมีอยู่แล้ว)
+    pending = [i for i, res in enumerate(results) if res["status"] == "pending"]
+    faction_names = {_meta_value(items[i]["meta"]["factionName"]) for i in pending}
+    type_names = {_meta_value(items[i]["meta"]["typeName"]) for i in pending}
+
+    faction_ids = dict(db.query(Faction.factionName, Faction.factId).filter(Faction.factionName.in_(faction_names)))
+    missing = [{"factionName": name} for name in faction_names if name not in faction_ids]
+    if missing:
+        created = db.execute(
+            insert(Faction).returning(Faction.factionName, Faction.factId, sort_by_parameter_order=True),
+            missing,
+        )
+        faction_ids.update(dict(created.all()))
+    type_ids = dict(db.query(Type.typeName, Type.typeId).filter(Type.typeName.in_(type_names)))
+
+    for i in pending:
+        type_name = _meta_value(items[i]["meta"]["typeName"])
+        if type_name not in type_ids:
+            fail(i, f"Type '{type_name}' not found.")
+
+    # 3) แปลงไฟล์ขนานกัน
+    pending = [i for i, res in enumerate(results) if res["status"] == "pending"]
+    prepared = {}
+    with ThreadPoolExecutor(max_workers=BULK_WORKERS) as pool:
+        futures = {pool.submit(_prepare_bulk_item, items[i], files[items[i]["fileName"]]): i for i in pending}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                prepared[i] = future.result()
+            except Exception as e:
+                fail(i, str(e))
+
+    ready = [i for i in pending if i in prepared]
+    if not ready:
+        db.commit()  # ฝ่ายที่สร้างใหม่
+        return results
+
+    # 4) insert แบบ bulk ใน transaction เดียว
+    try:
+        wiki_ids = db.scalars(
+            insert(Wiki).returning(Wiki.wikiId, sort_by_parameter_order=True),
+            [prepared[i]["wiki"] for i in ready],
+        ).all()
+
+        meta_rows = []
+        for i in ready:
+            meta = items[i]["meta"]
+            faction_name = _meta_value(meta["factionName"])
+            type_name = _meta_value(meta["typeName"])
+            meta_rows.append({
+                "factId": faction_ids[faction_name],
+                "typeId": type_ids[type_name],
+                "factionName": faction_name,
+                "typeName": type_name,
+                "publishedDate": dates[i][0],
+                "effectiveDate": dates[i][1],
+                "keyword": meta.get("keyword") or [],
+                "relateddoc": meta.get("relateDoc") or [],
+            })
+        meta_ids = db.scalars(
+            insert(Meta).returning(Meta.metaId, sort_by_parameter_order=True),
+            meta_rows,
+        ).all()
+
+        doc_rows = []
+        for i, meta_id, wiki_id in zip(ready, meta_ids, wiki_ids):
+            p = prepared[i]
+            doc_rows.append({
+                "docName": items[i]["docName"],
+                "metaId": meta_id,
+                "ocrText": p["ocrText"],
+                "ocrTextWithFormat": p["ocrTextWithFormat"],
+                "status": True,
+                "fileHash": p["blob"]["fileHash"],
+                "fileSize": p["blob"]["fileSize"],
+                "pageCount": p["blob"]["pageCount"],
+                "searchVector": p["searchVector"],
+                "minhash": signature_to_bytes(p["signature"]) if p["signature"] is not None else None,
+                "wikiId": wiki_id,
+            })
+        doc_ids = db.scalars(
+            insert(Document).returning(Document.docId, sort_by_parameter_order=True),
+            doc_rows,
+        ).all()
+
+        # รวมจำนวนต่อ key ก่อน แล้วค่อย upsert document_count
+        count_deltas = Counter()
+        for row in meta_rows:
+            published = row["publishedDate"]
+            if published:
+                count_deltas[(published.year, published.month, row["factionName"] or "", row["typeName"] or "")] += 1
+        for key, delta in count_deltas.items():
+            _bump_document_count(db, key, delta)
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        for i in ready:
+            fail(i, f"Database insert failed: {e}")
+        return results
+
+    for i, doc_id, wiki_id in zip(ready, doc_ids, wiki_ids):
+        task_id = start_wiki_job(wiki_id, prepared[i]["wiki"]["taskId"], items[i]["docName"], items[i].get("meta") or {}, prepared[i]["ocrText"])
+        results[i].update({"status": "saved", "doc_id": doc_id, "wikiId": wiki_id, "wiki_task_id": task_id})
+        _update_lsh_index(doc_id, None, prepared[i]["signature"])
+
+    return results
+
+
+def _spool(src, dest: Path, budget: int) -> int:
+    """คัดลอก file object ลง dest ทีละ chunk คืนจำนวนไบต์ (โยน 413 ถ้าเกิน budget ที่เหลือของ batch)"""
+    size = 0
+    with open(dest, "wb") as out:
+        while chunk := src.read(1024 * 1024):
+            size += len(chunk)
+            if size > budget:
+                raise HTTPException(status_code=413, detail="Upload is too large")
+            out.write(chunk)
+    return size
+
+
+def spool_bulk_files(archive, uploads: list[UploadFile], dest_dir: Path) -> dict[str, Path]:
+    """
+    เขียนไฟล์ใน ZIP และไฟล์ที่อัปโหลดลงโฟลเดอร์ชั่วคราว คืน {ชื่อไฟล์: path} (ชื่อไฟล์ไม่รวมโฟลเดอร์)
+    ไม่อ่านทั้ง batch เข้าหน่วยความจำของ API ขนาดรวมไม่เกิน BULK_MAX_BYTES
+    """
+    files = {}
+    remaining = BULK_MAX_BYTES
+
+    def target(name: str, kind: str) -> Path:
+        # ใช้ชื่อไฟล์ไม่รวมโฟลเดอร์ ไฟล์ชื่อซ้ำในคนละโฟลเดอร์จะทับกันโดยไม่รู้ตัว
+        if name in files:
+            raise HTTPException(status_code=400, detail=f"Duplicate file name in {kind}: {name}")
+        files[name] = dest_dir / str(len(files))
+        return files[name]
+
+    if archive is not None:
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                infos = [info for info in zf.infolist() if not info.is_dir()]
+                if len(infos) > BULK_MAX_ITEMS:
+                    raise HTTPException(status_code=413, detail=f"Too many files (max {BULK_MAX_ITEMS})")
+                if sum(info.file_size for info in infos) > BULK_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="Archive is too large")
+                for info in infos:
+                    with zf.open(info) as src:
+                        remaining -= _spool(src, target(Path(info.filename).name, "archive"), remaining)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Invalid ZIP archive")
+
+    for f in uploads:
+        remaining -= _spool(f.file, target(f.filename, "upload"), remaining)
+    return files
+
+
 #update doc-----------------------------------------------------------------------------------
 def update_doc(db: Session, doc_id: int, doc_data: dict, file: UploadFile | None = None):
   
@@ -159,14 +499,20 @@ def update_doc(db: Session, doc_id: int, doc_data: dict, file: UploadFile | None
     """
     อัพเดตทั้ง Metadata และ Document
     - ถ้ามี field ใน meta ให้ไปอัพเดตในตาราง meta
-    - ถ้ามีไฟล์ใหม่ ส่งมาให้แปลงเป็น PDF แล้วอัพเดต Document.file
+    - ถ้ามีไฟล์ใหม่ ส่งมาให้แปลงเป็น PDF แล้วเก็บลง blob store
     """
-    # 1) ดึง Document เดิม
-    db_doc = db.query(Document).filter(Document.docId == doc_id).first()
+    # แปลงไฟล์ใหม่ (ถ้ามี) ก่อน lock แถว ไม่ให้การแปลงที่ช้าไปถือ lock ไว้
+    #    (ไม่ลบ blob เดิม เพราะเอกสารอื่นที่ไฟล์เหมือนกันอาจใช้ hash เดียวกันอยู่)
+    blob = store_pdf(convert_to_pdf(file)) if file else None
+
+    # 1) ดึง Document เดิม lock แถวไว้จน commit (status/meta ที่อ่านใช้เลือกการแก้ document_count)
+    db_doc = db.query(Document).filter(Document.docId == doc_id).with_for_update().first()
     if not db_doc:
         raise ValueError(f"Document with id={doc_id} not found")
 
     ocr_updated = False
+    old_minhash = None
+    signature = None
 
     # 2) อัพเดตชื่อเอกสาร และ OCR text ถ้ามี
     if "docName" in doc_data:
@@ -184,41 +530,51 @@ def update_doc(db: Session, doc_id: int, doc_data: dict, file: UploadFile | None
             ocr_updated = True
             db_doc.ocrText = new_ocr_plain
             db_doc.ocrTextWithFormat = new_ocr_with_format
+            old_minhash = db_doc.minhash
+            signature = compute_signature(new_ocr_plain)
+            db_doc.minhash = signature_to_bytes(signature) if signature is not None else None
 
-    # 3) ถ้ามีไฟล์ใหม่ ให้แปลงเป็น PDF แล้วอัพเดต
-    if file:
-        pdf_bytes = convert_to_pdf(file)
-        db_doc.file = pdf_bytes
+    # 3) ถ้ามีไฟล์ใหม่ ชี้ไปที่ blob ที่เก็บไว้แล้ว
+    if blob:
+        db_doc.fileHash = blob["fileHash"]
+        db_doc.fileSize = blob["fileSize"]
+        db_doc.pageCount = blob["pageCount"]
+        db_doc.file = None
 
     # 4) อัพเดต Metadata (ถ้ามี)
     if "meta" in doc_data:
         meta_data = doc_data["meta"]
-        db_meta = db.query(Meta).filter(Meta.metaId == db_doc.metaId).first()
+        db_meta = db.query(Meta).filter(Meta.metaId == db_doc.metaId).with_for_update().first()
+        old_count_key = _count_key(db_meta)
         if db_meta:
             # ตัวอย่างอัพเดต field หลักๆ
             for key in ("factionName", "typeName", "publishedDate", "effectiveDate", "keyword", "relateddoc"):
                 if key in meta_data:
                     setattr(db_meta, key, meta_data[key])
 
+        # ฝ่าย/ประเภท/วันที่ประกาศเปลี่ยน → ย้ายจำนวนใน document_count
+        new_count_key = _count_key(db_meta)
+        if db_doc.status and new_count_key != old_count_key:
+            _bump_document_count(db, old_count_key, -1)
+            _bump_document_count(db, new_count_key, 1)
 
-      # 5) ถ้า OCR เปลี่ยน → สร้างสรุปใหม่ แล้ว "อัปเดต wiki เดิม" หรือ "สร้าง wiki ใหม่"
-    if ocr_updated:
-        title, summary, content = make_wiki_from_payload(
-            doc_name=db_doc.docName or "",
-            meta=doc_data.get("meta", {}) or {},
-            ocr_text=db_doc.ocrText or ""
+    # 4.1) ชื่อ/keyword/OCR เปลี่ยน → สร้าง search vector ใหม่
+    if "docName" in doc_data or ocr_updated or "keyword" in (doc_data.get("meta") or {}):
+        db_meta = db.query(Meta).filter(Meta.metaId == db_doc.metaId).first()
+        db_doc.searchVector = build_search_vector(
+            db_doc.docName, db_meta.keyword if db_meta else [], db_doc.ocrText
         )
 
+
+    # 5) ถ้า OCR เปลี่ยน → ให้ Celery สรุป wiki ใหม่ (wiki เดิมยังแสดงได้ระหว่างรอ) หรือสร้าง wiki ชั่วคราวถ้ายังไม่มี
+    wiki = None
+    if ocr_updated:
         wiki = db.query(Wiki).filter(Wiki.wikiId == db_doc.wikiId).first() if db_doc.wikiId else None
 
         if wiki:
-            wiki.title = title
-            wiki.summary = summary
-            wiki.content = content
+            mark_wiki_pending(wiki)
         else:
-            wiki = Wiki(title=title, summary=summary, content=content)
-            db.add(wiki)
-            db.flush()              # ให้ได้ wikiId ก่อน commit
+            wiki = create_pending_wiki(db, db_doc.docName or "", doc_data.get("meta", {}) or {}, db_doc.ocrText or "")
             db_doc.wikiId = wiki.wikiId
 
 
@@ -226,7 +582,11 @@ def update_doc(db: Session, doc_id: int, doc_data: dict, file: UploadFile | None
     # 5) Commit & Refresh
     db.commit()
     db.refresh(db_doc)
-    
+
+    if ocr_updated:
+        _update_lsh_index(db_doc.docId, old_minhash, signature)
+        start_wiki_job(wiki.wikiId, wiki.taskId, db_doc.docName or "", doc_data.get("meta", {}) or {}, db_doc.ocrText or "")
+
     return db_doc
 
 
@@ -234,11 +594,14 @@ def update_doc(db: Session, doc_id: int, doc_data: dict, file: UploadFile | None
 def soft_delete_doc(db: Session, doc_id: int) -> Document:
     """
     Soft-delete document: แค่เปลี่ยน status เป็น False
+    lock แถวก่อนอ่าน status ไม่งั้นลบพร้อมกันสองครั้งจะลด document_count สองครั้ง
     """
-    db_doc = db.query(Document).filter(Document.docId == doc_id).first()
+    db_doc = db.query(Document).filter(Document.docId == doc_id).with_for_update().first()
     if not db_doc:
         raise ValueError(f"Document with id={doc_id} not found")
     # เปลี่ยนสถานะ
+    if db_doc.status:
+        _bump_document_count(db, _count_key(db_doc.meta), -1)
     db_doc.status = False
     db.commit()
     db.refresh(db_doc)
@@ -249,11 +612,13 @@ class StatusUpdate(BaseModel):
     status: bool
 
 def update_document_status(db: Session, doc_id: int, new_status: bool) -> Document:
-    """Toggles a document's status (True <-> False)."""
-    doc_to_update = db.query(Document).filter(Document.docId == doc_id).first()
+    """Toggles a document's status (True <-> False). Locks the row so concurrent toggles bump document_count once."""
+    doc_to_update = db.query(Document).filter(Document.docId == doc_id).with_for_update().first()
     if not doc_to_update:
         raise HTTPException(status_code=404, detail=f"Document with id={doc_id} not found")
     
+    if bool(doc_to_update.status) != new_status:
+        _bump_document_count(db, _count_key(doc_to_update.meta), 1 if new_status else -1)
     doc_to_update.status = new_status
     db.commit()
     db.refresh(doc_to_update)
@@ -302,16 +667,16 @@ def get_document_counts_by_year(db: Session, year: int, faction_name: str):
     """
     ดึงจำนวนเอกสารแยกตามประเภท (ข้อบังคับ, ระเบียบ, ประกาศ) ของปีที่กำหนด
     - ถ้า faction_name เป็น 'ทุกฝ่าย' จะรวมทุกฝ่าย
+    - อ่านจากตาราง document_count นับเฉพาะเอกสารที่ status = True
     """
     query = (
-        db.query(Meta.typeName, func.count().label("count"))
-        .join(Document, Document.metaId == Meta.metaId)
-        .filter(func.extract('year', Meta.publishedDate) == year)
-        .group_by(Meta.typeName)
+        db.query(DocumentCount.typeName, func.sum(DocumentCount.count))
+        .filter(DocumentCount.year == year)
+        .group_by(DocumentCount.typeName)
     )
 
     if faction_name != "ทุกฝ่าย":
-        query = query.filter(Meta.factionName == faction_name)
+        query = query.filter(DocumentCount.factionName == faction_name)
 
     results = query.all()
 
@@ -324,7 +689,7 @@ def get_document_counts_by_year(db: Session, year: int, faction_name: str):
 
     for type_name, count in results:
         if type_name in count_map:
-            count_map[type_name] = count
+            count_map[type_name] = int(count or 0)
 
     return {
         "rule": count_map["ข้อบังคับ"],
@@ -333,10 +698,50 @@ def get_document_counts_by_year(db: Session, year: int, faction_name: str):
     }
 
 
+def get_document_count_series(db: Session, year_from: int, year_to: int):
+    """
+    จำนวนเอกสารรายปีและรายเดือนของทุกฝ่ายในช่วงปีที่กำหนด (query เดียวจาก document_count)
+    ผลรวมทุกฝ่ายอยู่ในคีย์ 'ทุกฝ่าย'
+    """
+    if year_from > year_to:
+        raise HTTPException(status_code=400, detail="year_from must be <= year_to")
+
+    rows = (
+        db.query(DocumentCount.factionName, DocumentCount.year, DocumentCount.month,
+                 DocumentCount.typeName, DocumentCount.count)
+        .filter(DocumentCount.year >= year_from, DocumentCount.year <= year_to, DocumentCount.count > 0)
+        .all()
+    )
+
+    years = list(range(year_from, year_to + 1))
+
+    def empty_counts():
+        return {"rule": 0, "regulation": 0, "announcement": 0, "total": 0}
+
+    def empty_series():
+        return {
+            "yearly": {y: empty_counts() for y in years},
+            "monthly": {y: [empty_counts() for _ in range(12)] for y in years},
+        }
+
+    factions = {"ทุกฝ่าย": empty_series()}
+    for faction_name, year, month, type_name, count in rows:
+        type_key = TYPE_COUNT_KEYS.get(type_name)
+        for name in ("ทุกฝ่าย", faction_name):
+            series = factions.setdefault(name, empty_series())
+            for bucket in (series["yearly"][year], series["monthly"][year][month - 1]):
+                bucket["total"] += count
+                if type_key:
+                    bucket[type_key] += count
+
+    return {"years": years, "factions": factions}
+
+
 def get_documents_by_faction(db: Session, faction_name: str):
     docs = (
         db.query(Document)
-        .join(Meta, Document.metaId == Meta.metaId)
+        .join(Document.meta)
+        .options(contains_eager(Document.meta), defer(Document.file))  # ไม่ดึงไฟล์ PDF มาด้วย
         .filter(Meta.factionName == faction_name)
         .all()
     )
@@ -371,7 +776,12 @@ def get_all_documents(db: Session):
     """
     ดึงเอกสารทั้งหมด โดย Join กับตาราง Meta
     """
-    docs = db.query(Document).join(Meta, Document.metaId == Meta.metaId).all()
+    docs = (
+        db.query(Document)
+        .join(Document.meta)
+        .options(contains_eager(Document.meta), defer(Document.file))  # ไม่ดึงไฟล์ PDF มาด้วย
+        .all()
+    )
     results = []
 
     for doc in docs:
@@ -395,21 +805,250 @@ def get_all_documents(db: Session):
 
     return results
 
-def download_document(db: Session, doc_id: int):
-    document = db.query(Document).filter(Document.docId == doc_id).first()
+# ---------- list (keyset pagination + field projection) ----------
+LIST_FIELDS = ("docId", "docName", "meta", "status", "files", "wiki", "ocrText", "ocrTextWithFormat")
+DEFAULT_LIST_FIELDS = ("docId", "docName", "meta", "status", "files", "wiki")
+MAX_LIST_LIMIT = 200
+
+
+def parse_list_fields(fields: str | None) -> set[str]:
+    """
+    แปลงพารามิเตอร์ fields=docName,meta,... เป็น set
+    - ไม่ส่งมา → ใช้ DEFAULT_LIST_FIELDS (ไม่รวม ocrText/ocrTextWithFormat)
+    - docId ถูกใส่เสมอเพราะใช้เป็น cursor
+    """
+    if not fields:
+        return set(DEFAULT_LIST_FIELDS)
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(LIST_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add("docId")
+    return requested
+
 
-    if not document or not document.file:
+def _meta_to_dict(meta: Meta | None) -> dict:
+    return {
+        "factionName": meta.factionName if meta else "",
+        "typeName": meta.typeName if meta else "",
+        "publishDate": str(meta.publishedDate) if meta and meta.publishedDate else "",
+        "effectiveDate": str(meta.effectiveDate) if meta and meta.effectiveDate else "",
+        "keyword": meta.keyword if meta else [],
+        "relateDoc": meta.relateddoc if meta else []
+    }
+
+
+def list_documents(
+    db: Session,
+    cursor: int | None = None,
+    limit: int = 50,
+    faction_name: str | None = None,
+    type_name: str | None = None,
+    status: bool | None = None,
+    published_from: date | None = None,
+    published_to: date | None = None,
+    effective_from: date | None = None,
+    effective_to: date | None = None,
+    fields: str | None = None,
+):
+    """
+    ดึงรายการเอกสารแบบแบ่งหน้า (keyset pagination บน docId)
+    - cursor = docId ตัวสุดท้ายของหน้าก่อน (ไม่ส่ง = หน้าแรก)
+    - โหลดเฉพาะคอลัมน์ที่ขอใน fields; file ไม่ถูกโหลดเลย และ ocrText/ocrTextWithFormat โหลดเมื่อขอเท่านั้น
+    - meta ถูกดึงมาใน query เดียวกัน (JOIN + contains_eager) ไม่ใช่ query แยกทีละแถว
+    """
+    selected = parse_list_fields(fields)
+    limit = max(1, min(limit, MAX_LIST_LIMIT))
+
+    columns = [Document.docId]
+    if "docName" in selected:
+        columns.append(Document.docName)
+    if "status" in selected:
+        columns.append(Document.status)
+    if "wiki" in selected:
+        columns.append(Document.wikiId)
+    if "ocrText" in selected:
+        columns.append(Document.ocrText)
+    if "ocrTextWithFormat" in selected:
+        columns.append(Document.ocrTextWithFormat)
+
+    query = db.query(Document).join(Document.meta).options(load_only(*columns))
+    if "meta" in selected:
+        query = query.options(contains_eager(Document.meta))
+
+    if cursor is not None:
+        query = query.filter(Document.docId > cursor)
+    if faction_name:
+        query = query.filter(Meta.factionName == faction_name)
+    if type_name:
+        query = query.filter(Meta.typeName == type_name)
+    if status is not None:
+        query = query.filter(Document.status == status)
+    if published_from:
+        query = query.filter(Meta.publishedDate >= published_from)
+    if published_to:
+        query = query.filter(Meta.publishedDate <= published_to)
+    if effective_from:
+        query = query.filter(Meta.effectiveDate >= effective_from)
+    if effective_to:
+        query = query.filter(Meta.effectiveDate <= effective_to)
+
+    # ดึงเกินมา 1 แถวเพื่อรู้ว่ามีหน้าถัดไปหรือไม่
+    docs = query.order_by(Document.docId).limit(limit + 1).all()
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    items = []
+    for doc in docs:
+        item = {"docId": doc.docId}
+        if "docName" in selected:
+            item["docName"] = doc.docName
+        if "meta" in selected:
+            item["meta"] = _meta_to_dict(doc.meta)
+        if "ocrText" in selected:
+            item["ocrText"] = doc.ocrText
+        if "ocrTextWithFormat" in selected:
+            item["ocrTextWithFormat"] = doc.ocrTextWithFormat
+        if "status" in selected:
+            item["status"] = doc.status
+        if "files" in selected:
+            item["files"] = [f"/document/download/{doc.docId}"]
+        if "wiki" in selected:
+            item["wiki"] = doc.wikiId
+        items.append(item)
+
+    return {
+        "items": items,
+        "next_cursor": docs[-1].docId if has_more and docs else None,
+        "limit": limit
+    }
+
+
+def _parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    แปลง header Range (รองรับช่วงเดียว: bytes=a-b, bytes=a-, bytes=-n) เป็น (start, end)
+    - คืน None ถ้าไม่ใช่รูปแบบที่รองรับ (เช่นหลายช่วง) → ส่งทั้งไฟล์แทน
+    - ช่วงที่อยู่นอกไฟล์ และ bytes=-0 (ขอ 0 ไบต์สุดท้าย, RFC 9110 14.1.3) → 416
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix < 0:
+                raise ValueError
+            # suffix 0 ไม่มีไบต์ให้ส่ง ให้ตกไปที่ 416 ด้านล่าง
+            start, end = (max(size - suffix, 0), size - 1) if suffix else (size, size - 1)
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+def _not_modified(request: Request, etag: str, last_modified: float | None) -> bool:
+    """ตรวจ If-None-Match / If-Modified-Since (If-None-Match มีลำดับความสำคัญกว่า)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since_dt = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # วันที่ที่ไม่มี timezone (เช่น -0000) ถือเป็น GMT ตาม HTTP-date ไม่ใช่เวลาท้องถิ่นของ server
+        if since_dt.tzinfo is None:
+            since_dt = since_dt.replace(tzinfo=timezone.utc)
+        since = since_dt.timestamp()
+        return int(last_modified) <= int(since)
+    return False
+
+
+def download_document(db: Session, doc_id: int, request: Request):
+    """
+    ส่งไฟล์ PDF ของเอกสาร
+    - ETag = sha256 ของไฟล์ (strong), รองรับ If-None-Match/If-Modified-Since → 304
+    - รองรับ Range (206) ให้ PDF viewer เลื่อนไปหน้าไหนก็ได้โดยไม่ต้องโหลดทั้งไฟล์
+    - blob บนดิสก์ส่งด้วย FileResponse (ให้ server ใช้ sendfile/pathsend ได้)
+    """
+    document = (
+        db.query(Document)
+        .options(load_only(Document.docId, Document.docName, Document.fileHash, Document.fileSize))
+        .filter(Document.docId == doc_id)
+        .first()
+    )
+
+    if not document:
         raise HTTPException(status_code=404, detail="Document not found")
 
+    store = get_blob_store()
+    legacy_bytes = None
+    if document.fileHash:
+        if not store.exists(document.fileHash):
+            raise HTTPException(status_code=404, detail="Document file not found")
+        file_hash = document.fileHash
+        size, last_modified = store.stat(file_hash)
+    elif document.file:
+        # แถวเก่าที่ยังไม่ได้ย้ายไป blob store
+        legacy_bytes = document.file
+        file_hash = hashlib.sha256(legacy_bytes).hexdigest()
+        size, last_modified = len(legacy_bytes), None
+    else:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    etag = f'"{file_hash}"'
     # ใช้ urllib.parse.quote และกำหนด safe=""
     safe_filename = quote(f"{document.docName}.pdf", safe="")
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}",
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",  # เก็บ cache ได้ แต่ต้องถามด้วย ETag ทุกครั้ง
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    if legacy_bytes is None:
+        path = store.local_path(file_hash)
+        if path is not None:
+            # FileResponse จัดการ Range/If-Range เองและใช้ ETag ที่เราส่งให้
+            return FileResponse(path, media_type="application/pdf", headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, size)
+
+    start, end = byte_range if byte_range else (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if legacy_bytes is not None:
+        content = iter([memoryview(legacy_bytes)[start:end + 1].tobytes()])
+    else:
+        content = store.iter_range(file_hash, start, end)
 
     return StreamingResponse(
-        io.BytesIO(document.file),
+        content,
+        status_code=206 if byte_range else 200,
         media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}"
-        }
+        headers=headers
     )
 
 def update_document(db: Session, doc_id: int, doc_data: dict, file: UploadFile | None):
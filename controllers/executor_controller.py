@@ -0,0 +1,168 @@
+"""
+Thread pool แบบจำกัดคิว สำหรับงานที่ block (แปลงไฟล์, งาน CPU หนัก) ไม่ให้ไปค้าง event loop ของ uvicorn
+- รับงานได้ไม่เกิน max_workers + max_queue งาน ถ้าเต็มจะตอบ 503 (พร้อม Retry-After) ทันทีแทนการรอ
+- งานที่เกิน timeout ตอบ 504 (งานที่เริ่มแล้วยังทำต่อจนจบใน thread ของมัน)
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+load_dotenv()
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int, timeout: float):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"Server is busy ({self.name}), please retry later",
+                headers={"Retry-After": "5"},
+            )
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _timeout_error(self) -> HTTPException:
+        return HTTPException(status_code=504, detail=f"{self.name} timed out after {self.timeout:.0f}s")
+
+    def run_sync(self, fn, *args, **kwargs):
+        """ใช้จากโค้ด sync (เช่น handler แบบ def ที่รันใน threadpool ของ FastAPI)"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise self._timeout_error()
+
+    async def run(self, fn, *args, **kwargs):
+        """ใช้จาก async handler: await โดยไม่ block event loop"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timeout_error()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout": self.timeout,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+            }
+
+
+class QueuedExecutor:
+    """
+    Thread pool สำหรับงาน batch (เช่น /document/bulk-save) ที่รอคิวของตัวเองแทนการตอบ 503
+    - ไม่ใช้ slot ร่วมกับ BoundedExecutor จึงไม่ทำให้ request ทีละไฟล์ถูกปฏิเสธระหว่างมี batch
+    - timeout นับตั้งแต่งานเริ่มรัน ไม่รวมเวลารอคิวหลังงานอื่นใน batch เดียวกัน
+    """
+
+    def __init__(self, name: str, max_workers: int, timeout: float):
+        self.name = name
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+        self._timeouts = 0
+
+    def _add(self, waiting: int = 0, running: int = 0):
+        with self._lock:
+            self._waiting += waiting
+            self._running += running
+
+    def run_sync(self, fn, *args, **kwargs):
+        started = threading.Event()
+
+        def job():
+            self._add(waiting=-1, running=1)
+            started.set()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._add(running=-1)
+
+        self._add(waiting=1)
+        future = self._pool.submit(job)
+        started.wait()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"{self.name} timed out after {self.timeout:.0f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "timeout": self.timeout,
+                "waiting": self._waiting,
+                "in_flight": self._running,
+                "timeouts": self._timeouts,
+            }
+
+
+CONVERT_CONCURRENCY = int(os.getenv("CONVERT_CONCURRENCY", "2"))
+CONVERT_TIMEOUT = float(os.getenv("CONVERT_TIMEOUT", "120"))
+
+# แปลง DOCX/รูปภาพเป็น PDF (LibreOffice, img2pdf, ไฟล์ชั่วคราว)
+conversion_executor = BoundedExecutor(
+    "conversion",
+    max_workers=CONVERT_CONCURRENCY,
+    max_queue=int(os.getenv("CONVERT_QUEUE_SIZE", "8")),
+    timeout=CONVERT_TIMEOUT,
+)
+
+# แปลงไฟล์ของ /document/bulk-save แยกเลนจาก conversion_executor ขนาดเท่ากัน
+bulk_conversion_executor = QueuedExecutor(
+    "bulk-conversion",
+    max_workers=CONVERT_CONCURRENCY,
+    timeout=CONVERT_TIMEOUT,
+)
+
+# งาน CPU หนักใน API (ตัดคำ/ดึง metadata, ตรวจคำผิด)
+cpu_executor = BoundedExecutor(
+    "cpu",
+    max_workers=int(os.getenv("CPU_CONCURRENCY", str(os.cpu_count() or 2))),
+    max_queue=int(os.getenv("CPU_QUEUE_SIZE", "32")),
+    timeout=float(os.getenv("CPU_TIMEOUT", "60")),
+)
+
+
+def get_executor_stats() -> list[dict]:
+    return [conversion_executor.stats(), bulk_conversion_executor.stats(), cpu_executor.stats()]
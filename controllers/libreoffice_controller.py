@@ -0,0 +1,284 @@
+"""
+Pool ของ LibreOffice (soffice --headless) ที่เปิดค้างไว้สำหรับแปลง DOCX เป็น PDF
+- แต่ละ slot มี user profile ของตัวเอง (ไม่ชนกันเมื่อแปลงพร้อมกัน)
+- ถ้า import uno ได้ (apt install python3-uno) จะสั่งงานผ่าน UNO socket กับ soffice ที่เปิดค้างไว้
+  ไม่ต้องรอ cold start ทุกไฟล์; ถ้าไม่มี uno จะรัน soffice --convert-to ด้วย profile ของ slot แทน
+- มี timeout ต่องาน, health check ก่อนใช้ slot, recycle หลังแปลงครบ LIBREOFFICE_MAX_JOBS และ metrics
+- profile และ UNO pipe แยกตาม pid ของ process หลาย process (uvicorn --workers, celery) ในเครื่องเดียวกันจึงไม่ชนกัน
+  (ใช้ named pipe แทน TCP port ไม่ต้องจอง port และไม่มีทางต่อผิดไปที่ soffice ของ process อื่น)
+"""
+import atexit
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# python3-uno ของ Debian อยู่นอก site-packages ของ python ที่ใช้รันแอป
+for _p in os.getenv("LIBREOFFICE_PYTHONPATH", "").split(os.pathsep):
+    if _p and _p not in sys.path:
+        sys.path.append(_p)
+
+try:
+    import uno  # type: ignore
+    from com.sun.star.beans import PropertyValue  # type: ignore
+    UNO_IMPORT_ERROR = None
+except Exception as e:
+    uno = None
+    UNO_IMPORT_ERROR = f"{type(e).__name__}: {e}"
+
+LIBREOFFICE_BIN = os.getenv("LIBREOFFICE_BIN", "soffice")
+POOL_SIZE = int(os.getenv("LIBREOFFICE_POOL_SIZE", "2"))
+
+# มี soffice แต่ import uno ไม่ได้ (เช่น python3-uno ไม่ตรงกับเวอร์ชัน python) pool ยังใช้ได้แต่ช้าลงมาก ต้องเห็นใน log
+if POOL_SIZE > 0 and uno is None and shutil.which(LIBREOFFICE_BIN) is not None:
+    print(
+        f"WARNING: LibreOffice pool falls back to one soffice subprocess per conversion; "
+        f"cannot import uno with Python {sys.version_info.major}.{sys.version_info.minor} ({UNO_IMPORT_ERROR})"
+    )
+MAX_JOBS = int(os.getenv("LIBREOFFICE_MAX_JOBS", "200"))           # recycle process หลังแปลงครบจำนวนนี้
+JOB_TIMEOUT = float(os.getenv("LIBREOFFICE_TIMEOUT", "60"))         # วินาทีต่อไฟล์
+QUEUE_TIMEOUT = float(os.getenv("LIBREOFFICE_QUEUE_TIMEOUT", "30"))  # รอ slot ว่างได้นานสุด
+START_TIMEOUT = float(os.getenv("LIBREOFFICE_START_TIMEOUT", "30"))
+PROFILE_ROOT = Path(os.getenv("LIBREOFFICE_PROFILE_DIR", "/tmp/libreoffice-pool"))
+
+
+class ConverterBusy(RuntimeError):
+    """ไม่มี slot ว่างภายในเวลาที่กำหนด"""
+
+
+def _props(**kwargs):
+    result = []
+    for name, value in kwargs.items():
+        p = PropertyValue()
+        p.Name = name
+        p.Value = value
+        result.append(p)
+    return tuple(result)
+
+
+class _Slot:
+    """soffice หนึ่ง process พร้อม profile ของตัวเอง"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: subprocess.Popen | None = None
+        self.desktop = None
+        self.jobs = 0
+
+    @property
+    def profile(self) -> Path:
+        # pid ตอนใช้งาน (ไม่ใช่ตอนสร้าง pool) เผื่อ process ถูก fork หลัง import
+        return PROFILE_ROOT / f"{os.getpid()}-slot-{self.index}"
+
+    @property
+    def pipe_name(self) -> str:
+        return f"libreoffice-pool-{os.getpid()}-{self.index}"
+
+    @property
+    def profile_url(self) -> str:
+        return self.profile.resolve().as_uri()
+
+    def start(self):
+        self.profile.mkdir(parents=True, exist_ok=True)
+        self.jobs = 0
+        if uno is None:
+            return  # โหมด fallback ไม่มี process ค้าง
+        self.process = subprocess.Popen(
+            [
+                LIBREOFFICE_BIN, "--headless", "--invisible", "--nologo", "--norestore",
+                "--nodefault", "--nolockcheck",
+                f"-env:UserInstallation={self.profile_url}",
+                f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local_ctx)
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+                return
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"LibreOffice slot {self.index} failed to start")
+                time.sleep(0.2)
+
+    def stop(self):
+        self.desktop = None
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def remove_profile(self):
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+    def healthy(self) -> bool:
+        if uno is None:
+            return True
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def convert(self, in_path: Path, out_dir: Path) -> Path:
+        out_path = out_dir / f"{in_path.stem}.pdf"
+        if uno is None:
+            res = subprocess.run(
+                [
+                    LIBREOFFICE_BIN, "--headless", "--norestore",
+                    f"-env:UserInstallation={self.profile_url}",
+                    "--convert-to", "pdf", "--outdir", str(out_dir), str(in_path),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=JOB_TIMEOUT,
+            )
+            if res.returncode != 0:
+                raise RuntimeError(f"LibreOffice convert failed: {res.stderr.decode('utf-8', 'ignore')}")
+        else:
+            # ถ้าเกินเวลา kill process ทิ้ง การเรียก UNO ที่ค้างอยู่จะ error ออกมาเอง
+            timer = threading.Timer(JOB_TIMEOUT, self.stop)
+            timer.start()
+            try:
+                doc = self.desktop.loadComponentFromURL(in_path.resolve().as_uri(), "_blank", 0, _props(Hidden=True))
+                try:
+                    doc.storeToURL(out_path.resolve().as_uri(), _props(FilterName="writer_pdf_Export"))
+                finally:
+                    doc.close(True)
+            except Exception as e:
+                if not timer.is_alive():
+                    raise subprocess.TimeoutExpired(LIBREOFFICE_BIN, JOB_TIMEOUT)
+                raise RuntimeError(f"LibreOffice convert failed: {e}")
+            finally:
+                timer.cancel()
+        if not out_path.exists():
+            raise RuntimeError("PDF not generated from DOCX.")
+        self.jobs += 1
+        return out_path
+
+
+class LibreOfficePool:
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._idle: queue.Queue[_Slot] = queue.Queue()
+        self._all = [_Slot(i) for i in range(size)]
+        self._started: set[int] = set()
+        self._lock = threading.Lock()
+        self.metrics = {
+            "mode": "uno" if uno is not None else "subprocess",
+            "uno_error": UNO_IMPORT_ERROR,
+            "pool_size": size,
+            "jobs": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "restarts": 0,
+            "busy_rejections": 0,
+            "waiting": 0,
+            "total_seconds": 0.0,
+        }
+        for slot in self._all:
+            self._idle.put(slot)
+
+    def _count(self, key: str, value=1):
+        with self._lock:
+            self.metrics[key] += value
+
+    def _prepare(self, slot: _Slot):
+        """start ครั้งแรก / health check / recycle ก่อนใช้ slot"""
+        if slot.index not in self._started:
+            slot.start()
+            self._started.add(slot.index)
+        elif slot.jobs >= MAX_JOBS or not slot.healthy():
+            slot.restart()
+            self._count("restarts")
+
+    def convert(self, in_path: Path, out_dir: Path) -> Path:
+        """แปลงไฟล์เป็น PDF ด้วย slot ที่ว่าง คืน path ของ PDF ใน out_dir"""
+        self._count("waiting")
+        try:
+            slot = self._idle.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            self._count("busy_rejections")
+            raise ConverterBusy("All LibreOffice workers are busy")
+        finally:
+            self._count("waiting", -1)
+
+        started = time.monotonic()
+        try:
+            self._prepare(slot)
+            result = slot.convert(in_path, out_dir)
+            self._count("jobs")
+            return result
+        except subprocess.TimeoutExpired:
+            self._count("timeouts")
+            self._count("failures")
+            slot.stop()
+            self._started.discard(slot.index)  # start ใหม่ตอนใช้ครั้งถัดไป
+            raise RuntimeError(f"LibreOffice conversion timed out after {JOB_TIMEOUT:.0f}s")
+        except Exception:
+            self._count("failures")
+            if not slot.healthy():
+                slot.stop()
+                self._started.discard(slot.index)
+            raise
+        finally:
+            self._count("total_seconds", time.monotonic() - started)
+            self._idle.put(slot)
+
+    def get_metrics(self) -> dict:
+        with self._lock:
+            result = dict(self.metrics)
+        done = result["jobs"] + result["failures"]
+        result["avg_seconds"] = round(result["total_seconds"] / done, 3) if done else None
+        result["idle"] = self._idle.qsize()
+        result["slots"] = [
+            {"index": s.index, "started": s.index in self._started, "jobs": s.jobs,
+             "alive": s.process is not None and s.process.poll() is None}
+            for s in self._all
+        ]
+        return result
+
+    def shutdown(self):
+        for slot in self._all:
+            slot.stop()
+            slot.remove_profile()
+
+
+_pool: LibreOfficePool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_libreoffice_pool() -> LibreOfficePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if shutil.which(LIBREOFFICE_BIN) is None:
+                raise RuntimeError(f"LibreOffice executable '{LIBREOFFICE_BIN}' not found")
+            _pool = LibreOfficePool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def get_converter_metrics() -> dict:
+    return _pool.get_metrics() if _pool is not None else {"pool_size": POOL_SIZE, "started": False}
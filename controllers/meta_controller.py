@@ -7,7 +7,9 @@ from typing import Optional, Tuple
 from fuzzywuzzy import fuzz, process
 from sqlalchemy.orm import Session
 
+from database import SessionLocal
 from models import Meta, Faction, Type
+from controllers.similarity_controller import suggest_related
 
 
 try:
@@ -231,13 +233,17 @@ def extract_metadata(ocr_text: str, db: Session):
         sorted_keywords = sorted(filtered, key=lambda w: freq_dict[w], reverse=True)
         keyword_list = sorted_keywords[:8]
 
+        # 9. เอกสารซ้ำ/เอกสารที่เกี่ยวข้อง จาก LSH index
+        similar = suggest_related(db, ocr_text)
+
         return {
             "factionName": faction_name,
             "typeName": type_name,
             "publishedDate": pub_date,
             "effectiveDate": eff_date,
             "keyword": keyword_list,
-            "relateDoc": []
+            "relateDoc": [d["docName"] for d in similar["related"]],
+            "duplicates": similar["duplicates"]
         }
 
     except Exception as e:
@@ -246,6 +252,17 @@ def extract_metadata(ocr_text: str, db: Session):
 
 
 # ------------------ ฟังก์ชันบันทึกลง DB ------------------ #
+def extract_metadata_own_session(ocr_text: str):
+    """
+    สำหรับรันใน thread ของ cpu_executor: เปิด Session ของตัวเอง
+    (Session ของ request ถูกปิดเมื่อ request timeout ขณะที่ thread นี้อาจยังใช้อยู่ และ Session ใช้ข้าม thread ไม่ได้)
+    """
+    db = SessionLocal()
+    try:
+        return extract_metadata(ocr_text, db)
+    finally:
+        db.close()
+
 def save_metadata_to_db(db: Session, meta_data: dict):
     new_meta = Meta(
         factionName=meta_data["factionName"],
@@ -0,0 +1,168 @@
+"""
+Cache ผล OCR ใน Redis เพื่อไม่ต้องจ่ายค่า typhoon OCR ซ้ำเมื่ออัปโหลดไฟล์เดิม
+- ระดับเอกสาร: key = SHA-256 ของไฟล์ เก็บผล OCR ที่ format แล้ว (อัปโหลดซ้ำได้ผลทันที)
+- ระดับหน้า: key = SHA-256 ของภาพหน้าที่ render แล้ว เก็บข้อความของหน้านั้น
+  (แก้ไฟล์แค่หน้าเดียว จะ OCR ใหม่เฉพาะหน้านั้น)
+- จำกัดขนาดรวมด้วย OCR_CACHE_MAX_BYTES ลบ entry ที่ใช้ล่าสุดนานที่สุดออกก่อน (LRU)
+- นับ hit/miss ไว้ดูที่ /ocr/cache/stats
+- key ทุกระดับต่อท้ายด้วย fingerprint ของค่าตั้งที่มีผลต่อข้อความ (ocr_settings_controller)
+  เปลี่ยน DPI/format ภาพ/preprocess/text layer/ข้ามหน้าว่าง แล้วจะไม่ได้ผลเก่ากลับมา
+- checkpoint: ผล OCR รายหน้าของไฟล์ที่ยัง OCR ไม่จบ (key = SHA-256 ของไฟล์, หมดอายุตาม OCR_CHECKPOINT_TTL)
+  task ที่ถูกส่งซ้ำหรือ worker ตายกลางทาง จะทำต่อจากหน้าที่ยังไม่มีผล ไม่ต้อง OCR ใหม่ทั้งไฟล์
+"""
+import hashlib
+import os
+import time
+import urllib.parse
+
+from dotenv import load_dotenv
+from redis import Redis
+
+from controllers.ocr_settings_controller import DOCUMENT_FINGERPRINT, PAGE_FINGERPRINT
+
+load_dotenv()
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+r = Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# เปลี่ยนค่านี้เมื่อวิธี OCR เปลี่ยน (เช่น model/prompt) เพื่อไม่ใช้ผลเก่า
+OCR_CACHE_VERSION = os.getenv("OCR_CACHE_VERSION", "1")
+OCR_CHECKPOINT_TTL = int(os.getenv("OCR_CHECKPOINT_TTL", str(24 * 3600)))
+
+PREFIX = f"ocr:cache:v{OCR_CACHE_VERSION}"
+LRU_KEY = f"{PREFIX}:lru"      # zset: key -> เวลาที่ใช้ล่าสุด
+SIZE_KEY = f"{PREFIX}:sizes"   # hash: key -> ขนาด (bytes)
+TOTAL_KEY = f"{PREFIX}:bytes"  # ขนาดรวมทั้งหมด
+STATS_KEY = f"{PREFIX}:stats"  # hash: doc_hit, doc_miss, page_hit, page_miss
+
+
+# เขียน entry พร้อมอัปเดตขนาดรวมแบบ atomic (อ่านขนาดเดิมนอก transaction แล้วเขียนซ้อนกันจะทำให้ TOTAL_KEY เพี้ยน)
+# KEYS: entry, SIZE_KEY, LRU_KEY, TOTAL_KEY  ARGV: value, size, now  คืนขนาดรวมใหม่
+_PUT = r.register_script("""
+local old_size = tonumber(redis.call('HGET', KEYS[2], KEYS[1]) or '0')
+redis.call('SET', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], KEYS[1], ARGV[2])
+redis.call('ZADD', KEYS[3], ARGV[3], KEYS[1])
+return redis.call('INCRBY', KEYS[4], tonumber(ARGV[2]) - old_size)
+""")
+
+# ลบ entry ที่ใช้ล่าสุดนานที่สุด ARGV[1] รายการแบบ atomic
+# KEYS: SIZE_KEY, LRU_KEY, TOTAL_KEY  คืน {ขนาดรวมใหม่, จำนวนที่ลบ}
+_EVICT = r.register_script("""
+local oldest = redis.call('ZPOPMIN', KEYS[2], ARGV[1])
+local freed, count = 0, 0
+for i = 1, #oldest, 2 do
+    local key = oldest[i]
+    freed = freed + tonumber(redis.call('HGET', KEYS[1], key) or '0')
+    redis.call('DEL', key)
+    redis.call('HDEL', KEYS[1], key)
+    count = count + 1
+end
+return {redis.call('INCRBY', KEYS[3], -freed), count}
+""")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _get(kind: str, digest: str) -> str | None:
+    if not OCR_CACHE_ENABLED:
+        return None
+    key = f"{PREFIX}:{kind}:{digest}"
+    try:
+        value = r.get(key)
+        r.hincrby(STATS_KEY, f"{kind}_{'hit' if value is not None else 'miss'}", 1)
+        if value is not None:
+            r.zadd(LRU_KEY, {key: time.time()})
+        return value
+    except Exception as e:
+        # cache ใช้ไม่ได้ไม่ควรทำให้ OCR ล้ม
+        print(f"OCR cache read failed: {e}")
+        return None
+
+
+def _put(kind: str, digest: str, value: str):
+    if not OCR_CACHE_ENABLED:
+        return
+    key = f"{PREFIX}:{kind}:{digest}"
+    size = len(value.encode("utf-8"))
+    if size > OCR_CACHE_MAX_BYTES:
+        return
+    try:
+        total = _PUT(keys=[key, SIZE_KEY, LRU_KEY, TOTAL_KEY], args=[value, size, time.time()])
+        if total > OCR_CACHE_MAX_BYTES:
+            _evict(total)
+    except Exception as e:
+        print(f"OCR cache write failed: {e}")
+
+
+def _evict(total: int):
+    """ลบ entry ที่ไม่ได้ใช้นานที่สุดจนขนาดรวมไม่เกิน OCR_CACHE_MAX_BYTES"""
+    while total > OCR_CACHE_MAX_BYTES:
+        total, count = _EVICT(keys=[SIZE_KEY, LRU_KEY, TOTAL_KEY], args=[32])
+        if not count:
+            break
+        r.hincrby(STATS_KEY, "evictions", count)
+
+
+def get_document_result(file_hash: str) -> str | None:
+    return _get("doc", f"{file_hash}:{DOCUMENT_FINGERPRINT}")
+
+
+def put_document_result(file_hash: str, ocr_format: str):
+    _put("doc", f"{file_hash}:{DOCUMENT_FINGERPRINT}", ocr_format)
+
+
+def get_page_text(page_hash: str) -> str | None:
+    return _get("page", f"{page_hash}:{PAGE_FINGERPRINT}")
+
+
+def put_page_text(page_hash: str, text: str):
+    _put("page", f"{page_hash}:{PAGE_FINGERPRINT}", text)
+
+
+def _checkpoint_key(file_hash: str) -> str:
+    return f"{PREFIX}:checkpoint:{file_hash}:{DOCUMENT_FINGERPRINT}"
+
+
+def load_checkpoint(file_hash: str) -> dict[int, str]:
+    """ผล OCR ของหน้าที่ทำเสร็จแล้ว {page_number: text}"""
+    try:
+        return {int(k): v for k, v in r.hgetall(_checkpoint_key(file_hash)).items()}
+    except Exception as e:
+        print(f"OCR checkpoint read failed: {e}")
+        return {}
+
+
+def save_checkpoint(file_hash: str, page_number: int, text: str) -> int:
+    """บันทึกผลของหน้า คืนจำนวนหน้าที่มีผลแล้วทั้งหมด"""
+    key = _checkpoint_key(file_hash)
+    pipe = r.pipeline()
+    pipe.hset(key, page_number, text)
+    pipe.expire(key, OCR_CHECKPOINT_TTL)
+    pipe.hlen(key)
+    return pipe.execute()[-1]
+
+
+def checkpoint_count(file_hash: str) -> int:
+    return r.hlen(_checkpoint_key(file_hash))
+
+
+def clear_checkpoint(file_hash: str):
+    r.delete(_checkpoint_key(file_hash))
+
+
+def get_cache_stats() -> dict:
+    stats = {k: int(v) for k, v in r.hgetall(STATS_KEY).items()}
+    for kind in ("doc", "page"):
+        hit, miss = stats.get(f"{kind}_hit", 0), stats.get(f"{kind}_miss", 0)
+        stats[f"{kind}_hit_ratio"] = round(hit / (hit + miss), 3) if hit + miss else None
+    stats["entries"] = r.zcard(LRU_KEY)
+    stats["bytes"] = int(r.get(TOTAL_KEY) or 0)
+    stats["max_bytes"] = OCR_CACHE_MAX_BYTES
+    stats["enabled"] = OCR_CACHE_ENABLED
+    return stats
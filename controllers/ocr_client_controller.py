@@ -0,0 +1,265 @@
+"""
+เรียก typhoon OCR API ตรงๆ ด้วยภาพที่อยู่ในหน่วยความจำ
+- ไม่ต้องเขียนไฟล์ชั่วคราวให้ typhoon_ocr.ocr_document อ่านกลับ แล้ว decode/encode ภาพซ้ำ
+- pixmap ของ PyMuPDF ถูก encode ครั้งเดียวเป็น PNG/JPEG/WebP ตาม OCR_IMAGE_FORMAT
+  (ค่าเริ่มต้น PNG ไม่เสียรายละเอียด jpeg/webp ย่อ payload แต่ยังไม่ได้วัดผลต่อความแม่นของ OCR ต้องเลือกเอง)
+- จำกัดอัตราเรียก API ทั้ง cluster ด้วย token bucket ใน Redis (OCR_RATE_PER_SECOND, OCR_RATE_BURST)
+  และจำนวน request ที่ค้างอยู่พร้อมกัน (OCR_MAX_IN_FLIGHT) ทุก worker ใช้โควตาร่วมกัน
+- error ชั่วคราว (429, 5xx, timeout, ต่อไม่ได้) retry แบบ exponential backoff + jitter
+- OCR_ENGINE=stub ใช้ engine จำลอง (ไม่เรียก API) สำหรับ load test แบบ offline
+"""
+import base64
+import io
+import json
+import os
+import random
+import time
+import urllib.parse
+import uuid
+from contextlib import contextmanager
+
+import openai
+from dotenv import load_dotenv
+from openai import OpenAI
+from PIL import Image
+from redis import Redis
+from typhoon_ocr.ocr_utils import get_prompt
+
+load_dotenv()
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+r = Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+
+OCR_DPI = int(os.getenv("OCR_DPI", "144"))                        # 144 dpi = Matrix(2, 2) แบบเดิม
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "png").lower()   # png (lossless), หรือเลือก jpeg/webp เอง
+OCR_IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "85"))     # ใช้กับ jpeg/webp
+TYPHOON_BASE_URL = os.getenv("TYPHOON_BASE_URL", "https://api.opentyphoon.ai/v1")
+TYPHOON_MODEL = os.getenv("TYPHOON_OCR_MODEL", "typhoon-ocr-preview")
+TYPHOON_API_KEY = (
+    os.getenv("TYPHOON_OCR_API_KEY")
+    or os.getenv("TYPHOON_OCR_API_KEYS")
+    or os.getenv("TYPHOON_API_KEY")
+    or os.getenv("OPENAI_API_KEY")
+)
+
+OCR_ENGINE = os.getenv("OCR_ENGINE", "typhoon").lower()           # typhoon หรือ stub
+OCR_RATE_PER_SECOND = float(os.getenv("OCR_RATE_PER_SECOND", "2"))  # 0 = ไม่จำกัด
+OCR_RATE_BURST = int(os.getenv("OCR_RATE_BURST", "5"))
+OCR_MAX_IN_FLIGHT = int(os.getenv("OCR_MAX_IN_FLIGHT", "4"))        # 0 = ไม่จำกัด
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", "5"))
+OCR_BACKOFF_BASE = float(os.getenv("OCR_BACKOFF_BASE", "1"))        # วินาที
+OCR_BACKOFF_MAX = float(os.getenv("OCR_BACKOFF_MAX", "60"))
+OCR_REQUEST_TIMEOUT = float(os.getenv("OCR_REQUEST_TIMEOUT", "120"))
+OCR_STUB_LATENCY = float(os.getenv("OCR_STUB_LATENCY", "1.5"))      # วินาทีต่อหน้าของ engine จำลอง
+OCR_STUB_ERROR_RATE = float(os.getenv("OCR_STUB_ERROR_RATE", "0"))  # สัดส่วนที่จำลอง 429
+
+BUCKET_KEY = "ocr:client:bucket"
+IN_FLIGHT_KEY = "ocr:client:in_flight"
+STATS_KEY = "ocr:client:stats"
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+_client: OpenAI | None = None
+
+
+def get_client() -> OpenAI:
+    global _client
+    if _client is None:
+        # retry เองด้านล่าง (ต้องผ่าน rate limit ทุกครั้ง) จึงปิด retry ของ SDK
+        _client = OpenAI(base_url=TYPHOON_BASE_URL, api_key=TYPHOON_API_KEY, max_retries=0, timeout=OCR_REQUEST_TIMEOUT)
+    return _client
+
+
+def encode_pixmap(pix, image_format: str = OCR_IMAGE_FORMAT, quality: int = OCR_IMAGE_QUALITY) -> tuple[bytes, str]:
+    """pixmap -> bytes ของภาพที่ส่ง OCR (encode ครั้งเดียว) คืน (data, mime)"""
+    if image_format == "png":
+        return pix.tobytes("png"), MIME_TYPES["png"]
+    # JPEG/WebP: ให้ PIL อ่าน buffer ของ pixmap ตรงๆ (ไม่ copy) แล้ว encode
+    # libjpeg ของ PIL เร็วกว่า pix.tobytes("jpeg") หลายเท่า และ PyMuPDF ไม่มี WebP
+    mode = "RGB" if pix.n == 3 else "L" if pix.n == 1 else "RGBA"
+    img = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+    return encode_image(img, image_format, quality)
+
+
+def encode_image(img: Image.Image, image_format: str = OCR_IMAGE_FORMAT, quality: int = OCR_IMAGE_QUALITY) -> tuple[bytes, str]:
+    """PIL image -> bytes ของภาพที่ส่ง OCR คืน (data, mime)"""
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported OCR_IMAGE_FORMAT: {image_format}")
+    if img.mode not in ("RGB", "L") and not (img.mode == "1" and image_format == "png"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    if image_format == "png":
+        img.save(buf, format="PNG")
+    else:
+        img.save(buf, format=image_format.upper(), quality=quality)
+    return buf.getvalue(), MIME_TYPES[image_format]
+
+
+# token bucket: คืน 0 ถ้าได้ token ไม่งั้นคืนเวลาที่ต้องรอ (ms)
+_TAKE_TOKEN = r.register_script("""
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+""")
+
+# semaphore ทั้ง cluster: ZSET ของ request id -> เวลาหมดอายุ (กัน worker ตายแล้วไม่คืน)
+_ENTER = r.register_script("""
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[4])
+    return 1
+end
+return 0
+""")
+
+
+class TransientOCRError(RuntimeError):
+    """error ที่ลองใหม่ได้ (ใช้โดย engine จำลอง)"""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+TRANSIENT_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    TransientOCRError,
+)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _wait_for_token():
+    if OCR_RATE_PER_SECOND <= 0:
+        return
+    while True:
+        wait_ms = _TAKE_TOKEN(keys=[BUCKET_KEY], args=[OCR_RATE_PER_SECOND, OCR_RATE_BURST, _now_ms()])
+        if not wait_ms:
+            return
+        r.hincrby(STATS_KEY, "throttled_ms", wait_ms)
+        time.sleep(wait_ms / 1000 * random.uniform(1, 1.2))
+
+
+@contextmanager
+def _in_flight_slot():
+    if OCR_MAX_IN_FLIGHT <= 0:
+        yield
+        return
+    request_id = uuid.uuid4().hex
+    lease_ms = int((OCR_REQUEST_TIMEOUT + 30) * 1000)
+    while not _ENTER(keys=[IN_FLIGHT_KEY], args=[_now_ms(), OCR_MAX_IN_FLIGHT, lease_ms, request_id]):
+        time.sleep(random.uniform(0.1, 0.3))
+    try:
+        yield
+    finally:
+        r.zrem(IN_FLIGHT_KEY, request_id)
+
+
+def _retry_after(e: Exception) -> float | None:
+    """อ่าน Retry-After จาก response ของ API (ถ้ามี)"""
+    if isinstance(e, TransientOCRError):
+        return e.retry_after
+    response = getattr(e, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int, retry_after: float | None) -> float:
+    """full jitter: สุ่มระหว่าง 0 ถึง base * 2^attempt (ไม่เกิน OCR_BACKOFF_MAX) แต่ไม่น้อยกว่า Retry-After"""
+    delay = random.uniform(0, min(OCR_BACKOFF_MAX, OCR_BACKOFF_BASE * (2 ** attempt)))
+    return max(delay, retry_after or 0)
+
+
+def _stub_ocr(data: bytes, width: int, height: int) -> str:
+    """engine จำลอง: หน่วงเวลาเหมือนเรียก API และสุ่ม 429 ตาม OCR_STUB_ERROR_RATE"""
+    time.sleep(random.uniform(0.5, 1.5) * OCR_STUB_LATENCY)
+    if random.random() < OCR_STUB_ERROR_RATE:
+        raise TransientOCRError("stub rate limited (429)", retry_after=None)
+    return f"[stub OCR {width}x{height}, {len(data)} bytes]"
+
+
+def _call_engine(data: bytes, mime: str, width: int, height: int, task_type: str) -> str:
+    if OCR_ENGINE == "stub":
+        return _stub_ocr(data, width, height)
+    return _typhoon_ocr(data, mime, width, height, task_type)
+
+
+def ocr_image_bytes(data: bytes, mime: str, width: int, height: int, task_type: str = "default") -> str:
+    """OCR ภาพหนึ่งหน้า ผ่าน rate limit / in-flight limit ของทั้ง cluster และ retry เมื่อ error ชั่วคราว"""
+    attempt = 0
+    while True:
+        _wait_for_token()
+        try:
+            with _in_flight_slot():
+                r.hincrby(STATS_KEY, "requests", 1)
+                return _call_engine(data, mime, width, height, task_type)
+        except TRANSIENT_ERRORS as e:
+            if attempt >= OCR_MAX_RETRIES:
+                r.hincrby(STATS_KEY, "failures", 1)
+                raise
+            delay = _backoff(attempt, _retry_after(e))
+            print(f"OCR request failed ({type(e).__name__}), retry {attempt + 1}/{OCR_MAX_RETRIES} in {delay:.1f}s")
+            r.hincrby(STATS_KEY, "retries", 1)
+            time.sleep(delay)
+            attempt += 1
+
+
+def get_client_stats() -> dict:
+    stats = {k: int(v) for k, v in r.hgetall(STATS_KEY).items()}
+    stats["in_flight"] = r.zcount(IN_FLIGHT_KEY, _now_ms(), "+inf")
+    stats.update({
+        "engine": OCR_ENGINE,
+        "rate_per_second": OCR_RATE_PER_SECOND,
+        "burst": OCR_RATE_BURST,
+        "max_in_flight": OCR_MAX_IN_FLIGHT,
+    })
+    return stats
+
+
+def _typhoon_ocr(data: bytes, mime: str, width: int, height: int, task_type: str) -> str:
+    """ส่งภาพหนึ่งหน้าให้ typhoon OCR คืน markdown (prompt เดียวกับ typhoon_ocr.ocr_document)"""
+    anchor_text = f"Page dimensions: {float(width):.1f}x{float(height):.1f}\n[Image 0x0 to {width:.0f}x{height:.0f}]\n"
+    image_b64 = base64.b64encode(data).decode("ascii")
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": get_prompt(task_type)(anchor_text)},
+                {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_b64}"}},
+            ],
+        }
+    ]
+    response = get_client().chat.completions.create(
+        model=TYPHOON_MODEL,
+        messages=messages,
+        max_tokens=16384,
+        extra_body={
+            "repetition_penalty": 1.2,
+            "temperature": 0.1,
+            "top_p": 0.6,
+        },
+    )
+    return json.loads(response.choices[0].message.content)["natural_text"]
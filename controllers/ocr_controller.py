@@ -1,13 +1,16 @@
 import os
-import io
 import cv2
 import re
 import fitz  # PyMuPDF
-import thaispellcheck
 import numpy as np
 import tempfile
 import os
 import urllib.parse
+import queue
+import resource
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 # import pandas as pd
 # import ollama
 # import pytesseract
@@ -15,12 +18,45 @@ from celery.exceptions import Ignore
 from io import BytesIO
 from PIL import Image
 from bs4 import BeautifulSoup
-from tempfile import NamedTemporaryFile
 from fastapi import UploadFile
 from dotenv import load_dotenv
-from typhoon_ocr import ocr_document
-from celery import Celery
+from celery import Celery, chord
 from redis import Redis
+from controllers.ocr_client_controller import OCR_DPI, encode_image, encode_pixmap, ocr_image_bytes
+from controllers.spellcheck_controller import check_html
+from controllers.preprocess_controller import OCR_PREPROCESS, encode_preprocessed, preprocess_page
+from controllers.ocr_settings_controller import (
+    BLANK_CHECK_DPI,
+    BLANK_MIN_GLYPHS,
+    BLANK_MIN_INK,
+    OCR_SKIP_BLANK_PAGES,
+    TEXT_LAYER_MAX_GARBAGE,
+    TEXT_LAYER_MIN_CHARS,
+    TEXT_LAYER_MIN_COVERAGE,
+    USE_TEXT_LAYER,
+)
+from controllers.ocr_queue_controller import (
+    OCR_CHORD_STALE_SECONDS,
+    OCR_SLOT_RETRY_SECONDS,
+    acquire_job_slot,
+    choose_lane,
+    hold_job_slot,
+    release_job_slot,
+    start_slot_heartbeat,
+)
+from controllers.progress_controller import publish_page, publish_progress, report_state
+from controllers.staging_controller import delete_staged, open_staged_pdf, read_staged, stage_upload, staged_hash, upload_hash
+from controllers.ocr_cache_controller import (
+    checkpoint_count,
+    clear_checkpoint,
+    content_hash,
+    get_document_result,
+    load_checkpoint,
+    save_checkpoint,
+    get_page_text,
+    put_document_result,
+    put_page_text,
+)
 
 # from pytesseract import Output
 # from fitz import TextWriter
@@ -31,8 +67,32 @@ load_dotenv()
 redis_url = os.getenv("REDIS_URL")
 url = urllib.parse.urlparse(redis_url)
 
-celery_app = Celery("worker", broker=redis_url, backend=redis_url)
+celery_app = Celery("worker", broker=redis_url, backend=redis_url, include=["controllers.wiki_controller"])
+# รับงานทีละชิ้น ไม่ให้ worker จองงานใหญ่ค้างไว้ในมือขณะที่คิว interactive มีงานรอ
+celery_app.conf.worker_prefetch_multiplier = 1
+# task OCR ack หลังทำเสร็จ (acks_late) ถ้า worker ตายงานจะกลับเข้าคิวแล้วทำต่อจาก checkpoint
+# visibility_timeout ต้องนานกว่างานที่ยาวที่สุด ไม่งั้น Redis จะส่งงานที่ยังรันอยู่ให้ worker อื่นซ้ำ
+celery_app.conf.broker_transport_options = {"visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", str(6 * 3600)))}
+# memory watchdog: child process ที่ RSS เกินค่านี้ (KB) หลังจบ task จะถูกแทนด้วย process ใหม่ (0 = ปิด)
+celery_app.conf.worker_max_memory_per_child = int(os.getenv("CELERY_MAX_MEMORY_PER_CHILD", str(1536 * 1024))) or None
 r = Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+
+# แบ่ง PDF ที่มีหน้ามากเป็นช่วงหน้า แล้วกระจายให้ worker หลายตัว OCR พร้อมกัน (Celery chord)
+OCR_PARALLEL_MIN_PAGES = int(os.getenv("OCR_PARALLEL_MIN_PAGES", "8"))  # 0 = ปิด ทำทีละหน้าใน task เดียว
+OCR_CHUNK_PAGES = int(os.getenv("OCR_CHUNK_PAGES", "4"))
+OCR_STATE_TTL = 3600
+
+# ส่งข้อความรายหน้าไปที่ websocket ทันทีที่หน้านั้นเสร็จ ให้เริ่มตรวจหน้าแรกๆ ได้ก่อนทั้งไฟล์เสร็จ
+OCR_STREAM_PAGES = os.getenv("OCR_STREAM_PAGES", "true").lower() == "true"
+
+# render หน้าถัดไปซ้อนกับการรอ OCR: จำนวน request OCR ที่ค้างพร้อมกันต่อ task และจำนวนภาพที่ render รอไว้
+OCR_PIPELINE_WORKERS = max(1, int(os.getenv("OCR_PIPELINE_WORKERS", "3")))
+OCR_RENDER_AHEAD = max(1, int(os.getenv("OCR_RENDER_AHEAD", "2")))
+
+# PDF หลายร้อยหน้า: คืน cache ของ MuPDF ทุกๆ OCR_WINDOW_PAGES หน้า และเขียนข้อความรายหน้าลงไฟล์ชั่วคราว
+# เมื่อเกิน OCR_SPOOL_MAX_BYTES แทนการต่อ string ไว้ใน memory
+OCR_WINDOW_PAGES = max(1, int(os.getenv("OCR_WINDOW_PAGES", "16")))
+OCR_SPOOL_MAX_BYTES = int(os.getenv("OCR_SPOOL_MAX_BYTES", str(1024 * 1024)))
 # client = ollama.Client()
 # model = "scb10x/llama3.1-typhoon2-8b-instruct"
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
@@ -47,9 +107,9 @@ r = Redis(host=url.hostname, port=url.port, password=url.password, decode_respon
 #     return response.response
 
 def find_misspelled_words(text:str):
-    """ ตรวจสอบคำผิดจากข้อความ OCR """
+    """ ตรวจสอบคำผิดจากข้อความ OCR (เฉพาะ text node, cache รายบรรทัด: spellcheck_controller) """
     # thaispellcheck.check(text, autocorrect=True) เเบบเเก้คำผิดอัตโนมัติ
-    return thaispellcheck.check(text) 
+    return check_html(text)
 
 def correct_text(text:str):  #เเก้คำที่ผิดบ่อย ทำมือ
     correct_text = re.sub(r'[ก-๙]\.ศ', 'พ.ศ', text) 
@@ -83,134 +143,464 @@ def format_ocr_result(ocr_result:str):
     ocr_format = find_misspelled_words(ocr_format)
     return ocr_format
 
-def process_image_to_text(page, img, page_width, page_height):
+def process_image_to_text(data:bytes, mime:str, width:int, height:int):
+    """OCR ภาพหนึ่งหน้า (bytes ที่ encode แล้ว) ส่งตรงไป typhoon ไม่ผ่านไฟล์ชั่วคราว"""
+    ocr_text = ocr_image_bytes(data, mime, width, height)
+    return ocr_text + '\n\n'
+
+def _is_garbage_char(ch:str) -> bool:
+    """ตัวอักษรที่บอกว่า text layer เพี้ยน: U+FFFD, control char, Private Use Area (ฟอนต์ไทยเก่าที่ map ผิด)"""
+    code = ord(ch)
+    return (
+        ch == '\ufffd'
+        or (code < 32 and ch not in '\n\t\r')
+        or 0xE000 <= code <= 0xF8FF
+    )
+
+def extract_text_layer(page):
+    """คืนข้อความจาก text layer ของหน้า ถ้าใช้แทน OCR ได้ ไม่งั้นคืน None
+    - ตัวอักษรต้องมีพอ (TEXT_LAYER_MIN_CHARS) และตัวเพี้ยนไม่เกิน TEXT_LAYER_MAX_GARBAGE
+    - หน้าที่เป็นภาพสแกนเกือบทั้งหน้าแต่มีข้อความนิดเดียว (เช่น หัวกระดาษ) ยังต้อง OCR
+    """
+    if not USE_TEXT_LAYER:
+        return None
+    text = page.get_text("text", sort=True).strip()
+    chars = [ch for ch in text if not ch.isspace()]
+    if len(chars) < TEXT_LAYER_MIN_CHARS:
+        return None
+    garbage = sum(1 for ch in chars if _is_garbage_char(ch)) / len(chars)
+    if garbage > TEXT_LAYER_MAX_GARBAGE:
+        return None
+
+    # ค่า default ของ "blocks" ไม่คืน image block ต้องเปิด TEXT_PRESERVE_IMAGES เอง
+    # วัดพื้นที่เฉพาะส่วนที่อยู่ในหน้า (ภาพสแกนมักล้นขอบ mediabox)
+    page_area = abs(page.rect) or 1
+    text_area = image_area = 0
+    for block in page.get_text("blocks", flags=fitz.TEXTFLAGS_BLOCKS | fitz.TEXT_PRESERVE_IMAGES):
+        area = abs(fitz.Rect(block[:4]) & page.rect)
+        if block[6] == 0:
+            text_area += area
+        else:
+            image_area += area
+    image_area = min(image_area, page_area)
+    if image_area / page_area > 0.5 and text_area / page_area < TEXT_LAYER_MIN_COVERAGE:
+        return None
+    return text
+
+def is_blank_page(page) -> bool:
+    """
+    หน้าที่ไม่มีข้อความให้ OCR ดูจากภาพ grayscale ความละเอียดต่ำ (BLANK_CHECK_DPI) ก่อน render เต็ม
+    - pixel แทบไม่แปรปรวน หรือหมึกน้อยกว่า BLANK_MIN_INK: หน้าว่าง
+    - connected component ขนาดตัวอักษรน้อยกว่า BLANK_MIN_GLYPHS: มีแต่ลายเซ็น/โลโก้/เส้นขอบ/จุดฝุ่น
+    ตัดขอบ 4% ทิ้งก่อน (เงาขอบกระดาษ รูเจาะ จากเครื่องสแกน)
+    """
+    pix = page.get_pixmap(dpi=BLANK_CHECK_DPI, colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    margin_y, margin_x = int(pix.height * 0.04), int(pix.width * 0.04)
+    gray = gray[margin_y:pix.height - margin_y, margin_x:pix.width - margin_x]
+    if gray.size == 0 or gray.std() < 4:
+        return True
+
+    ink = (gray < 128).astype(np.uint8)
+    if ink.mean() < BLANK_MIN_INK:
+        return True
+
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    # ตัวอักษรสูงไม่เกิน ~5% ของหน้า จุดเล็กกว่า 4 pixel คือฝุ่น
+    glyphs = np.count_nonzero((areas >= 4) & (heights >= 3) & (heights <= pix.height * 0.05))
+    return glyphs < BLANK_MIN_GLYPHS
+
+def render_pdf_page(page, preprocess=False):
+    """
+    เตรียมหน้าสำหรับ OCR: render หน้าจากเอกสารต้นฉบับโดยตรง (get_pixmap หมุนตาม rotation ของหน้าให้แล้ว
+    ได้ภาพเดียวกับการวาดลงเอกสารใหม่ทุก pixel โดยไม่ต้องสร้างเอกสารเงาทั้งไฟล์) แล้ว encode ภาพ
+    คืน (text, None) ถ้าได้ข้อความแล้ว (text layer / cache / หน้าว่างได้ '') หรือ (None, payload) ที่ต้องส่ง OCR
+    preprocess = True: render เป็น grayscale แล้วแก้เอียง/ตัดขอบ/ย่อ (preprocess_page) ก่อน encode
+    """
+    text = extract_text_layer(page)
+    if text is not None:
+        return text + '\n\n', None
+    if OCR_SKIP_BLANK_PAGES and is_blank_page(page):
+        return '', None
+
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False) if preprocess else page.get_pixmap(dpi=OCR_DPI)
+    # หน้าที่ภาพเหมือนเดิมทุก pixel ใช้ผล OCR เดิมได้เลย (ภาพ grayscale ได้ hash ต่างจากภาพสี ผลสองแบบจึงไม่ปนกัน)
+    # ค่า preprocess/encode ที่ใช้หลังจากนี้อยู่ใน key ด้วย (PAGE_FINGERPRINT ใน ocr_cache_controller)
+    page_hash = content_hash(pix.samples)
+    cached = get_page_text(page_hash)
+    if cached is not None:
+        return cached, None
+    if preprocess:
+        gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+        img = preprocess_page(gray)
+        data, mime = encode_preprocessed(img)
+        return None, (page_hash, data, mime, img.shape[1], img.shape[0])
+    data, mime = encode_pixmap(pix)
+    return None, (page_hash, data, mime, pix.width, pix.height)
+
+def ocr_rendered_page(payload):
+    page_hash, data, mime, width, height = payload
+    text = process_image_to_text(data, mime, width, height)
+    put_page_text(page_hash, text)
+    return text
+
+def _done_future(value=None, error=None) -> Future:
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+    return future
+
+def iter_ocr_pages(doc, page_numbers, checkpoint, preprocess=False):
+    """
+    render กับ OCR ทำงานซ้อนกันภายใน task เดียว คืน (page_number, text, restored) ตามลำดับหน้า
+    - thread render (thread เดียวที่แตะ doc) วาดหน้าล่วงหน้าแล้วส่ง OCR เข้า thread pool
+    - มี request OCR ค้างพร้อมกันได้ OCR_PIPELINE_WORKERS และภาพรอคิวไม่เกินขนาดคิว (จำกัดหน่วยความจำ)
+    - restored = True คือหน้าที่มีผลใน checkpoint อยู่แล้ว
+    - text ว่าง ('') คือหน้าว่างที่ข้ามไม่ส่ง OCR (ข้อความที่ OCR ได้จะลงท้ายด้วย '\n\n' เสมอ)
+    ต้องใช้จนจบหรือ close() ก่อนปิด doc (close จะรอ thread render หยุดก่อน)
+    """
+    pending = queue.Queue(maxsize=OCR_PIPELINE_WORKERS + OCR_RENDER_AHEAD)
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=OCR_PIPELINE_WORKERS, thread_name_prefix="ocr")
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.2)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for i, page_number in enumerate(page_numbers, 1):
+                if stop.is_set():
+                    return
+                if page_number in checkpoint:
+                    put((page_number, _done_future(checkpoint[page_number]), True))
+                    continue
+                text, payload = render_pdf_page(doc[page_number], preprocess)
+                future = _done_future(text) if payload is None else pool.submit(ocr_rendered_page, payload)
+                put((page_number, future, False))
+                if i % OCR_WINDOW_PAGES == 0:
+                    # ฟอนต์/ภาพที่ MuPDF cache ไว้จากหน้าก่อนๆ ไม่ต้องใช้แล้ว
+                    fitz.TOOLS.store_shrink(100)
+        except Exception as e:
+            put((None, _done_future(error=e), False))
+        finally:
+            put(None)
+
+    producer = threading.Thread(target=produce, name="ocr-render", daemon=True)
+    producer.start()
     try:
-        img_arr = np.array(img)
-        img_arr = cv2.cvtColor(img_arr, cv2.COLOR_BGR2GRAY)
-        img_arr = cv2.medianBlur(img_arr, 3)
-
-        with NamedTemporaryFile(delete=True, suffix=".png") as tmp:
-            temp_path = tmp.name
-            tmp.close()
-            img.save(temp_path)
-            # Process a specific page from a PDF
-            markdown = ocr_document(
-                pdf_or_image_path=temp_path,
-                task_type="default",
-                page_num=1
-            )
-        ocr_text = markdown
-        
-        # ocr_text_list = [t.strip() for t in ocr_text.split('\n') if t.strip() != '']
-        # ocr_df = pytesseract.image_to_data(img_arr, lang='tha', config='--psm 11', output_type=Output.DATAFRAME)
-        # ocr_df = ocr_df.dropna()
-        # ocr_df = ocr_df.groupby('block_num').agg({
-        #     'left': 'first',
-        #     'top': 'first',
-        #     'width': 'first',
-        #     'height': 'first',
-        #     'text': lambda x: ''.join(x)
-        # }).reset_index(drop=True)
-        # ocr_df = prepare_dataframe(ocr_df)
-        # ocr_df['text'] = ocr_text_list
-
-        # img_width, img_height = img.size
-        # scale_x = page_width / img_width
-        # scale_y = page_height / img_height
-        # font_size = ocr_df['height'].quantile(0.95) * scale_y * 0.8
-
-        # tw = TextWriter(page.rect)
-        # for _, row in ocr_df.iterrows():
-        #     x = row['left'] * scale_x
-        #     y = (row['top'] + row['height']) * scale_y
-        #     tw.append((x, y), row['text'], fontsize=font_size)
-        # tw.write_text(page, render_mode=3)
-
-        return ocr_text + '\n\n'
+        while (item := pending.get()) is not None:
+            page_number, future, restored = item
+            yield page_number, future.result(), restored
     finally:
-        os.remove(temp_path)
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        producer.join()
+
+def reset_peak_rss():
+    """เริ่มนับ peak RSS ใหม่ (Linux: VmHWM) ให้ได้ค่าของ task นี้ ไม่ใช่ของทั้ง process"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_mb() -> float:
+    """peak RSS ของ process ตั้งแต่ reset_peak_rss() ครั้งล่าสุด (MB)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def page_spool():
+    """ที่พักข้อความรายหน้า อยู่ใน memory จนเกิน OCR_SPOOL_MAX_BYTES แล้วย้ายลงไฟล์ชั่วคราว"""
+    return tempfile.SpooledTemporaryFile(max_size=OCR_SPOOL_MAX_BYTES, mode='w+', encoding='utf-8')
+
+def record_skipped_page(task_id, page_number):
+    """จดหน้าว่างที่ข้ามไว้ที่ task หลัก (subtask ทุกช่วงหน้าเขียนรวมกัน)"""
+    pipe = r.pipeline()
+    pipe.sadd(f'{task_id}_skipped', page_number)
+    pipe.expire(f'{task_id}_skipped', OCR_STATE_TTL)
+    pipe.execute()
+
+def skipped_pages(task_id) -> list[int]:
+    return sorted(int(p) for p in r.smembers(f'{task_id}_skipped'))
+
+def stream_page(task_id, page_number, total_pages, text):
+    if OCR_STREAM_PAGES:
+        publish_page(task_id, page_number, total_pages, format_ocr_result(text))
+
+def split_page_ranges(total_pages:int, chunk_pages:int=OCR_CHUNK_PAGES):
+    """แบ่งเป็นช่วงหน้า [start, end) ขนาดไม่เกิน chunk_pages"""
+    chunk_pages = max(1, chunk_pages)
+    return [(start, min(start + chunk_pages, total_pages)) for start in range(0, total_pages, chunk_pages)]
+
+def _stop_parallel_ocr(task, parent_id, staged_ref, job, state, meta=None):
+    """ตั้ง state CANCEL/FAILURE ให้ task หลักครั้งเดียว subtask อื่นเห็น flag แล้วหยุดเงียบๆ"""
+    if r.set(f'{parent_id}_stopped', state, ex=OCR_STATE_TTL, nx=True):
+        report_state(task, task_id=parent_id, state=state, meta=meta)
+        # merge_ocr_pages จะไม่ถูกเรียกแล้ว
+        delete_staged(staged_ref)
+        release_job_slot(parent_id, job or {})
+    raise Ignore()
+
+@celery_app.task
+def ocr_chord_failed(request, exc, traceback, parent_id, staged_ref, job=None):
+    """
+    errback ของ merge_ocr_pages: subtask ช่วงหน้าล้มด้วย exception ที่ไม่ได้จับไว้ (เช่น อ่านไฟล์/Redis ไม่ได้)
+    Celery ตั้งผล chord เป็น FAILURE ใน result backend อย่างเดียว ไม่มี task_failure ของ task หลัก
+    จึงต้อง publish FAILURE ให้ websocket ลบไฟล์ และคืน slot เอง
+    """
+    print(f'OCR task {parent_id} failed in a page range: {exc!r}')
+    if r.set(f'{parent_id}_stopped', "FAILURE", ex=OCR_STATE_TTL, nx=True):
+        publish_progress(parent_id, "FAILURE")
+    delete_staged(staged_ref)
+    release_job_slot(parent_id, job or {})
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def ocr_page_range(self, staged_ref, file_hash, start, end, total_pages, parent_id, job=None):
+    """OCR หน้า [start, end) ของเอกสาร อัปเดต progress ไปที่ task หลัก (parent_id)"""
+    texts = []
+    if r.get(f'{parent_id}_stopped'):
+        raise Ignore()
+    reset_peak_rss()
+    checkpoint = load_checkpoint(file_hash)
+    # ช่วงหน้าที่รันอยู่ต่ออายุ slot ของงานหลักด้วยเวลาแบบ chord (ช่วงอื่นอาจยังรอในคิว)
+    stop_heartbeat = start_slot_heartbeat(parent_id, job or {}, OCR_CHORD_STALE_SECONDS)
+    with open_staged_pdf(staged_ref) as doc:
+        pages = iter_ocr_pages(doc, range(start, end), checkpoint, (job or {}).get("preprocess", OCR_PREPROCESS))
+        try:
+            while True:
+                if r.get(f'{parent_id}_stopped'):
+                    raise Ignore()
+                if r.get(f'{parent_id}_cancel'):
+                    progress = str(round((checkpoint_count(file_hash)/total_pages)*100))
+                    _stop_parallel_ocr(self, parent_id, staged_ref, job, "CANCEL", {"current_page": start + len(texts), "total_page": total_pages, "progress": progress})
+                try:
+                    page_number, text, restored = next(pages)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    print(f'OCR failed: {e}')
+                    _stop_parallel_ocr(self, parent_id, staged_ref, job, "FAILURE")
+                texts.append(text)
+                if not text:
+                    record_skipped_page(parent_id, page_number)
+                stream_page(parent_id, page_number, total_pages, text)
+                if restored:
+                    continue
+                # progress นับจากหน้าที่มี checkpoint แล้ว (รวมหน้าที่ทำไว้ก่อน worker ตาย)
+                done = save_checkpoint(file_hash, page_number, text)
+                if not r.get(f'{parent_id}_stopped'):
+                    progress = str(round((done/total_pages)*100))
+                    report_state(self, task_id=parent_id, state="PROGRESS", meta={"current_page": page_number, "total_page": total_pages, "progress": progress, "skipped_pages": skipped_pages(parent_id), "peak_rss_mb": peak_rss_mb()})
+        finally:
+            pages.close()
+            stop_heartbeat()
+    return {"start": start, "texts": texts, "peak_rss_mb": peak_rss_mb()}
 
 @celery_app.task(bind=True)
-def process_ocr(self,file_bytes, file_name):   
+def merge_ocr_pages(self, results, file_hash, staged_ref, job=None):
+    """รวมผลจากทุกช่วงหน้าตามลำดับหน้า (task นี้ใช้ task id เดิมของ process_ocr)"""
     task_id = self.request.id
-    ocr_result = ''
-    content_type = os.path.splitext(file_name)[1].lower()
+    delete_staged(staged_ref)
+    release_job_slot(task_id, job or {})
+    ocr_result = ''.join(text for part in sorted(results, key=lambda p: p["start"]) for text in part["texts"])
+    skipped = skipped_pages(task_id)
+    if skipped:
+        print(f'OCR task {task_id}: skipped blank pages {skipped}')
+    r.delete(f'{task_id}_stopped', f'{task_id}_cancel', f'{task_id}_skipped')
+    print(f'OCR task {task_id} peak RSS (max of ranges): {max(part.get("peak_rss_mb", 0) for part in results)} MB')
+    ocr_format = format_ocr_result(ocr_result)
+    put_document_result(file_hash, ocr_format)
+    clear_checkpoint(file_hash)
+    return ocr_format
+
+@celery_app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_ocr(self, staged_ref, file_name, job=None):
+    """
+    OCR ไฟล์ที่พักไว้ใน staging (staged_ref) ลบไฟล์ทิ้งเมื่อเสร็จ
+    job = {"lane", "client", "user_id", "faction_id", "preprocess", "file_hash"}
+    lane/client/user_id/faction_id ใช้จำกัดจำนวนงานพร้อมกันต่อ IP/ผู้ใช้/ฝ่าย, preprocess เลือกว่าจะเตรียมภาพก่อน OCR หรือไม่
+    file_hash คือ key ของ cache/checkpoint ที่ enqueue_ocr คำนวณไว้แล้ว
+    """
+    job = job or {}
+    if not acquire_job_slot(self.request.id, job):
+        # ผู้ใช้/ฝ่ายนี้มีงานรันครบโควตา กลับไปต่อท้ายคิวให้งานของคนอื่นก่อน
+        raise self.retry(countdown=OCR_SLOT_RETRY_SECONDS, max_retries=None)
+    keep_staged = False
+    reset_peak_rss()
+    stop_heartbeat = start_slot_heartbeat(self.request.id, job)
+    try:
+        task_id = self.request.id
+        ocr_result = ''
+        content_type = os.path.splitext(file_name)[1].lower()
+
+        preprocess = job.get("preprocess", OCR_PREPROCESS)
+        file_hash = job.get("file_hash") or document_key(staged_hash(staged_ref), preprocess)
+        # enqueue_ocr ดู cache ก่อนส่งงานแล้ว เหลือกรณีไฟล์เดียวกันถูกส่งซ้อนกันก่อนงานแรกเสร็จ
+        cached = get_document_result(file_hash)
+        if cached is not None:
+            return cached
     
-    # ถ้าเป็น PDF
-    if content_type in [".pdf"]:
-        with fitz.open(stream=file_bytes, filetype='pdf') as doc:
+        # ถ้าเป็น PDF
+        if content_type in [".pdf"]:
+            # ข้อความรายหน้าเขียนลง spool (ไฟล์ชั่วคราวเมื่อใหญ่) แล้วอ่านรวมครั้งเดียวตอนจบ
+            with open_staged_pdf(staged_ref) as doc, page_spool() as spool:
             
-            total_pages = doc.page_count
-            progress = "0"
+                total_pages = doc.page_count
+                progress = "0"
+
+                # เอกสารยาว: แตกเป็นช่วงหน้าให้ worker หลายตัวช่วยกัน แล้วรวมผลใน merge_ocr_pages
+                # replace() ทำให้ผลของ chord กลับมาที่ task id เดิม client ใช้ progress/cancel ได้เหมือนเดิม
+                if OCR_PARALLEL_MIN_PAGES and total_pages >= OCR_PARALLEL_MIN_PAGES:
+                    report_state(self, state="PROGRESS", meta={"current_page": 0, "total_page": total_pages, "progress": progress})
+                    r.delete(f'{task_id}_stopped')
+                    lane = job.get("lane") or choose_lane(total_pages)
+                    header = [
+                        ocr_page_range.s(staged_ref, file_hash, start, end, total_pages, task_id, job).set(queue=lane)
+                        for start, end in split_page_ranges(total_pages)
+                    ]
+                    # subtask ยังต้องอ่านไฟล์ merge_ocr_pages เป็นคนลบไฟล์และคืน slot
+                    keep_staged = True
+                    body = merge_ocr_pages.s(file_hash, staged_ref, job).set(queue=lane)
+                    body.link_error(ocr_chord_failed.s(task_id, staged_ref, job))
+                    hold_job_slot(task_id, job)
+                    return self.replace(chord(header, body))
             
-            with fitz.open() as new_doc:
-                for page in doc:
-                    page_width, page_height = page.rect.br
-                    page_rot = page.rotation
-                    page.set_rotation(0)
-                    new_doc_page = new_doc.new_page(width=page_width, height=page_height)
-                    new_doc_page.show_pdf_page(
-                        new_doc_page.rect,
-                        doc,
-                        page.number,
-                        rotate=-page_rot
-                    )
-
-                    pix = new_doc_page.get_pixmap(matrix=fitz.Matrix(2,2))
-                    with Image.open(io.BytesIO(pix.tobytes('png'))) as img:
+                # ทำต่อจากหน้าที่ยังไม่มี checkpoint (task ที่ถูกส่งซ้ำ/worker ตายกลางทาง)
+                # render หน้าถัดไประหว่างรอ OCR หน้าก่อนหน้า (iter_ocr_pages)
+                checkpoint = load_checkpoint(file_hash)
+                pages = iter_ocr_pages(doc, range(total_pages), checkpoint, preprocess)
+                current_page = 0
+                skipped = []
+                try:
+                    while True:
                         #OCR
                         if(r.get(f'{task_id}_cancel')):
                             r.delete(f'{task_id}_cancel')
-                            self.update_state(state="CANCEL", meta={"current_page": page.number, "total_page": total_pages, "progress": progress})
+                            report_state(self, state="CANCEL", meta={"current_page": current_page, "total_page": total_pages, "progress": progress})
                             raise Ignore()
-                        self.update_state(state="PROGRESS", meta={"current_page": page.number, "total_page": total_pages, "progress": progress})
+                        report_state(self, state="PROGRESS", meta={"current_page": current_page, "total_page": total_pages, "progress": progress, "skipped_pages": skipped, "peak_rss_mb": peak_rss_mb()})
                         try:
-                            ocr_result += process_image_to_text(new_doc_page, img, page_width, page_height)
+                            current_page, text, restored = next(pages)
+                        except StopIteration:
+                            break
                         except Exception as e:
                             print(f'OCR failed: {e}')
-                            self.update_state(state="FAILURE")
+                            report_state(self, state="FAILURE")
                             raise Ignore()
-                        progress = str(round((page.number/total_pages)*100))
-                        self.update_state(state="PROGRESS", meta={"current_page": page.number, "total_page": total_pages, "progress": progress})
-        # formatting ocr_result
-        ocr_format = format_ocr_result(ocr_result)
-
-        # new_doc.ez_save('file/output.pdf')
-        return ocr_format
-
-    # ถ้าเป็นภาพ (jpg, png ฯลฯ)
-    elif content_type in [".jpg", ".png", ".jpeg"]:
-        with Image.open(BytesIO(file_bytes)) as img:
-            progress = "0"
-
-            # สร้างหน้ากระดาษใหม่ให้พอดีกับขนาดภาพ
-            page_width, page_height = 595.276, 841.890 #ขนาด A4 ใน pdf
-            with fitz.open() as new_doc:
-                new_doc_page = new_doc.new_page(width=page_width, height=page_height)
-
-                # วางภาพลงบนหน้ากระดาษ (optional)
-                new_doc_page.insert_image(new_doc_page.rect, stream=file_bytes)
-
-                # OCR
-                if(r.get(f'{task_id}_cancel')):
-                    r.delete(f'{task_id}_cancel')
-                    self.update_state(state="CANCEL", meta={"current_page": 1, "total_page": 1, "progress": progress})
-                    raise Ignore()
-                self.update_state(state="PROGRESS", meta={"current_page": 1, "total_page": 1, "progress": progress})
-                try:
-                    ocr_result += process_image_to_text(new_doc_page, img, page_width, page_height)
-                except Exception as e:
-                    print(f'OCR failed: {e}')
-                    self.update_state(state="FAILURE")
-                    raise Ignore()
-        # formatting ocr_result
-        ocr_format = format_ocr_result(ocr_result)
+                        if not restored:
+                            save_checkpoint(file_hash, current_page, text)
+                        if not text:
+                            skipped.append(current_page)
+                        stream_page(task_id, current_page, total_pages, text)
+                        spool.write(text)
+                        progress = str(round((current_page/total_pages)*100))
+                finally:
+                    pages.close()
+                if skipped:
+                    # state สุดท้ายก่อน SUCCESS ให้ client เห็นหน้าที่ข้ามครบ
+                    report_state(self, state="PROGRESS", meta={"current_page": current_page, "total_page": total_pages, "progress": "100", "skipped_pages": skipped, "peak_rss_mb": peak_rss_mb()})
+                spool.seek(0)
+                ocr_result = spool.read()
+            print(f'OCR task {task_id}: {total_pages} pages, skipped blank pages {skipped}, peak RSS {peak_rss_mb()} MB')
+            # formatting ocr_result
+            ocr_format = format_ocr_result(ocr_result)
+            put_document_result(file_hash, ocr_format)
+            clear_checkpoint(file_hash)
 
-        # new_doc.ez_save('file/output.pdf')
-        return ocr_format
+            # new_doc.ez_save('file/output.pdf')
+            return ocr_format
 
-    else:
-        return {"error": "Unsupported file type"}
+        # ถ้าเป็นภาพ (jpg, png ฯลฯ)
+        elif content_type in [".jpg", ".png", ".jpeg"]:
+            with Image.open(BytesIO(read_staged(staged_ref))) as img:
+                progress = "0"
+                if preprocess:
+                    gray = preprocess_page(np.asarray(img.convert("L")))
+                    data, mime = encode_preprocessed(gray)
+                    height, width = gray.shape
+                else:
+                    data, mime = encode_image(img)
+                    width, height = img.size
+
+            # OCR
+            if(r.get(f'{task_id}_cancel')):
+                r.delete(f'{task_id}_cancel')
+                report_state(self, state="CANCEL", meta={"current_page": 1, "total_page": 1, "progress": progress})
+                raise Ignore()
+            report_state(self, state="PROGRESS", meta={"current_page": 1, "total_page": 1, "progress": progress})
+            try:
+                ocr_result += process_image_to_text(data, mime, width, height)
+            except Exception as e:
+                print(f'OCR failed: {e}')
+                report_state(self, state="FAILURE")
+                raise Ignore()
+            # formatting ocr_result
+            ocr_format = format_ocr_result(ocr_result)
+            put_document_result(file_hash, ocr_format)
+
+            # new_doc.ez_save('file/output.pdf')
+            return ocr_format
+
+        else:
+            return {"error": "Unsupported file type"}
+    finally:
+        stop_heartbeat()
+        if not keep_staged:
+            delete_staged(staged_ref)
+            release_job_slot(self.request.id, job)
+
+def count_staged_pages(staged_ref: str, file_name: str) -> int:
+    if os.path.splitext(file_name)[1].lower() != ".pdf":
+        return 1
+    with open_staged_pdf(staged_ref) as doc:
+        return doc.page_count
+
+def document_key(file_hash: str, preprocess: bool) -> str:
+    """key ของ cache/checkpoint ระดับเอกสาร ผลของไฟล์เดียวกันแยกตามโหมด preprocess เทียบ A/B กันได้"""
+    return f'{file_hash}:pre' if preprocess else file_hash
+
+def enqueue_ocr(file: UploadFile, identity: dict | None = None, preprocess: bool | None = None):
+    """
+    พักไฟล์ไว้ใน staging แล้วส่งแค่ ref เข้าคิวตามจำนวนหน้า (sync: เรียกผ่าน run_in_threadpool)
+    identity = {"client", "user_id", "faction_id"} จาก job_identity ใช้จำกัดจำนวนงานพร้อมกัน
+    preprocess = None ใช้ค่าเริ่มต้น OCR_PREPROCESS
+    คืน {"task_id"} หรือ {"task_id", "result", "cached": True} ถ้าไฟล์เดิมเคย OCR แล้ว
+    ไฟล์ที่มีผลใน cache ไม่เข้าคิว Celery เลย (ไม่ต้องรอ slot/คิวของงานอื่น) แต่ยังได้ task id ที่
+    ดูผลผ่าน /ocr/progress ได้เหมือนงานปกติ
+    """
+    preprocess = OCR_PREPROCESS if preprocess is None else preprocess
+    file_hash = document_key(upload_hash(file), preprocess)
+    cached = get_document_result(file_hash)
+    if cached is not None:
+        task_id = str(uuid.uuid4())
+        celery_app.backend.store_result(task_id, cached, "SUCCESS")
+        publish_progress(task_id, "SUCCESS", result=cached)
+        return {"task_id": task_id, "result": cached, "cached": True}
+
+    staged_ref = stage_upload(file)
+    try:
+        lane = choose_lane(count_staged_pages(staged_ref, file.filename))
+        job = {"lane": lane, **(identity or {}), "preprocess": preprocess, "file_hash": file_hash}
+        task = process_ocr.apply_async(args=[staged_ref, file.filename, job], queue=lane)
+        return {"task_id": task.id}
+    except Exception:
+        delete_staged(staged_ref)
+        raise
 
     
 def richtext_to_plaintext(text:str):
@@ -0,0 +1,210 @@
+"""
+แยกคิว OCR ตามขนาดงาน และจำกัดจำนวนงานที่รันพร้อมกันต่อผู้ใช้/ต่อฝ่าย
+- ocr_interactive: ไฟล์สั้น (ไม่เกิน OCR_INTERACTIVE_MAX_PAGES หน้า) มี worker แยกใน compose จึงไม่ต้องรอหลังงานใหญ่
+- ocr_standard / ocr_bulk: ไฟล์ยาวขึ้นตามลำดับ (subtask ของงานที่แตกหลาย worker อยู่คิวเดียวกับงานหลัก)
+- ผู้ใช้/ฝ่ายที่มีงานรันอยู่ครบโควตา งานถัดไปจะถูก retry กลับเข้าคิว ให้งานของคนอื่นได้รันก่อน
+- ตัวตนที่ใช้นับโควตามาจากฝั่ง server (job_identity): IP ของ client ทุกงาน ผู้ใช้/ฝ่ายจากตาราง user
+  งานที่ไม่ระบุผู้ใช้จึงยังถูกจำกัดต่อ IP และ factId ที่ client ส่งมาเองไม่มีผล
+- slot เก็บเป็น ZSET ของ task id -> เวลาหมดอายุ งานที่รันอยู่ต่ออายุทุก OCR_SLOT_HEARTBEAT_SECONDS (start_slot_heartbeat)
+  worker ที่ถูก kill (SIGKILL/OOM) จะไม่ต่ออายุ slot จึงว่างภายใน OCR_SLOT_STALE_SECONDS
+  งานที่แตกเป็น chord ถือ slot ไว้ OCR_CHORD_STALE_SECONDS (hold_job_slot) เพราะช่วงหน้าที่ยังรอในคิวไม่มีใครต่ออายุให้
+"""
+import os
+import threading
+import time
+import urllib.parse
+
+from dotenv import load_dotenv
+from redis import Redis
+
+load_dotenv()
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+r = Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+
+LANE_INTERACTIVE = "ocr_interactive"
+LANE_STANDARD = "ocr_standard"
+LANE_BULK = "ocr_bulk"
+LANES = [LANE_INTERACTIVE, LANE_STANDARD, LANE_BULK]
+
+OCR_INTERACTIVE_MAX_PAGES = int(os.getenv("OCR_INTERACTIVE_MAX_PAGES", "5"))
+OCR_STANDARD_MAX_PAGES = int(os.getenv("OCR_STANDARD_MAX_PAGES", "50"))
+OCR_MAX_JOBS_PER_USER = int(os.getenv("OCR_MAX_JOBS_PER_USER", "2"))        # 0 = ไม่จำกัด
+OCR_MAX_JOBS_PER_FACTION = int(os.getenv("OCR_MAX_JOBS_PER_FACTION", "4"))  # 0 = ไม่จำกัด
+OCR_MAX_JOBS_PER_CLIENT = int(os.getenv("OCR_MAX_JOBS_PER_CLIENT", "4"))    # ต่อ IP, 0 = ไม่จำกัด
+OCR_SLOT_RETRY_SECONDS = int(os.getenv("OCR_SLOT_RETRY_SECONDS", "10"))
+# heartbeat มาจาก thread แยก ไม่ขึ้นกับเวลาต่อหน้า จึงใช้ช่วงสั้นได้ (ต้องยาวกว่า heartbeat หลายเท่า)
+OCR_SLOT_HEARTBEAT_SECONDS = int(os.getenv("OCR_SLOT_HEARTBEAT_SECONDS", "30"))
+OCR_SLOT_STALE_SECONDS = int(os.getenv("OCR_SLOT_STALE_SECONDS", "180"))
+# งาน chord: ช่วงหน้าที่ค้างในคิวจะถูกส่งซ้ำหลัง visibility_timeout จึงถือ slot ไว้นานเท่านั้น
+OCR_CHORD_STALE_SECONDS = int(os.getenv("OCR_CHORD_STALE_SECONDS", os.getenv("CELERY_VISIBILITY_TIMEOUT", str(6 * 3600))))
+
+STATS_KEY = "ocr:lane:stats"  # hash: <lane>:avg_seconds, <lane>:jobs
+
+# จอง slot ให้ครบทุก key หรือไม่จองเลย (ZSET ของ task id -> เวลาหมดอายุ)
+# TTL ของ key ใช้ OCR_CHORD_STALE_SECONDS เสมอ ไม่ให้ slot ของงาน chord หายไปพร้อม key
+_ACQUIRE = r.register_script("""
+local now = tonumber(ARGV[1])
+local deadline = now + tonumber(ARGV[2])
+local task_id = ARGV[3]
+local key_ttl = ARGV[4]
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+    local cap = tonumber(ARGV[4 + i])
+    if cap > 0 and not redis.call('ZSCORE', key, task_id) and redis.call('ZCARD', key) >= cap then
+        return 0
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('ZADD', key, 'GT', deadline, task_id)
+    redis.call('EXPIRE', key, key_ttl)
+end
+return 1
+""")
+
+
+def choose_lane(page_count: int) -> str:
+    if page_count <= OCR_INTERACTIVE_MAX_PAGES:
+        return LANE_INTERACTIVE
+    if page_count <= OCR_STANDARD_MAX_PAGES:
+        return LANE_STANDARD
+    return LANE_BULK
+
+
+def job_identity(db, request, user_id: int | None) -> dict:
+    """
+    ตัวตนของงานสำหรับโควตา: client = IP ของ request เสมอ
+    user_id/faction_id ใช้เฉพาะผู้ใช้ที่มีอยู่จริง และฝ่ายอ่านจากตาราง user ไม่เชื่อค่าที่ client ส่งมา
+    (หลัง reverse proxy ต้องรัน uvicorn --proxy-headers ไม่งั้นทุกงานได้ IP ของ proxy)
+    """
+    from models.user import User
+
+    identity = {"client": request.client.host if request.client else "unknown", "user_id": None, "faction_id": None}
+    if user_id is not None:
+        user = db.query(User.userId, User.factId).filter(User.userId == user_id).first()
+        if user is not None:
+            identity.update(user_id=user.userId, faction_id=user.factId)
+    return identity
+
+
+def _slot_keys(job: dict) -> list[tuple[str, int]]:
+    keys = [(f"ocr:running:lane:{job.get('lane') or LANE_STANDARD}", 0)]
+    if job.get("client") is not None:
+        keys.append((f"ocr:running:client:{job['client']}", OCR_MAX_JOBS_PER_CLIENT))
+    if job.get("user_id") is not None:
+        keys.append((f"ocr:running:user:{job['user_id']}", OCR_MAX_JOBS_PER_USER))
+    if job.get("faction_id") is not None:
+        keys.append((f"ocr:running:faction:{job['faction_id']}", OCR_MAX_JOBS_PER_FACTION))
+    return keys
+
+
+def acquire_job_slot(task_id: str, job: dict) -> bool:
+    """จอง slot ให้งานนี้ คืน False ถ้าผู้ใช้หรือฝ่ายมีงานรันอยู่ครบโควตาแล้ว"""
+    keys = _slot_keys(job)
+    caps = [cap for _, cap in keys]
+    now = time.time()
+    if not _ACQUIRE(keys=[k for k, _ in keys], args=[now, OCR_SLOT_STALE_SECONDS, task_id, OCR_CHORD_STALE_SECONDS, *caps]):
+        return False
+    # เวลาเริ่มเก็บแยก (score ใน ZSET เปลี่ยนตาม heartbeat) ใช้คำนวณเวลาเฉลี่ยต่องาน
+    r.set(_started_key(task_id), now, ex=OCR_CHORD_STALE_SECONDS, nx=True)
+    return True
+
+
+def _started_key(task_id: str) -> str:
+    return f"ocr:running:started:{task_id}"
+
+
+def touch_job_slot(task_id: str, job: dict, stale_seconds: int = OCR_SLOT_STALE_SECONDS):
+    """ต่ออายุ slot ของงานที่ยังรันอยู่ (ไม่ลดเวลาหมดอายุที่ยาวกว่า เช่น ของงาน chord)"""
+    deadline = time.time() + stale_seconds
+    try:
+        pipe = r.pipeline()
+        for key, _ in _slot_keys(job):
+            pipe.zadd(key, {task_id: deadline}, xx=True, gt=True)
+            pipe.expire(key, OCR_CHORD_STALE_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        print(f"Touch OCR slot failed: {e}")
+
+
+def hold_job_slot(task_id: str, job: dict):
+    """ถือ slot ของงานหลักที่แตกเป็น chord ไว้จนกว่าช่วงหน้าในคิวจะได้รัน (ช่วงหน้าที่รันอยู่ต่ออายุซ้ำ)"""
+    touch_job_slot(task_id, job, OCR_CHORD_STALE_SECONDS)
+
+
+def start_slot_heartbeat(task_id: str, job: dict, stale_seconds: int = OCR_SLOT_STALE_SECONDS):
+    """
+    ต่ออายุ slot จาก thread แยกทุก OCR_SLOT_HEARTBEAT_SECONDS (หน้าที่ OCR นาน/รอ rate limit ไม่ทำให้ slot หลุด)
+    คืนฟังก์ชันสำหรับหยุด heartbeat
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(OCR_SLOT_HEARTBEAT_SECONDS):
+            touch_job_slot(task_id, job, stale_seconds)
+
+    thread = threading.Thread(target=beat, name="ocr-slot-heartbeat", daemon=True)
+    thread.start()
+
+    def stop_heartbeat():
+        stop.set()
+        thread.join()
+    return stop_heartbeat
+
+
+def release_job_slot(task_id: str, job: dict):
+    """คืน slot และเก็บเวลาเฉลี่ยต่องานของคิวไว้ประมาณเวลารอ"""
+    keys = [k for k, _ in _slot_keys(job)]
+    lane = job.get("lane") or LANE_STANDARD
+    try:
+        pipe = r.pipeline()
+        pipe.get(_started_key(task_id))
+        pipe.delete(_started_key(task_id))
+        for key in keys:
+            pipe.zrem(key, task_id)
+        started = pipe.execute()[0]
+        if started is not None:
+            _record_duration(lane, time.time() - float(started))
+    except Exception as e:
+        print(f"Release OCR slot failed: {e}")
+
+
+def _record_duration(lane: str, seconds: float):
+    """ค่าเฉลี่ยแบบ exponential moving average"""
+    avg = r.hget(STATS_KEY, f"{lane}:avg_seconds")
+    avg = seconds if avg is None else 0.8 * float(avg) + 0.2 * seconds
+    pipe = r.pipeline()
+    pipe.hset(STATS_KEY, f"{lane}:avg_seconds", round(avg, 2))
+    pipe.hincrby(STATS_KEY, f"{lane}:jobs", 1)
+    pipe.execute()
+
+
+def get_queue_stats(celery_app) -> dict:
+    """ความยาวคิว งานที่กำลังรัน และเวลารอโดยประมาณของแต่ละคิว"""
+    consumers = {lane: 0 for lane in LANES}
+    try:
+        inspect = celery_app.control.inspect(timeout=1.0)
+        active_queues = inspect.active_queues() or {}
+        stats = inspect.stats() or {}
+        for worker, queues in active_queues.items():
+            concurrency = stats.get(worker, {}).get("pool", {}).get("max-concurrency", 1)
+            for q in queues:
+                if q["name"] in consumers:
+                    consumers[q["name"]] += concurrency
+    except Exception as e:
+        print(f"Inspect workers failed: {e}")
+
+    lane_stats = r.hgetall(STATS_KEY)
+    result = {}
+    for lane in LANES:
+        depth = r.llen(lane)
+        avg = float(lane_stats.get(f"{lane}:avg_seconds", 0)) or None
+        result[lane] = {
+            "queued": depth,
+            "running": r.zcard(f"ocr:running:lane:{lane}"),
+            "consumers": consumers[lane],
+            "avg_seconds": avg,
+            "estimated_wait_seconds": round(depth * avg / consumers[lane], 1) if avg and consumers[lane] else None,
+        }
+    return result
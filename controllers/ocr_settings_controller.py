@@ -0,0 +1,61 @@
+"""
+ค่าตั้งของ OCR ที่มีผลต่อข้อความที่ได้ อ่านจาก env ที่นี่ที่เดียว ocr_controller กับ ocr_cache_controller import จากที่นี่
+- PAGE_FINGERPRINT: engine/model ของ OCR และค่าที่มีผลต่อภาพที่ส่ง OCR (DPI, format/quality ของภาพ, preprocess)
+  ใช้ต่อท้าย key cache รายหน้า (ผลจาก OCR_ENGINE=stub จึงไม่ปนกับผล OCR จริง)
+- DOCUMENT_FINGERPRINT: PAGE_FINGERPRINT + การเลือก text layer/ข้ามหน้าว่าง ใช้ต่อท้าย key cache ระดับเอกสารและ checkpoint
+เปลี่ยนค่าเหล่านี้แล้วจะไม่ได้ผลที่ทำไว้ด้วยค่าเก่ากลับมา
+"""
+import hashlib
+import os
+
+from dotenv import load_dotenv
+
+from controllers.ocr_client_controller import OCR_DPI, OCR_ENGINE, OCR_IMAGE_FORMAT, OCR_IMAGE_QUALITY, TYPHOON_MODEL
+from controllers.preprocess_controller import (
+    PREPROCESS_BINARIZE,
+    PREPROCESS_MAX_SKEW,
+    PREPROCESS_MIN_SCALE,
+    PREPROCESS_TEXT_HEIGHT,
+)
+
+load_dotenv()
+
+# PDF ที่ export จาก Word มี text layer อยู่แล้ว ดึงข้อความตรงๆ ได้โดยไม่ต้อง OCR
+USE_TEXT_LAYER = os.getenv("OCR_USE_TEXT_LAYER", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "40"))
+TEXT_LAYER_MAX_GARBAGE = float(os.getenv("TEXT_LAYER_MAX_GARBAGE", "0.05"))
+TEXT_LAYER_MIN_COVERAGE = float(os.getenv("TEXT_LAYER_MIN_COVERAGE", "0.05"))
+
+# ข้ามหน้าว่าง/แทบไม่มีข้อความ (แผ่นคั่น หน้าลายเซ็นอย่างเดียว ใบปะหน้าจากเครื่องสแกน) ไม่ส่ง OCR
+OCR_SKIP_BLANK_PAGES = os.getenv("OCR_SKIP_BLANK_PAGES", "true").lower() == "true"
+BLANK_CHECK_DPI = int(os.getenv("BLANK_CHECK_DPI", "100"))
+BLANK_MIN_INK = float(os.getenv("BLANK_MIN_INK", "0.0002"))    # สัดส่วน pixel หมึกขั้นต่ำ
+BLANK_MIN_GLYPHS = int(os.getenv("BLANK_MIN_GLYPHS", "6"))   # จำนวน component ขนาดตัวอักษรขั้นต่ำ
+
+
+def _fingerprint(settings: dict) -> str:
+    return hashlib.sha1(repr(sorted(settings.items())).encode()).hexdigest()[:12]
+
+
+PAGE_FINGERPRINT = _fingerprint({
+    "engine": OCR_ENGINE,
+    "model": TYPHOON_MODEL,
+    "dpi": OCR_DPI,
+    "image_format": OCR_IMAGE_FORMAT,
+    "image_quality": OCR_IMAGE_QUALITY,
+    "pre_binarize": PREPROCESS_BINARIZE,
+    "pre_text_height": PREPROCESS_TEXT_HEIGHT,
+    "pre_min_scale": PREPROCESS_MIN_SCALE,
+    "pre_max_skew": PREPROCESS_MAX_SKEW,
+})
+DOCUMENT_FINGERPRINT = _fingerprint({
+    "page": PAGE_FINGERPRINT,
+    "text_layer": USE_TEXT_LAYER,
+    "text_min_chars": TEXT_LAYER_MIN_CHARS,
+    "text_max_garbage": TEXT_LAYER_MAX_GARBAGE,
+    "text_min_coverage": TEXT_LAYER_MIN_COVERAGE,
+    "skip_blank": OCR_SKIP_BLANK_PAGES,
+    "blank_dpi": BLANK_CHECK_DPI,
+    "blank_min_ink": BLANK_MIN_INK,
+    "blank_min_glyphs": BLANK_MIN_GLYPHS,
+})
@@ -0,0 +1,103 @@
+"""
+เตรียมภาพหน้าก่อนส่ง OCR ให้ภาพเล็กลงหลายเท่าโดยข้อความยังอ่านได้
+- grayscale (render จาก PDF เป็นขาวดำตั้งแต่แรก ไม่ต้องแปลงสีเอง) และทำพื้นกระดาษให้ขาวล้วน
+- แก้ภาพเอียง (deskew) หามุมที่ผลรวมหมึกรายแถวแปรปรวนมากที่สุด (บรรทัดตรงแนวนอน)
+- ตัดขอบว่างรอบเนื้อหาทิ้ง
+- ย่อภาพตามความสูงตัวอักษรที่วัดได้ ให้เหลือประมาณ PREPROCESS_TEXT_HEIGHT pixel (ไม่ขยาย)
+- PREPROCESS_BINARIZE=true แปลงเป็นขาว/ดำล้วน (adaptive threshold) ภาพเล็กที่สุดแต่เสี่ยงเสียสระ/วรรณยุกต์บาง
+- encode เป็น PNG หรือ JPEG แล้วแต่อันไหนเล็กกว่า (ข้อความพิมพ์บนพื้นขาว PNG เล็กกว่า JPEG หลายเท่า)
+เปิด/ปิดได้ต่องาน (ฟิลด์ preprocess ของ /ocr/process) ค่าเริ่มต้นตาม OCR_PREPROCESS
+"""
+import os
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image
+
+from controllers.ocr_client_controller import encode_image
+
+load_dotenv()
+
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "false").lower() == "true"
+PREPROCESS_BINARIZE = os.getenv("PREPROCESS_BINARIZE", "false").lower() == "true"
+PREPROCESS_TEXT_HEIGHT = int(os.getenv("PREPROCESS_TEXT_HEIGHT", "16"))    # pixel
+PREPROCESS_MIN_SCALE = float(os.getenv("PREPROCESS_MIN_SCALE", "0.5"))     # ย่อได้ไม่เกินครึ่ง
+PREPROCESS_MAX_SKEW = float(os.getenv("PREPROCESS_MAX_SKEW", "5"))         # องศา
+
+SKEW_STEP = 0.5
+SKEW_SAMPLE_WIDTH = 800
+
+
+def _ink_mask(gray: np.ndarray) -> tuple[float, np.ndarray]:
+    """คืน (ระดับ threshold ของ Otsu, mask ที่ pixel หมึก = 255) ตัดจุดฝุ่นเล็กๆ ออก"""
+    level, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return level, cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+
+def _rotate(img: np.ndarray, angle: float, border: int, interpolation=cv2.INTER_LINEAR) -> np.ndarray:
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), flags=interpolation, borderValue=border)
+
+
+def estimate_skew(ink: np.ndarray) -> float:
+    """มุมเอียง (องศา) ลองหมุนภาพย่อทีละ SKEW_STEP องศา แล้วเลือกมุมที่แถวหมึกชัดที่สุด"""
+    if PREPROCESS_MAX_SKEW <= 0:
+        return 0.0
+    scale = min(1.0, SKEW_SAMPLE_WIDTH / ink.shape[1])
+    small = cv2.resize(ink, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else ink
+    angles = np.arange(-PREPROCESS_MAX_SKEW, PREPROCESS_MAX_SKEW + SKEW_STEP / 2, SKEW_STEP)
+    scores = [np.var(_rotate(small, angle, 0, cv2.INTER_NEAREST).sum(axis=1, dtype=np.float64)) for angle in angles]
+    return float(angles[int(np.argmax(scores))])
+
+
+def text_height(ink: np.ndarray) -> float | None:
+    """ความสูงตัวอักษร (median ของ connected component ขนาดตัวอักษร) None ถ้าหาไม่ได้"""
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    glyphs = heights[(areas >= 8) & (heights >= 4) & (heights <= ink.shape[0] * 0.1)]
+    return float(np.median(glyphs)) if glyphs.size else None
+
+
+def preprocess_page(gray: np.ndarray) -> np.ndarray:
+    """ภาพ grayscale (uint8, h x w) -> ภาพที่พร้อมส่ง OCR"""
+    level, ink = _ink_mask(gray)
+    if not ink.any():
+        return gray
+
+    angle = estimate_skew(ink)
+    if abs(angle) >= SKEW_STEP:
+        gray = _rotate(gray, angle, 255)
+        ink = _rotate(ink, angle, 0, cv2.INTER_NEAREST)
+
+    # ตัดขอบว่าง เหลือขอบไว้นิดหน่อยไม่ให้ตัวอักษรชิดขอบภาพ
+    x, y, w, h = cv2.boundingRect(cv2.findNonZero(ink))
+    pad = max(4, int(min(gray.shape) * 0.01))
+    y0, x0 = max(0, y - pad), max(0, x - pad)
+    gray = gray[y0:y + h + pad, x0:x + w + pad]
+    ink = ink[y0:y + h + pad, x0:x + w + pad]
+
+    height = text_height(ink)
+    if height:
+        scale = max(PREPROCESS_MIN_SCALE, min(1.0, PREPROCESS_TEXT_HEIGHT / height))
+        if scale < 0.95:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    if PREPROCESS_BINARIZE:
+        gray = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+    else:
+        # พื้นกระดาษ/noise ที่สว่างกว่ากึ่งกลางระหว่าง threshold กับสีขาว ให้เป็นขาวล้วน (ขอบตัวอักษรยังเป็นเทาอยู่)
+        gray = np.where(gray > (level + 255) / 2, 255, gray).astype(np.uint8)
+    return np.ascontiguousarray(gray)
+
+
+
+def encode_preprocessed(img: np.ndarray) -> tuple[bytes, str]:
+    """ภาพจาก preprocess_page -> (data, mime) ขาว/ดำล้วนเป็น PNG 1 bit, grayscale เลือก PNG/JPEG ที่เล็กกว่า"""
+    pil = Image.fromarray(img)
+    if PREPROCESS_BINARIZE:
+        return encode_image(pil.convert("1"), "png")
+    # สแกนที่มี noise มาก PNG อาจใหญ่กว่า JPEG
+    return min(encode_image(pil, "png"), encode_image(pil, "jpeg"), key=lambda encoded: len(encoded[0]))
@@ -0,0 +1,182 @@
+"""
+ส่งความคืบหน้าของ Celery task ไปยัง websocket แบบ push ผ่าน Redis pub/sub
+- ฝั่ง worker: report_state() อัปเดต state ใน result backend เหมือนเดิม แล้ว publish event
+  และเก็บ state ล่าสุดไว้ให้ client ที่เพิ่งเข้ามาดู
+  งานที่จบ (SUCCESS/FAILURE จาก exception) publish ให้อัตโนมัติผ่าน Celery signal
+- ฝั่ง API: progress_hub มี subscriber แบบ async ตัวเดียวต่อ process กระจาย event ให้ทุก websocket
+  ที่ดู task นั้นอยู่ ไม่ต้อง poll AsyncResult ทีละ socket
+- publish_page() ส่งข้อความของแต่ละหน้าทันทีที่ OCR เสร็จ (event "PAGE") และเก็บไว้ให้ client ที่เข้ามาทีหลัง
+"""
+import asyncio
+import json
+import os
+import urllib.parse
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from celery.signals import task_failure, task_success
+from dotenv import load_dotenv
+from redis import Redis
+from redis import asyncio as aioredis
+
+load_dotenv()
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+r = Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+
+PROGRESS_CHANNEL = "task:progress"
+LAST_STATE_TTL = 24 * 3600
+SUBSCRIBE_TIMEOUT = 5
+
+# task ที่มี websocket ติดตามอยู่ (merge_ocr_pages ใช้ task id เดิมของ process_ocr)
+PUBLISHED_TASKS = {
+    "controllers.ocr_controller.process_ocr",
+    "controllers.ocr_controller.merge_ocr_pages",
+    "controllers.wiki_controller.generate_wiki",
+}
+
+
+def _last_state_key(task_id: str) -> str:
+    return f"task:progress:last:{task_id}"
+
+
+def _pages_key(task_id: str) -> str:
+    return f"task:progress:pages:{task_id}"
+
+
+def publish_progress(task_id: str, state: str, meta=None, result=None):
+    event = json.dumps({"task_id": task_id, "state": state, "meta": meta, "result": result}, ensure_ascii=False)
+    try:
+        pipe = r.pipeline()
+        pipe.set(_last_state_key(task_id), event, ex=LAST_STATE_TTL)
+        pipe.publish(PROGRESS_CHANNEL, event)
+        pipe.execute()
+    except Exception as e:
+        # แจ้ง progress ไม่ได้ไม่ควรทำให้ task ล้ม
+        print(f"Publish progress failed: {e}")
+
+
+def publish_page(task_id: str, page_number: int, total_pages: int, text: str):
+    """ส่งข้อความของหน้าที่ OCR เสร็จ ไม่แทนที่ state ล่าสุด (PROGRESS ยังแยกอยู่)"""
+    event = json.dumps(
+        {"task_id": task_id, "state": "PAGE", "meta": {"page": page_number, "total_page": total_pages, "text": text}},
+        ensure_ascii=False,
+    )
+    try:
+        pipe = r.pipeline()
+        pipe.rpush(_pages_key(task_id), event)
+        pipe.expire(_pages_key(task_id), LAST_STATE_TTL)
+        pipe.publish(PROGRESS_CHANNEL, event)
+        pipe.execute()
+    except Exception as e:
+        print(f"Publish page failed: {e}")
+
+
+def report_state(task, state: str, meta=None, task_id: str | None = None):
+    """แทน task.update_state(): เก็บใน result backend และ publish ให้ websocket"""
+    task_id = task_id or task.request.id
+    task.update_state(task_id=task_id, state=state, meta=meta)
+    publish_progress(task_id, state, meta)
+
+
+@task_success.connect
+def _publish_success(sender=None, result=None, **kwargs):
+    if sender is not None and sender.name in PUBLISHED_TASKS:
+        publish_progress(sender.request.id, "SUCCESS", result=result)
+
+
+@task_failure.connect
+def _publish_failure(sender=None, task_id=None, **kwargs):
+    if sender is not None and sender.name in PUBLISHED_TASKS:
+        publish_progress(task_id, "FAILURE")
+
+
+class ProgressHub:
+    """subscriber ตัวเดียวต่อ API process กระจาย event ไปยัง queue ของแต่ละ websocket"""
+
+    def __init__(self):
+        self._watchers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self._redis: aioredis.Redis | None = None
+        self._listener: asyncio.Task | None = None
+        # set เมื่อ Redis ยืนยันการ subscribe แล้ว (event ที่ publish หลังจากนี้ไม่หลุด)
+        self._subscribed = asyncio.Event()
+
+    def _ensure_started(self):
+        if self._redis is None:
+            self._redis = aioredis.Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        reconnect = False
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(PROGRESS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "subscribe":
+                            self._subscribed.set()
+                            if reconnect:
+                                # event ที่ publish ระหว่างหลุดการเชื่อมต่อหายไปแล้ว ส่ง state ล่าสุดให้ทุกคนที่ดูอยู่ใหม่
+                                for task_id, queues in list(self._watchers.items()):
+                                    for event in await self._backlog(task_id):
+                                        for queue in list(queues):
+                                            queue.put_nowait(event)
+                            continue
+                        if message["type"] != "message":
+                            continue
+                        event = json.loads(message["data"])
+                        for queue in list(self._watchers.get(event["task_id"], ())):
+                            queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Progress subscriber error: {e}")
+                self._subscribed.clear()
+                reconnect = True
+                await asyncio.sleep(1)
+
+    async def _backlog(self, task_id: str) -> list[dict]:
+        """หน้าที่เสร็จแล้วตามด้วย state ล่าสุดของ task (อาจซ้ำกับ event สด ให้ดูจากเลขหน้า)"""
+        events = [json.loads(page) for page in await self._redis.lrange(_pages_key(task_id), 0, -1)]
+        last = await self._redis.get(_last_state_key(task_id))
+        if last:
+            events.append(json.loads(last))
+        return events
+
+    @staticmethod
+    async def _wait_disconnect(websocket, queue: asyncio.Queue):
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        queue.put_nowait(None)
+
+    @asynccontextmanager
+    async def watch(self, task_id: str, websocket=None):
+        """
+        queue ของ event ของ task นี้ (event แรกคือ state ล่าสุด ถ้ามี)
+        ถ้าส่ง websocket มา จะได้ None ใน queue เมื่อ client ปิดการเชื่อมต่อ
+        """
+        self._ensure_started()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._watchers[task_id].add(queue)
+        disconnect = asyncio.create_task(self._wait_disconnect(websocket, queue)) if websocket is not None else None
+        try:
+            # อ่าน state ล่าสุดหลัง subscribe สำเร็จเท่านั้น ไม่งั้น event ที่ publish ระหว่างนั้น (เช่น SUCCESS
+            # ของงานที่เจอ cache) จะไม่อยู่ทั้งใน state ล่าสุดและใน event สด
+            try:
+                await asyncio.wait_for(self._subscribed.wait(), timeout=SUBSCRIBE_TIMEOUT)
+            except asyncio.TimeoutError:
+                print("Progress subscriber not ready, reading last state anyway")
+            for event in await self._backlog(task_id):
+                queue.put_nowait(event)
+            yield queue
+        finally:
+            if disconnect is not None:
+                disconnect.cancel()
+            self._watchers[task_id].discard(queue)
+            if not self._watchers[task_id]:
+                del self._watchers[task_id]
+
+
+progress_hub = ProgressHub()
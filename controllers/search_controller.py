@@ -0,0 +1,160 @@
+"""
+ค้นหาเอกสารแบบ full-text ด้วย tsvector ของ Postgres
+Parser ของ Postgres ตัดคำภาษาไทยไม่ได้ จึงตัดคำด้วย pythainlp ฝั่ง Python แล้วสร้าง tsvector/tsquery
+เป็น literal เอง (ไม่ผ่าน to_tsvector) ทั้งตอนบันทึกเอกสารและตอนค้นหา เพื่อให้ lexeme ตรงกันเสมอ
+"""
+import html
+import re
+
+from fastapi import HTTPException
+from pythainlp.tokenize import word_tokenize
+from pythainlp.util import thai_digit_to_arabic_digit
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+MAX_POSITION = 16383           # ตำแหน่งสูงสุดที่ tsvector รับได้
+MAX_POSITIONS_PER_LEXEME = 256
+MAX_LEXEME_BYTES = 2046
+
+_WORD_CHAR = re.compile(r"[0-9A-Za-z\u0E00-\u0E7F]")
+
+
+def tokenize(text_: str | None) -> list[str]:
+    """ตัดคำ (ไทย+อังกฤษ) ให้เป็น lexeme ที่ใช้ทั้งตอนทำ index และตอนค้นหา"""
+    if not text_:
+        return []
+    text_ = thai_digit_to_arabic_digit(text_).lower()
+    tokens = []
+    for token in word_tokenize(text_, keep_whitespace=False):
+        token = token.strip()
+        if token and _WORD_CHAR.search(token) and len(token.encode("utf-8")) <= MAX_LEXEME_BYTES:
+            tokens.append(token)
+    return tokens
+
+
+def _quote_lexeme(token: str) -> str:
+    return "'" + token.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def build_search_vector(doc_name: str | None, keywords: list[str] | None, ocr_text: str | None) -> str:
+    """
+    สร้าง tsvector literal พร้อมตำแหน่งและน้ำหนัก: ชื่อเอกสาร = A, keyword = B, เนื้อหา OCR = C
+    """
+    positions: dict[str, list[str]] = {}
+    pos = 0
+    for weight, source in (("A", doc_name), ("B", " ".join(keywords or [])), ("C", ocr_text)):
+        for token in tokenize(source):
+            pos = min(pos + 1, MAX_POSITION)
+            entries = positions.setdefault(token, [])
+            if len(entries) < MAX_POSITIONS_PER_LEXEME:
+                entries.append(f"{pos}{weight}")
+    return " ".join(f"{_quote_lexeme(tok)}:{','.join(entries)}" for tok, entries in positions.items())
+
+
+def build_search_query(q: str) -> tuple[str, list[str]]:
+    """แปลงคำค้นเป็น tsquery literal (ทุกคำต้องพบ, คำสุดท้ายค้นแบบขึ้นต้นด้วย) และคืนรายการคำที่ใช้"""
+    terms = list(dict.fromkeys(tokenize(q)))
+    if not terms:
+        return "", []
+    parts = [_quote_lexeme(t) for t in terms]
+    parts[-1] += ":*"
+    return " & ".join(parts), terms
+
+
+def make_snippet(ocr_text: str | None, terms: list[str], width: int = 160) -> str:
+    """ตัดข้อความรอบคำที่ค้นเจอ และครอบคำนั้นด้วย <mark> (escape HTML ก่อน)"""
+    if not ocr_text:
+        return ""
+    lowered = ocr_text.lower()
+    hits = [i for i in (lowered.find(t) for t in terms) if i >= 0]
+    center = min(hits) if hits else 0
+    start = max(center - width // 2, 0)
+    end = min(start + width, len(ocr_text))
+    snippet = html.escape(ocr_text[start:end])
+    if terms:
+        pattern = re.compile("|".join(re.escape(html.escape(t)) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+        snippet = pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", snippet)
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(ocr_text) else "")
+
+
+# ผลลัพธ์, จำนวนทั้งหมด และ facet ได้มาใน query เดียว
+_SEARCH_SQL = text("""
+WITH matched AS (
+    SELECT d."docId", d."docName", m."factionName", m."typeName", m."publishedDate",
+           ts_rank_cd(d."searchVector", q.query) AS rank
+    FROM document d
+    JOIN meta m ON m."metaId" = d."metaId"
+    CROSS JOIN (SELECT CAST(:query AS tsquery) AS query) q
+    WHERE d."searchVector" @@ q.query
+      AND d.status IS TRUE
+      AND (CAST(:faction AS varchar) IS NULL OR m."factionName" = :faction)
+      AND (CAST(:type AS varchar) IS NULL OR m."typeName" = :type)
+      AND (CAST(:year AS integer) IS NULL OR extract(year FROM m."publishedDate") = :year)
+),
+hits AS (
+    SELECT mt.*, d."ocrText"
+    FROM (SELECT * FROM matched ORDER BY rank DESC, "docId" LIMIT :limit OFFSET :offset) mt
+    JOIN document d ON d."docId" = mt."docId"
+),
+facets AS (
+    SELECT CASE WHEN GROUPING("factionName") = 0 THEN 'faction'
+                WHEN GROUPING("typeName") = 0 THEN 'type'
+                ELSE 'year' END AS facet,
+           COALESCE("factionName", "typeName", year::text) AS value,
+           count(*) AS count
+    FROM (SELECT "factionName", "typeName", extract(year FROM "publishedDate")::int AS year FROM matched) f
+    GROUP BY GROUPING SETS (("factionName"), ("typeName"), (year))
+)
+SELECT (SELECT count(*) FROM matched) AS total,
+       (SELECT COALESCE(json_agg(hits ORDER BY rank DESC, "docId"), '[]') FROM hits) AS hits,
+       (SELECT COALESCE(json_agg(facets ORDER BY facet, count DESC), '[]') FROM facets) AS facets
+""")
+
+
+def search_documents(
+    db: Session,
+    q: str,
+    faction_name: str | None = None,
+    type_name: str | None = None,
+    year: int | None = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    """
+    ค้นหาเอกสาร เรียงตามคะแนน (ts_rank_cd) พร้อม snippet และจำนวนตามฝ่าย/ประเภท/ปี
+    """
+    query, terms = build_search_query(q)
+    if not query:
+        raise HTTPException(status_code=400, detail="Search query is empty")
+
+    row = db.execute(_SEARCH_SQL, {
+        "query": query,
+        "faction": faction_name,
+        "type": type_name,
+        "year": year,
+        "limit": limit,
+        "offset": offset,
+    }).one()
+
+    facets = {"faction": {}, "type": {}, "year": {}}
+    for f in row.facets:
+        if f["value"] is not None:
+            facets[f["facet"]][f["value"]] = f["count"]
+
+    return {
+        "total": row.total,
+        "items": [
+            {
+                "docId": h["docId"],
+                "docName": h["docName"],
+                "factionName": h["factionName"],
+                "typeName": h["typeName"],
+                "publishDate": h["publishedDate"] or "",
+                "rank": h["rank"],
+                "snippet": make_snippet(h["ocrText"], terms),
+                "files": [f"/document/download/{h['docId']}"],
+            }
+            for h in row.hits
+        ],
+        "facets": facets,
+    }
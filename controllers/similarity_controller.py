@@ -0,0 +1,187 @@
+"""
+หาเอกสารซ้ำ/เอกสารที่เกี่ยวข้องด้วย MinHash + LSH
+- signature: MinHash 384 ค่า จาก shingle ตัวอักษร 5 ตัว (ไม่ต้องตัดคำ จึงใช้กับภาษาไทยได้ตรง ๆ)
+  คำนวณจากข้อความล้วนเสมอ (ข้อความ OCR ที่เป็น HTML ต้องลอก tag ก่อน ไม่งั้นเอกสารเดียวกันได้ Jaccard ไม่ถึง 0.9)
+- index: LSH 128 band x 3 row เก็บใน Redis (ใช้ร่วมกันทุก worker) เพิ่ม/ลบทีละเอกสาร ไม่ต้องเทียบทุกคู่
+  threshold ของ LSH ~ (1/128)^(1/3) = 0.2 ต่ำกว่า RELATED_THRESHOLD (0.3) คู่ที่ Jaccard 0.3 เป็น candidate
+  ~97% (1-(1-0.3^3)^128) ส่วนคู่ที่ไม่เกี่ยวข้องเป็น candidate ~12% ที่ Jaccard 0.1 และ ~1.6% ที่ 0.05
+  (แบบ 64 x 2 ได้ ~47% และ ~15% ทำให้ bucket ใหญ่มากเมื่อเอกสารเยอะ, แบบ 64 x 4 เจอคู่ที่ 0.3 แค่ ~41%)
+  candidate ที่เกิน MAX_CANDIDATES เลือกเฉพาะที่ตรงกันหลาย band ที่สุดก่อนดึง signature
+- signature ถูกเก็บใน Document.minhash ด้วย เพื่อสร้าง index ใหม่ได้ (python migrate.py lsh-index)
+  เปลี่ยน NUM_PERM/BANDS แล้วต้องรัน python migrate.py lsh-index ใหม่ (signature ที่ขนาดไม่ตรงจะถูกคำนวณใหม่)
+"""
+import os
+import re
+import urllib.parse
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+from pythainlp.util import thai_digit_to_arabic_digit
+from redis import Redis
+
+load_dotenv()
+
+NUM_PERM = 384
+BANDS = 128
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+MIN_TEXT_LENGTH = 50  # ข้อความสั้นกว่านี้ไม่ทำ signature (ผลไม่น่าเชื่อถือ)
+
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.8"))
+RELATED_THRESHOLD = float(os.getenv("RELATED_THRESHOLD", "0.3"))
+MAX_CANDIDATES = int(os.getenv("LSH_MAX_CANDIDATES", "2000"))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(1)  # seed คงที่ ทุก process ต้องได้ค่า a, b ชุดเดียวกัน
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_CHUNK = 4096
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+# เก็บ signature เป็น bytes จึงไม่ใช้ decode_responses
+r = Redis(host=url.hostname, port=url.port, password=url.password)
+
+_SPACE = re.compile(r"\s+")
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """hash ของ shingle ตัวอักษรทุกตัว (rolling hash แบบ vectorized) คืนค่าที่ไม่ซ้ำเป็น uint64"""
+    text = _SPACE.sub("", thai_digit_to_arabic_digit(text).lower())
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < SHINGLE_SIZE:
+        return np.empty(0, dtype=np.uint64)
+    h = np.zeros(len(codes) - SHINGLE_SIZE + 1, dtype=np.uint64)
+    for j in range(SHINGLE_SIZE):
+        h = h * np.uint64(1000003) + codes[j:len(codes) - SHINGLE_SIZE + 1 + j]
+    return np.unique(h & _MAX_HASH)
+
+
+def compute_signature(text: str | None) -> np.ndarray | None:
+    """MinHash signature (uint32 ขนาด NUM_PERM) หรือ None ถ้าข้อความสั้นเกินไป"""
+    if not text or len(text) < MIN_TEXT_LENGTH:
+        return None
+    hashes = _shingle_hashes(text)
+    if hashes.size == 0:
+        return None
+    sig = np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i in range(0, hashes.size, _CHUNK):
+            hv = hashes[i:i + _CHUNK]
+            phv = ((_PERM_A[:, None] * hv[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME) & _MAX_HASH
+            np.minimum(sig, phv.min(axis=1), out=sig)
+    return sig.astype(np.uint32)
+
+
+def signature_to_bytes(sig: np.ndarray) -> bytes:
+    return sig.astype("<u4").tobytes()
+
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4")
+
+
+def is_current_signature(data: bytes | None) -> bool:
+    """signature ที่เก็บไว้ใช้กับ NUM_PERM ปัจจุบันได้ไหม (ของรูปแบบเดิมต้องคำนวณใหม่)"""
+    return bool(data) and len(data) == NUM_PERM * 4
+
+
+# prefix ของ bucket ตามรูปแบบ band ไม่ปนกับ bucket ของรูปแบบเดิม
+BUCKET_PREFIX = f"lsh:b{BANDS}x{ROWS}"
+
+
+def _band_keys(sig: np.ndarray) -> list[str]:
+    raw = signature_to_bytes(sig)
+    step = ROWS * 4
+    return [f"{BUCKET_PREFIX}:{i}:{raw[i * step:(i + 1) * step].hex()}" for i in range(BANDS)]
+
+
+def drop_stale_buckets() -> int:
+    """ลบ bucket ของรูปแบบ band เดิม (เรียกตอน rebuild index) คืนจำนวน key ที่ลบ"""
+    stale = [
+        key for key in r.scan_iter("lsh:*", count=1000)
+        if not key.startswith(b"lsh:sig:") and not key.startswith(BUCKET_PREFIX.encode() + b":")
+    ]
+    for i in range(0, len(stale), 1000):
+        r.delete(*stale[i:i + 1000])
+    return len(stale)
+
+
+def index_document(doc_id: int, sig: np.ndarray) -> None:
+    """เพิ่มเอกสารเข้า LSH index"""
+    pipe = r.pipeline(transaction=False)
+    for key in _band_keys(sig):
+        pipe.sadd(key, doc_id)
+    pipe.set(f"lsh:sig:{doc_id}", signature_to_bytes(sig))
+    pipe.execute()
+
+
+def remove_document(doc_id: int, sig: np.ndarray) -> None:
+    """เอาเอกสารออกจาก LSH index (ใช้ signature เดิมเพื่อรู้ว่าอยู่ใน bucket ไหน)"""
+    pipe = r.pipeline(transaction=False)
+    for key in _band_keys(sig):
+        pipe.srem(key, doc_id)
+    pipe.delete(f"lsh:sig:{doc_id}")
+    pipe.execute()
+
+
+def find_similar(sig: np.ndarray, exclude: int | None = None, limit: int | None = 10) -> list[tuple[int, float]]:
+    """
+    หา candidate จาก bucket ที่ band ตรงกัน แล้วประมาณ Jaccard จาก signature
+    คืน [(docId, similarity)] เรียงจากมากไปน้อย เฉพาะที่ >= RELATED_THRESHOLD (limit=None คืนทั้งหมด)
+    """
+    pipe = r.pipeline(transaction=False)
+    for key in _band_keys(sig):
+        pipe.smembers(key)
+    # นับจำนวน band ที่ตรงกัน คู่ที่คล้ายกันมากจะตรงหลาย band จึงใช้เลือกเมื่อ candidate เกิน MAX_CANDIDATES
+    hits = Counter(int(m) for members in pipe.execute() for m in members)
+    hits.pop(exclude, None)
+    if not hits:
+        return []
+
+    ids = [doc_id for doc_id, _ in hits.most_common(MAX_CANDIDATES)]
+    raw = r.mget([f"lsh:sig:{i}" for i in ids])
+    pairs = [(doc_id, data) for doc_id, data in zip(ids, raw) if is_current_signature(data)]
+    if not pairs:
+        return []
+    sigs = np.stack([signature_from_bytes(data) for _, data in pairs])
+    scores = (sigs == sig[None, :]).mean(axis=1)
+
+    results = [(doc_id, float(score)) for (doc_id, _), score in zip(pairs, scores) if score >= RELATED_THRESHOLD]
+    results.sort(key=lambda x: -x[1])
+    return results if limit is None else results[:limit]
+
+
+def suggest_related(db, ocr_text: str | None, exclude: int | None = None, limit: int = 10) -> dict:
+    """
+    แยกผลจาก find_similar เป็นเอกสารซ้ำ (>= DUPLICATE_THRESHOLD) และเอกสารที่เกี่ยวข้อง
+    ocr_text เป็น HTML จาก OCR ได้ (ลอก tag ก่อน ให้ตรงกับ signature ที่เก็บจาก Document.ocrText)
+    คืนเฉพาะเอกสารที่ยังเปิดใช้งาน (status = True) ไม่เกิน limit รายการ
+    """
+    from controllers.ocr_controller import richtext_to_plaintext
+    from models.document import Document
+
+    plain_text, _ = richtext_to_plaintext(ocr_text or "")
+    sig = compute_signature(plain_text)
+    if sig is None:
+        return {"duplicates": [], "related": []}
+    try:
+        matches = find_similar(sig, exclude=exclude, limit=None)
+    except Exception as e:
+        print(f"LSH lookup failed: {e}")
+        return {"duplicates": [], "related": []}
+    if not matches:
+        return {"duplicates": [], "related": []}
+
+    names = dict(
+        db.query(Document.docId, Document.docName)
+        .filter(Document.docId.in_([doc_id for doc_id, _ in matches]), Document.status.is_(True))
+        .all()
+    )
+    duplicates, related = [], []
+    for doc_id, score in [m for m in matches if m[0] in names][:limit]:
+        item = {"docId": doc_id, "docName": names[doc_id], "similarity": round(score, 3)}
+        (duplicates if score >= DUPLICATE_THRESHOLD else related).append(item)
+    return {"duplicates": duplicates, "related": related}
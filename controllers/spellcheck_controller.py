@@ -0,0 +1,111 @@
+"""
+ตรวจคำผิด (thaispellcheck) เฉพาะข้อความ ไม่ส่ง markup เข้าไปตัดคำด้วย และจำผลรายบรรทัด
+- แยก HTML เป็น tag กับ text node ตรวจเฉพาะ text node (tag <คำผิด> จากการตรวจครั้งก่อนถูกลบออกก่อนตรวจใหม่)
+- ผลของแต่ละบรรทัด cache ใน Redis ตาม SHA-1 ของบรรทัด แก้เอกสารแล้วตรวจซ้ำ เสียเวลาแค่บรรทัดที่เปลี่ยน
+- บรรทัดที่ไม่มีใน cache ตั้งแต่ SPELLCHECK_PARALLEL_MIN_LINES บรรทัดขึ้นไป กระจายให้ process pool ตรวจพร้อมกัน
+  (thaispellcheck เป็น Python ล้วน แยก thread ไม่เร็วขึ้นเพราะ GIL) ถ้าสร้าง process ลูกไม่ได้
+  (เช่น ใน Celery worker ที่เป็น daemon process) จะตรวจทีละบรรทัดแทน
+"""
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+import thaispellcheck
+from dotenv import load_dotenv
+from redis import Redis
+
+load_dotenv()
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+r = Redis(host=url.hostname, port=url.port, password=url.password, decode_responses=True)
+
+SPELLCHECK_CACHE_TTL = int(os.getenv("SPELLCHECK_CACHE_TTL", str(7 * 24 * 3600)))
+SPELLCHECK_WORKERS = int(os.getenv("SPELLCHECK_WORKERS", str(os.cpu_count() or 1)))  # 1 = ไม่ใช้ process pool
+SPELLCHECK_PARALLEL_MIN_LINES = int(os.getenv("SPELLCHECK_PARALLEL_MIN_LINES", "64"))
+
+PREFIX = "spellcheck:v1"
+
+# แยกที่ tag และขึ้นบรรทัดใหม่ (ข้อความธรรมดาหลายบรรทัดก็ cache ได้รายบรรทัด)
+_SPLIT = re.compile(r'(<[^>]*>|\n)')
+_MARK = re.compile(r'</?คำผิด>')
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_pool_broken = False
+
+
+def _line_key(line: str) -> str:
+    return f"{PREFIX}:{hashlib.sha1(line.encode('utf-8')).hexdigest()}"
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if _pool_broken or SPELLCHECK_WORKERS <= 1 or multiprocessing.current_process().daemon:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: process ลูกโหลดแค่ thaispellcheck ไม่ fork thread/connection ของ API ติดไปด้วย
+            _pool = ProcessPoolExecutor(max_workers=SPELLCHECK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _check_many(lines: list[str]) -> list[str]:
+    global _pool_broken
+    pool = _get_pool() if len(lines) >= SPELLCHECK_PARALLEL_MIN_LINES else None
+    if pool is not None:
+        try:
+            return list(pool.map(thaispellcheck.check, lines, chunksize=max(1, len(lines) // (SPELLCHECK_WORKERS * 4))))
+        except Exception as e:
+            print(f"Spellcheck process pool failed, checking sequentially: {e}")
+            _pool_broken = True
+    return [thaispellcheck.check(line) for line in lines]
+
+
+def check_lines(lines: list[str]) -> list[str]:
+    """ตรวจคำผิดทีละบรรทัด (ข้อความล้วน) คืนบรรทัดที่ครอบคำผิดด้วย <คำผิด>...</คำผิด>"""
+    unique = list({line for line in lines if line.strip()})
+    if not unique:
+        return list(lines)
+
+    keys = [_line_key(line) for line in unique]
+    try:
+        cached = r.mget(keys)
+    except Exception as e:
+        # cache ใช้ไม่ได้ไม่ควรทำให้ตรวจคำผิดล้ม
+        print(f"Spellcheck cache read failed: {e}")
+        cached = [None] * len(unique)
+    results = {line: value for line, value in zip(unique, cached) if value is not None}
+
+    missing = [line for line in unique if line not in results]
+    if missing:
+        checked = _check_many(missing)
+        results.update(zip(missing, checked))
+        try:
+            pipe = r.pipeline()
+            for line, value in zip(missing, checked):
+                pipe.set(_line_key(line), value, ex=SPELLCHECK_CACHE_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"Spellcheck cache write failed: {e}")
+
+    return [results.get(line, line) for line in lines]
+
+
+def check_many_html(texts: list[str]) -> list[str]:
+    """ตรวจคำผิดเฉพาะ text node ของ HTML/ข้อความหลายชิ้นในครั้งเดียว tag คงเดิม บรรทัดที่ซ้ำกันตรวจครั้งเดียว"""
+    # re.split ที่มี group: index คู่คือข้อความ index คี่คือ tag/ขึ้นบรรทัด
+    split = [_SPLIT.split(_MARK.sub('', text)) for text in texts]
+    nodes = [node for parts in split for node in parts[0::2]]
+    checked = iter(check_lines(nodes))
+    for parts in split:
+        parts[0::2] = [next(checked) for _ in parts[0::2]]
+    return [''.join(parts) for parts in split]
+
+
+def check_html(html: str) -> str:
+    return check_many_html([html])[0]
@@ -0,0 +1,168 @@
+"""
+พื้นที่พักไฟล์ที่อัปโหลดมาให้ OCR ก่อนส่งเข้า Celery
+API เขียนไฟล์ครั้งเดียวแล้วส่งแค่ ref (string สั้นๆ) ไปกับ task แทนการส่ง bytes ทั้งไฟล์ผ่าน Redis broker
+- OCR_STAGING=local (ค่าเริ่มต้น): ไฟล์ใน OCR_STAGING_DIR ซึ่งต้องเป็น volume ที่ API กับ worker แชร์กัน
+- OCR_STAGING=redis: แบ่งเป็น chunk ละ 1 MB ใน Redis พร้อม TTL (ใช้เมื่อไม่มี volume กลาง)
+task ลบไฟล์ทิ้งเมื่อทำเสร็จ ไฟล์ที่ค้าง (worker ตาย/ยกเลิก) หมดอายุเองตาม OCR_STAGING_TTL
+"""
+import hashlib
+import os
+import tempfile
+import time
+import urllib.parse
+import uuid
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from dotenv import load_dotenv
+from redis import Redis
+
+load_dotenv()
+
+OCR_STAGING = os.getenv("OCR_STAGING", "local").lower()
+OCR_STAGING_DIR = Path(os.getenv("OCR_STAGING_DIR", "file/staging"))
+OCR_STAGING_TTL = int(os.getenv("OCR_STAGING_TTL", str(6 * 3600)))
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+redis_url = os.getenv("REDIS_URL")
+url = urllib.parse.urlparse(redis_url)
+r = Redis(host=url.hostname, port=url.port, password=url.password)
+
+
+def _local_path(name: str) -> Path:
+    return OCR_STAGING_DIR / name
+
+
+def _redis_key(name: str) -> str:
+    return f"ocr:staging:{name}"
+
+
+def _sweep_local():
+    """ลบไฟล์ที่ค้างเกิน TTL (task ที่ตายกลางทางจะไม่ได้ลบเอง)"""
+    cutoff = time.time() - OCR_STAGING_TTL
+    for path in OCR_STAGING_DIR.glob("*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def stage_stream(stream, suffix: str = "") -> str:
+    """เขียนไฟล์จาก file-like object ทีละ chunk คืน ref สำหรับส่งให้ task"""
+    name = f"{uuid.uuid4().hex}{suffix}"
+    if OCR_STAGING == "redis":
+        key = _redis_key(name)
+        # ส่งทีละ chunk ไม่พักทั้งไฟล์ไว้ใน pipeline และตั้ง TTL ตั้งแต่ chunk แรก
+        # ถ้า API ตายกลางทาง key ที่เขียนไปแล้วยังหมดอายุเอง
+        try:
+            while chunk := stream.read(CHUNK_SIZE):
+                pipe = r.pipeline()
+                pipe.rpush(key, chunk)
+                pipe.expire(key, OCR_STAGING_TTL)
+                pipe.execute()
+        except Exception:
+            r.delete(key)
+            raise
+        return f"redis:{name}"
+
+    OCR_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    _sweep_local()
+    fd, tmp_path = tempfile.mkstemp(dir=OCR_STAGING_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp_path, _local_path(name))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return f"local:{name}"
+
+
+def stage_upload(file) -> str:
+    """เขียน UploadFile ลง staging (เรียกใน threadpool เพราะอ่าน/เขียนแบบ sync)"""
+    file.file.seek(0)
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    return stage_stream(file.file, suffix)
+
+
+def iter_staged(ref: str):
+    """อ่านไฟล์ที่พักไว้ทีละ chunk"""
+    backend, name = ref.split(":", 1)
+    if backend == "redis":
+        key = _redis_key(name)
+        length = r.llen(key)
+        if length == 0:
+            raise KeyError(ref)
+        for i in range(length):
+            yield r.lindex(key, i)
+        return
+    try:
+        f = open(_local_path(name), "rb")
+    except FileNotFoundError:
+        raise KeyError(ref)
+    with f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def read_staged(ref: str) -> bytes:
+    return b"".join(iter_staged(ref))
+
+
+def staged_hash(ref: str) -> str:
+    """SHA-256 ของไฟล์ที่พักไว้ (อ่านทีละ chunk ไม่โหลดทั้งไฟล์)"""
+    h = hashlib.sha256()
+    for chunk in iter_staged(ref):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def upload_hash(file) -> str:
+    """SHA-256 ของ UploadFile ก่อนพักลง staging (ได้ค่าเดียวกับ staged_hash) แล้วกรอกลับไปต้นไฟล์"""
+    h = hashlib.sha256()
+    file.file.seek(0)
+    while chunk := file.file.read(CHUNK_SIZE):
+        h.update(chunk)
+    file.file.seek(0)
+    return h.hexdigest()
+
+
+def open_staged_pdf(ref: str) -> fitz.Document:
+    """
+    เปิด PDF ที่พักไว้ ให้ MuPDF อ่านจากไฟล์เองโดยไม่โหลดเป็น bytes ใน Python
+    แบบ redis เขียน chunk ลงไฟล์ชั่วคราวของ worker ก่อน (สแกนขนาดใหญ่ไม่ต้องอยู่ในหน่วยความจำทั้งไฟล์)
+    """
+    backend, name = ref.split(":", 1)
+    if backend == "local":
+        path = _local_path(name)
+        if not path.is_file():
+            raise KeyError(ref)
+        return fitz.open(path)
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        try:
+            for chunk in iter_staged(ref):
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    try:
+        return fitz.open(tmp.name, filetype="pdf")
+    finally:
+        # MuPDF เปิดไฟล์ค้างไว้แล้ว ลบชื่อไฟล์ได้ทันที พื้นที่ดิสก์คืนเมื่อปิดเอกสาร
+        os.remove(tmp.name)
+
+
+def delete_staged(ref: str):
+    backend, name = ref.split(":", 1)
+    if backend == "redis":
+        r.delete(_redis_key(name))
+    else:
+        try:
+            _local_path(name).unlink()
+        except FileNotFoundError:
+            pass
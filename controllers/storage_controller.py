@@ -0,0 +1,190 @@
+"""
+Blob store สำหรับไฟล์ PDF แบบ content-addressed (key = sha256 ของเนื้อไฟล์)
+- BLOB_STORE=local (ค่าเริ่มต้น): เก็บไฟล์ใน BLOB_STORE_DIR/<2 ตัวแรก>/<2 ตัวถัดไป>/<sha256>
+- BLOB_STORE=s3: S3 หรือ S3-compatible (เช่น MinIO) ผ่าน boto3
+ไฟล์ที่เนื้อหาเหมือนกันจะได้ key เดียวกัน จึงเก็บจริงแค่ครั้งเดียว
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from dotenv import load_dotenv
+
+try:
+    import boto3  # type: ignore
+except Exception:
+    boto3 = None
+
+load_dotenv()
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    """เก็บ blob เป็นไฟล์บนดิสก์ (หรือ volume ที่แชร์กัน)"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / key
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def put(self, data: bytes) -> str:
+        key = sha256_hex(data)
+        path = self._path(key)
+        if path.is_file():
+            return key  # มีอยู่แล้ว (dedup)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # เขียนลงไฟล์ชั่วคราวในโฟลเดอร์เดียวกันก่อนแล้วค่อย rename เพื่อไม่ให้มีไฟล์ครึ่ง ๆ กลาง ๆ
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def get(self, key: str) -> bytes:
+        with self.open(key) as f:
+            return f.read()
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open(key) as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """อ่านช่วงไบต์ [start, end] (รวม end) ทีละ chunk"""
+        with self.open(key) as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0 and (chunk := f.read(min(chunk_size, remaining))):
+                remaining -= len(chunk)
+                yield chunk
+
+    def size(self, key: str) -> int:
+        return self._path(key).stat().st_size
+
+    def stat(self, key: str) -> tuple[int, float]:
+        """คืน (ขนาดไฟล์, เวลาแก้ไขล่าสุดเป็น epoch seconds)"""
+        st = self._path(key).stat()
+        return st.st_size, st.st_mtime
+
+    def local_path(self, key: str) -> Path | None:
+        """path บนดิสก์ของ blob ใช้ส่งไฟล์ตรงด้วย FileResponse/sendfile"""
+        path = self._path(key)
+        return path if path.is_file() else None
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+
+class S3BlobStore:
+    """เก็บ blob ใน bucket ของ S3/S3-compatible (ตั้ง S3_ENDPOINT_URL เพื่อชี้ไป MinIO ได้)"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str | None = None):
+        if boto3 is None:
+            raise RuntimeError("BLOB_STORE=s3 requires boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def put(self, data: bytes) -> str:
+        key = sha256_hex(data)
+        if not self.exists(key):
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self._key(key),
+                Body=data,
+                ContentType="application/pdf",
+            )
+        return key
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            raise KeyError(key)
+        return obj["Body"]
+
+    def get(self, key: str) -> bytes:
+        return self.open(key).read()
+
+    def iter_chunks(self, key: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        body = self.open(key)
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def iter_range(self, key: str, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        obj = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{end}")
+        body = obj["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def size(self, key: str) -> int:
+        head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        return head["ContentLength"]
+
+    def stat(self, key: str) -> tuple[int, float]:
+        head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        return head["ContentLength"], head["LastModified"].timestamp()
+
+    def local_path(self, key: str) -> Path | None:
+        return None
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+_store = None
+
+
+def get_blob_store():
+    """คืน blob store ตามค่า BLOB_STORE (สร้างครั้งเดียวต่อ process)"""
+    global _store
+    if _store is None:
+        backend = os.getenv("BLOB_STORE", "local").lower()
+        if backend == "s3":
+            _store = S3BlobStore(
+                bucket=os.getenv("S3_BUCKET", "documents"),
+                prefix=os.getenv("S3_PREFIX", "pdf/"),
+                endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            )
+        elif backend == "local":
+            _store = LocalBlobStore(os.getenv("BLOB_STORE_DIR", "file/blobs"))
+        else:
+            raise RuntimeError(f"Unknown BLOB_STORE '{backend}'")
+    return _store
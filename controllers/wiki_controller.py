@@ -1,14 +1,17 @@
 import re
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
-import os, json, requests
+import os, json, requests, uuid
 from datetime import datetime
 from typing import List
 from collections import Counter
 
+from database import SessionLocal
 from models.document import Document
 from models.wiki import Wiki
 from schemas.wiki import WikiUpdate
+from controllers.ocr_controller import celery_app
+from controllers.progress_controller import report_state
 
 
 
@@ -225,14 +228,21 @@ def summarize_compact_rule_based(ocr_text: str, title: str) -> str:
     return " ".join(bullets) if bullets else summarize_rule_based(ocr_text, title, max_lines=6)
 
 # ---------- main entry (LLM + fallback) ----------
-def make_wiki_from_payload(doc_name: str, meta: dict, ocr_text: str) -> tuple[str, str, str]:
-    title = doc_name or "เอกสาร"
+def _default_summary(meta: dict) -> str:
     faction = meta.get("factionName") or "-"
     dtype   = meta.get("typeName") or "-"
     pub     = _fmt_date_th(meta.get("publishedDate") or meta.get("publishDate"))
     eff     = _fmt_date_th(meta.get("effectiveDate"))
+    return f"{dtype}ฉบับนี้ออกโดย{faction} ประกาศเมื่อ {pub} และมีผลใช้บังคับตั้งแต่ {eff}"
 
-    summary_default = f"{dtype}ฉบับนี้ออกโดย{faction} ประกาศเมื่อ {pub} และมีผลใช้บังคับตั้งแต่ {eff}"
+def make_placeholder_wiki(doc_name: str, meta: dict, ocr_text: str) -> tuple[str, str, str]:
+    """wiki แบบ rule-based (ไม่เรียก LLM) ใช้ระหว่างรอ generate_wiki หรือเมื่อ LLM ใช้ไม่ได้"""
+    title = doc_name or "เอกสาร"
+    return to_thai_digits(title), _default_summary(meta), to_thai_digits(summarize_compact_rule_based(ocr_text, title))
+
+def make_wiki_from_payload(doc_name: str, meta: dict, ocr_text: str) -> tuple[str, str, str]:
+    title = doc_name or "เอกสาร"
+    summary_default = _default_summary(meta)
 
     try:
         t, s, c = summarize_with_ollama(title, meta, ocr_text)
@@ -242,7 +252,81 @@ def make_wiki_from_payload(doc_name: str, meta: dict, ocr_text: str) -> tuple[st
         c = _normalize_thai_abbrev(_normalize_dates_to_be(c))
         return t or title, s or summary_default, c or summarize_compact_rule_based(ocr_text, title)
     except Exception:
-        return to_thai_digits(title), summary_default, to_thai_digits(summarize_compact_rule_based(ocr_text, title))   
+        return make_placeholder_wiki(doc_name, meta, ocr_text)
+
+# ---------- async job (Celery) ----------
+WIKI_PENDING = "PENDING"
+WIKI_SUCCESS = "SUCCESS"
+WIKI_FAILURE = "FAILURE"
+
+def create_pending_wiki(db: Session, doc_name: str, meta: dict, ocr_text: str) -> Wiki:
+    """
+    สร้าง wiki ชั่วคราว (rule-based) สถานะ PENDING พร้อม taskId
+    ต้องเรียก start_wiki_job หลัง commit เพื่อให้ worker เห็นแถวนี้
+    """
+    title, summary, content = make_placeholder_wiki(doc_name, meta, ocr_text)
+    wiki = Wiki(title=title, summary=summary, content=content, status=WIKI_PENDING, taskId=str(uuid.uuid4()))
+    db.add(wiki)
+    db.flush()
+    return wiki
+
+def mark_wiki_pending(wiki: Wiki) -> None:
+    """ให้ wiki เดิมรอสรุปใหม่ (เนื้อหาเดิมยังแสดงได้ระหว่างรอ)"""
+    wiki.status = WIKI_PENDING
+    wiki.taskId = str(uuid.uuid4())
+
+def start_wiki_job(wiki_id: int, task_id: str, doc_name: str, meta: dict, ocr_text: str) -> str | None:
+    """ส่งงานสรุป wiki เข้า Celery (เรียกหลัง commit แล้วเท่านั้น) คืน task id"""
+    try:
+        generate_wiki.apply_async(args=[wiki_id, doc_name, meta, ocr_text], task_id=task_id)
+        return task_id
+    except Exception as e:
+        print(f"Wiki job enqueue failed: {e}")
+        return None
+
+@celery_app.task(bind=True, max_retries=2, default_retry_delay=30)
+def generate_wiki(self, wiki_id: int, doc_name: str, meta: dict, ocr_text: str):
+    """
+    เรียก LLM สรุปเอกสารแล้วเขียนทับ wiki ชั่วคราว
+    ถ้า wiki ถูกแก้เองหรือมีงานใหม่มาแทน (taskId ไม่ตรง) จะไม่เขียนทับ
+    """
+    task_id = self.request.id
+    report_state(self, "PROGRESS", {"wikiId": wiki_id})
+    try:
+        title, summary, content = summarize_with_ollama(doc_name or "เอกสาร", meta or {}, ocr_text or "")
+        status = WIKI_SUCCESS
+    except Exception as e:
+        print(f"Wiki generation failed (wikiId={wiki_id}): {e}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        title = summary = content = None
+        status = WIKI_FAILURE
+
+    db = SessionLocal()
+    try:
+        wiki = db.query(Wiki).filter(Wiki.wikiId == wiki_id).first()
+        if not wiki or wiki.taskId != task_id:
+            return {"wikiId": wiki_id, "status": "SKIPPED"}
+        if status == WIKI_SUCCESS:
+            wiki.title = _normalize_thai_abbrev(_normalize_dates_to_be(title)) or wiki.title
+            wiki.summary = _normalize_thai_abbrev(_normalize_dates_to_be(summary)) or wiki.summary
+            wiki.content = _normalize_thai_abbrev(_normalize_dates_to_be(content)) or wiki.content
+        wiki.status = status  # FAILURE = ยังใช้ wiki แบบ rule-based อยู่
+        db.commit()
+        return {"wikiId": wiki_id, "status": status}
+    finally:
+        db.close()
+
+def get_wiki_task(task_id: str, db: Session) -> dict:
+    """สถานะงานสรุป wiki สำหรับ polling"""
+    wiki = db.query(Wiki).filter(Wiki.taskId == task_id).first()
+    if not wiki:
+        raise HTTPException(status_code=404, detail="Wiki task not found")
+    result = {"task_id": task_id, "wikiId": wiki.wikiId, "status": wiki.status}
+    if wiki.status != WIKI_PENDING:
+        result.update({"title": wiki.title, "summary": wiki.summary, "content": wiki.content})
+    return result
+
 #------------------get,update,del-----------------
 def update_wiki(db: Session, wiki_id: int, payload: WikiUpdate) -> Wiki:
     wiki = db.query(Wiki).filter(Wiki.wikiId == wiki_id).first()
@@ -259,6 +343,10 @@ def update_wiki(db: Session, wiki_id: int, payload: WikiUpdate) -> Wiki:
     for k, v in updates.items():
         setattr(wiki, k, v)
 
+    # แก้ไขเองแล้ว ไม่ให้งานสรุปที่ค้างอยู่มาเขียนทับ
+    if updates:
+        wiki.status = WIKI_SUCCESS
+        wiki.taskId = None
 
     db.commit()
     db.refresh(wiki)
@@ -0,0 +1,206 @@
+"""
+คำสั่งปรับปรุงฐานข้อมูล (ไม่มี Alembic จึงรวมไว้ที่นี่)
+
+    python migrate.py schema                    # สร้างตาราง/เพิ่มคอลัมน์ใหม่ให้ฐานข้อมูลเดิม
+    python migrate.py blobs [--batch-size 50]   # ย้ายไฟล์ PDF จาก document.file ไป blob store
+    python migrate.py search-index              # สร้าง searchVector ใหม่ให้เอกสารทุกฉบับ
+    python migrate.py lsh-index                 # สร้าง MinHash/LSH index ของเอกสารที่ซ้ำกัน/เกี่ยวข้องกันใหม่
+    python migrate.py document-count            # คำนวณตาราง document_count (dashboard) ใหม่จากเอกสารทั้งหมด
+"""
+import argparse
+
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload, load_only
+
+from database import Base, SessionLocal, engine
+from models import *
+from controllers.document_controller import store_pdf
+from controllers.search_controller import build_search_vector
+from controllers.similarity_controller import compute_signature, drop_stale_buckets, index_document, is_current_signature, signature_from_bytes, signature_to_bytes
+
+# create_all ไม่เพิ่มคอลัมน์ให้ตารางที่มีอยู่แล้ว จึงต้อง ALTER เอง (ทุกคำสั่งต้องรันซ้ำได้)
+SCHEMA_UPGRADES = [
+    'ALTER TABLE document ADD COLUMN IF NOT EXISTS "fileHash" VARCHAR(64)',
+    'ALTER TABLE document ADD COLUMN IF NOT EXISTS "fileSize" BIGINT',
+    'ALTER TABLE document ADD COLUMN IF NOT EXISTS "pageCount" INTEGER',
+    'CREATE INDEX IF NOT EXISTS "ix_document_fileHash" ON document ("fileHash")',
+    'ALTER TABLE document ADD COLUMN IF NOT EXISTS "searchVector" TSVECTOR',
+    'CREATE INDEX IF NOT EXISTS "ix_document_searchVector" ON document USING gin ("searchVector")',
+    'ALTER TABLE document ADD COLUMN IF NOT EXISTS minhash BYTEA',
+    "ALTER TABLE wiki ADD COLUMN IF NOT EXISTS status VARCHAR DEFAULT 'SUCCESS'",
+    'ALTER TABLE wiki ADD COLUMN IF NOT EXISTS "taskId" VARCHAR',
+    'CREATE INDEX IF NOT EXISTS "ix_wiki_taskId" ON wiki ("taskId")',
+]
+
+
+def upgrade_schema(bind=engine):
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for stmt in SCHEMA_UPGRADES:
+            conn.execute(text(stmt))
+    print("Schema is up to date.")
+
+
+def migrate_blobs(batch_size: int = 50):
+    """
+    ย้าย document.file ไป blob store ทีละ batch
+    - ดึงแค่ docId มาก่อน แล้วโหลดไฟล์ทีละแถว เพื่อไม่ให้มีไฟล์หลายตัวค้างในหน่วยความจำ
+    - commit ทุก batch ถ้าหยุดกลางทาง รันใหม่ก็ทำต่อจากที่ค้างไว้ได้
+    """
+    moved = failed = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            ids = [
+                row.docId for row in
+                db.query(Document.docId)
+                .filter(Document.docId > last_id, Document.fileHash.is_(None), Document.file.isnot(None))
+                .order_by(Document.docId)
+                .limit(batch_size)
+            ]
+            if not ids:
+                break
+
+            for doc_id in ids:
+                doc = db.query(Document).filter(Document.docId == doc_id).one()
+                try:
+                    blob = store_pdf(doc.file)
+                except Exception as e:
+                    print(f"❌ docId={doc_id}: {e}")
+                    failed += 1
+                    db.expunge(doc)
+                    continue
+                doc.fileHash = blob["fileHash"]
+                doc.fileSize = blob["fileSize"]
+                doc.pageCount = blob["pageCount"]
+                doc.file = None
+                db.flush()
+                db.expunge(doc)  # ปล่อย bytes ของไฟล์ออกจาก session
+                moved += 1
+
+            db.commit()
+            last_id = ids[-1]
+            print(f"moved {moved} documents (last docId={last_id})")
+
+    print(f"Done: moved={moved}, failed={failed}")
+
+
+def rebuild_search_index(batch_size: int = 200):
+    """สร้าง searchVector ใหม่ทั้งหมด (ใช้หลังเพิ่มคอลัมน์ หรือเมื่อเปลี่ยนวิธีตัดคำ)"""
+    done = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            docs = (
+                db.query(Document)
+                .options(
+                    load_only(Document.docId, Document.docName, Document.ocrText),
+                    joinedload(Document.meta).load_only(Meta.keyword),
+                )
+                .filter(Document.docId > last_id)
+                .order_by(Document.docId)
+                .limit(batch_size)
+                .all()
+            )
+            if not docs:
+                break
+            for doc in docs:
+                doc.searchVector = build_search_vector(
+                    doc.docName, doc.meta.keyword if doc.meta else [], doc.ocrText
+                )
+            db.commit()
+            done += len(docs)
+            last_id = docs[-1].docId
+            print(f"indexed {done} documents (last docId={last_id})")
+    print(f"Done: indexed={done}")
+
+
+def rebuild_lsh_index(batch_size: int = 500):
+    """คำนวณ MinHash ที่ยังไม่มี แล้วใส่ทุกเอกสารเข้า LSH index ใน Redis"""
+    print(f"removed {drop_stale_buckets()} buckets of the old band layout")
+    done = 0
+    last_id = 0
+    while True:
+        with SessionLocal() as db:
+            docs = (
+                db.query(Document)
+                .options(load_only(Document.docId, Document.minhash))
+                .filter(Document.docId > last_id)
+                .order_by(Document.docId)
+                .limit(batch_size)
+                .all()
+            )
+            if not docs:
+                break
+            for doc in docs:
+                if is_current_signature(doc.minhash):
+                    signature = signature_from_bytes(doc.minhash)
+                else:
+                    ocr_text = db.query(Document.ocrText).filter(Document.docId == doc.docId).scalar()
+                    signature = compute_signature(ocr_text)
+                    if signature is None:
+                        doc.minhash = None
+                        continue
+                    doc.minhash = signature_to_bytes(signature)
+                index_document(doc.docId, signature)
+            db.commit()
+            done += len(docs)
+            last_id = docs[-1].docId
+            print(f"indexed {done} documents (last docId={last_id})")
+    print(f"Done: indexed={done}")
+
+
+REBUILD_DOCUMENT_COUNT_SQL = [
+    "DELETE FROM document_count",
+    """
+    INSERT INTO document_count (year, month, "factionName", "typeName", count)
+    SELECT extract(year FROM m."publishedDate")::int, extract(month FROM m."publishedDate")::int,
+           COALESCE(m."factionName", ''), COALESCE(m."typeName", ''), count(*)
+    FROM document d
+    JOIN meta m ON m."metaId" = d."metaId"
+    WHERE d.status IS TRUE AND m."publishedDate" IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    """,
+]
+
+
+def rebuild_document_count():
+    """คำนวณ document_count ใหม่ทั้งตารางใน transaction เดียว"""
+    with engine.begin() as conn:
+        conn.execute(text("LOCK TABLE document_count IN EXCLUSIVE MODE"))
+        for stmt in REBUILD_DOCUMENT_COUNT_SQL:
+            conn.execute(text(stmt))
+    print("Done: document_count rebuilt")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("schema", help="create tables and add new columns")
+    blobs = sub.add_parser("blobs", help="move document.file into the blob store")
+    blobs.add_argument("--batch-size", type=int, default=50)
+    search = sub.add_parser("search-index", help="rebuild document.searchVector")
+    search.add_argument("--batch-size", type=int, default=200)
+    lsh = sub.add_parser("lsh-index", help="rebuild the MinHash/LSH similarity index")
+    lsh.add_argument("--batch-size", type=int, default=500)
+    sub.add_parser("document-count", help="rebuild the document_count dashboard table")
+    args = parser.parse_args()
+
+    if args.command == "schema":
+        upgrade_schema()
+    elif args.command == "blobs":
+        upgrade_schema()
+        migrate_blobs(args.batch_size)
+    elif args.command == "search-index":
+        upgrade_schema()
+        rebuild_search_index(args.batch_size)
+    elif args.command == "lsh-index":
+        upgrade_schema()
+        rebuild_lsh_index(args.batch_size)
+    elif args.command == "document-count":
+        upgrade_schema()
+        rebuild_document_count()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from sqlalchemy import create_engine
 from models import *
 from controllers import role_controller, type_controller, faction_controller, user_controller
 from schemas import RoleCreate, TypeCreate, FactionCreate, UserCreate
+from migrate import upgrade_schema
 
 MAX_RETRIES = 30
 SLEEP_INTERVAL = 2
@@ -23,7 +24,7 @@ def wait_for_db_ready():
 
 def init_db():
     engine = wait_for_db_ready()
-    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
     db_session = SessionLocal()
     try:
         # add role
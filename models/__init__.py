@@ -4,4 +4,5 @@ from .faction import Faction
 from .type import Type
 from .user import User
 from .role import Role
-from .wiki import Wiki
\ No newline at end of file
+from .wiki import Wiki
+from .document_count import DocumentCount
@@ -1,16 +1,30 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, LargeBinary, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, ForeignKey, Index, Integer, String, LargeBinary, Boolean
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred, relationship
 from database import Base
 
 class Document(Base):
     __tablename__ = "document"
+    __table_args__ = (
+        Index("ix_document_searchVector", "searchVector", postgresql_using="gin"),
+    )
 
     docId = Column(Integer, primary_key=True)
     docName = Column(String)
     ocrText = Column(String)
     ocrTextWithFormat = Column(String)
     status = Column(Boolean)
-    file = Column(LargeBinary)  # ใช้ LargeBinary เก็บไฟล์s
+    file = deferred(Column(LargeBinary, nullable=True))  # ไฟล์เก่าที่ยังไม่ได้ย้ายไป blob store (python migrate.py blobs)
+
+    # ไฟล์ PDF อยู่ใน blob store (controllers/storage_controller.py) ตาราง document เก็บแค่ข้อมูลอ้างอิง
+    fileHash = Column(String(64), index=True)  # sha256 ของไฟล์ PDF
+    fileSize = Column(BigInteger)
+    pageCount = Column(Integer)
+
+    # tsvector ที่ตัดคำไทยไว้แล้ว (controllers/search_controller.py) อัปเดตตอน save/update
+    searchVector = deferred(Column(TSVECTOR))
+    # MinHash signature ของ ocrText (controllers/similarity_controller.py) ใช้สร้าง LSH index ใหม่
+    minhash = deferred(Column(LargeBinary))
     
     metaId = Column(Integer, ForeignKey("meta.metaId"))
     meta = relationship('Meta', back_populates='document')
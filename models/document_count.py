@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, String
+from database import Base
+
+class DocumentCount(Base):
+    """
+    ตารางสรุปจำนวนเอกสารที่เปิดใช้งาน (status = True) แยกตาม ปี/เดือน ที่ประกาศ, ฝ่าย และประเภท
+    อัปเดตใน transaction เดียวกับการ save/update/delete เอกสาร (controllers/document_controller.py)
+    """
+    __tablename__ = "document_count"
+
+    year = Column(Integer, primary_key=True)
+    month = Column(Integer, primary_key=True)
+    factionName = Column(String, primary_key=True)
+    typeName = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
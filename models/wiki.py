@@ -9,6 +9,9 @@ class Wiki(Base):
     title = Column(String)
     summary = Column(String)
     content = Column(String)
+    # สถานะงานสรุปด้วย LLM (controllers/wiki_controller.generate_wiki): PENDING / SUCCESS / FAILURE
+    status = Column(String, server_default="SUCCESS")
+    taskId = Column(String, index=True, nullable=True)
 
     # document = relationship("Document", back_populates="wiki") 
 
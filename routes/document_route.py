@@ -1,26 +1,41 @@
 import json
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+import tempfile
+from datetime import date
+from pathlib import Path
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Form
 from sqlalchemy.orm import Session
-from controllers.wiki_controller import make_wiki_from_payload
+from controllers.wiki_controller import create_pending_wiki, start_wiki_job
 from database import get_db
-from controllers.document_controller import StatusUpdate, update_document_status, delete_document, download_document, get_all_documents, get_document_by_id, get_document_counts_by_year, get_documents_by_faction, save_doc, update_doc, soft_delete_doc, update_document
-from controllers.ocr_controller import richtext_to_plaintext, process_ocr
+from controllers.document_controller import BULK_MAX_ITEMS, StatusUpdate, bulk_save_docs, spool_bulk_files, update_document_status, delete_document, download_document, get_all_documents, get_document_by_id, get_document_count_series, get_document_counts_by_year, get_documents_by_faction, list_documents, save_doc, update_doc, soft_delete_doc, update_document
+from controllers.ocr_controller import enqueue_ocr, richtext_to_plaintext
+from controllers.ocr_queue_controller import job_identity
+from controllers.executor_controller import get_executor_stats
+from controllers.libreoffice_controller import get_converter_metrics
+from controllers.search_controller import search_documents
+from controllers.similarity_controller import suggest_related
+from schemas.meta import OCRTextRequest
 from models.document import Document
 from models.meta import Meta
 from fastapi import Query
-from models.wiki import Wiki
+from fastapi.concurrency import run_in_threadpool
 
 
 router = APIRouter(prefix="/document", tags=["Document"])
 
 @router.post("/ocr")
-async def ocr(file: UploadFile = File(...)):
+async def ocr(
+    request: Request,
+    file: UploadFile = File(...),
+    userId: int | None = Form(None),
+    preprocess: bool | None = Form(None, description="เตรียมภาพก่อน OCR (แก้เอียง/ตัดขอบ/ย่อ) ไม่ส่ง = ค่าเริ่มต้นของ server"),
+    db: Session = Depends(get_db),
+):
     print(f"Received file: {file.filename}")
-    file_name = file.filename
-    file_bytes = await file.read()
     try:
-        task = process_ocr.delay(file_bytes, file_name)
-        return {"task_id": task.id}
+        # โควตาใช้ IP ของ client และฝ่ายจากตาราง user (ไม่รับ factId จาก client)
+        identity = await run_in_threadpool(job_identity, db, request, userId)
+        # ไฟล์ที่เคย OCR แล้วได้ result กลับมาทันที (cached = true)
+        return await run_in_threadpool(enqueue_ocr, file, identity, preprocess)
     except Exception as e:
         print(f"OCR endpoint error: {e}")
         return {"error": str(e)}
@@ -35,7 +50,7 @@ async def ocr(file: UploadFile = File(...)):
 
 
 @router.post("/save")
-async def save_document(
+def save_document(
     doc: str = Form(...),  # รับ JSON เป็น String
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
@@ -48,25 +63,16 @@ async def save_document(
     
     doc_data.update({"ocrText": ocrText, "ocrTextWithFormat": ocrTextWithFormat})
 
-   # wiki
-    title, summary, content = make_wiki_from_payload(
-        doc_name=doc_data.get("docName", ""),
-        meta=doc_data.get("meta", {}) or {},
-        ocr_text=ocrText,
-    )
-    wiki = Wiki(title=title, summary=summary, content=content)
-    db.add(wiki)
-    db.flush()            
+    # 1) wiki ชั่วคราว (rule-based) ส่วนสรุปด้วย LLM ทำใน Celery (generate_wiki)
+    meta = doc_data.get("meta", {}) or {}
+    wiki = create_pending_wiki(db, doc_data.get("docName", ""), meta, ocrText)
 
-    # 3) save document 
+    # 2) save document (commit ทั้ง wiki และ document)
     new_doc = save_doc(db, doc_data, file, wiki_id=wiki.wikiId)
-
-    # 4) commit ครั้งเดียว
-    db.commit()
-
-    # 5) refresh objects
     db.refresh(wiki)
-    db.refresh(new_doc)
+
+    # 3) ส่งงานสรุป wiki หลัง commit แล้ว
+    task_id = start_wiki_job(wiki.wikiId, wiki.taskId, doc_data.get("docName", ""), meta, ocrText)
 
     return {"message": "Document saved successfully", "doc_id": new_doc.docId,
             "wiki": {
@@ -74,25 +80,115 @@ async def save_document(
                 "title": wiki.title,
                 "summary": wiki.summary,
                 "content": wiki.content,
+                "status": wiki.status,
+                "task_id": task_id,
             }}
 
+@router.post("/bulk-save", summary="Save many documents in one batch")
+def bulk_save_documents(
+    manifest: str = Form(..., description='JSON list: [{"fileName", "docName", "ocrText", "meta"}, ...]'),
+    files: list[UploadFile] | None = File(None),
+    archive: UploadFile | None = File(None, description="ZIP ที่มีไฟล์ตาม fileName ใน manifest"),
+    db: Session = Depends(get_db)
+):
+    """
+    บันทึกเอกสารหลายฉบับ (multipart หลายไฟล์ หรือ ZIP ไฟล์เดียว) พร้อม manifest
+    คืนสถานะรายไฟล์: saved (พร้อม doc_id) หรือ error
+    """
+    try:
+        items = json.loads(manifest, strict=False)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON in 'manifest' field")
+    if isinstance(items, dict):
+        items = items.get("items", [])
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Manifest must be a non-empty list")
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {BULK_MAX_ITEMS})")
+
+    # พักไฟล์ลงดิสก์ก่อน worker แต่ละตัวค่อยอ่านไฟล์ของตัวเอง (ไม่ถือทั้ง batch ไว้ในหน่วยความจำ)
+    with tempfile.TemporaryDirectory(prefix="bulk-") as spool_dir:
+        file_map = spool_bulk_files(archive.file if archive is not None else None, files or [], Path(spool_dir))
+        results = bulk_save_docs(db, items, file_map)
+    return {
+        "saved": sum(1 for r in results if r["status"] == "saved"),
+        "failed": sum(1 for r in results if r["status"] == "error"),
+        "items": results,
+    }
+
+
+@router.get("/converter/metrics", summary="LibreOffice pool and executor metrics")
+def converter_metrics():
+    return {"libreoffice": get_converter_metrics(), "executors": get_executor_stats()}
+
+
 @router.get("/download/{doc_id}")
-async def download_document_api(doc_id: int, db: Session = Depends(get_db)):
-    return download_document(db, doc_id)
+def download_document_api(doc_id: int, request: Request, db: Session = Depends(get_db)):
+    return download_document(db, doc_id, request)
 
 
 #-------------------------------------------------------------------------------------------------
 @router.get("/all")
-async def fetch_all_documents(db: Session = Depends(get_db)):
+def fetch_all_documents(db: Session = Depends(get_db)):
     return get_all_documents(db)
 
 
+@router.get("/list", summary="List documents with keyset pagination")
+def fetch_document_list(
+    cursor: int | None = Query(None, description="docId ตัวสุดท้ายของหน้าก่อนหน้า"),
+    limit: int = Query(50, ge=1, le=200),
+    faction_name: str | None = Query(None),
+    type_name: str | None = Query(None),
+    status: bool | None = Query(None),
+    published_from: date | None = Query(None),
+    published_to: date | None = Query(None),
+    effective_from: date | None = Query(None),
+    effective_to: date | None = Query(None),
+    fields: str | None = Query(None, description="เช่น docName,meta,status (ocrText/ocrTextWithFormat ต้องขอเอง)"),
+    db: Session = Depends(get_db)
+):
+    return list_documents(
+        db,
+        cursor=cursor,
+        limit=limit,
+        faction_name=faction_name,
+        type_name=type_name,
+        status=status,
+        published_from=published_from,
+        published_to=published_to,
+        effective_from=effective_from,
+        effective_to=effective_to,
+        fields=fields,
+    )
+
+
+@router.get("/search", summary="Full-text search over OCR text")
+def search_document_api(
+    q: str = Query(..., min_length=1, description="คำค้น"),
+    faction_name: str | None = Query(None),
+    type_name: str | None = Query(None),
+    year: int | None = Query(None, description="ปีของวันที่ประกาศ"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    return search_documents(db, q, faction_name=faction_name, type_name=type_name, year=year, limit=limit, offset=offset)
+
+
+@router.post("/similar", summary="Find near-duplicate and related documents")
+def similar_document_api(request: OCRTextRequest, db: Session = Depends(get_db)):
+    """
+    ตรวจเอกสารซ้ำ/เอกสารที่เกี่ยวข้องจากข้อความ OCR ก่อนบันทึก
+    """
+    return suggest_related(db, request.ocrText)
+
+
 @router.get("/faction/{faction_name}")
-async def fetch_documents_by_faction(faction_name: str, db: Session = Depends(get_db)):
+def fetch_documents_by_faction(faction_name: str, db: Session = Depends(get_db)):
     return get_documents_by_faction(db, faction_name)
 
 @router.get("/getById/{doc_id}", summary="Get document by ID")
-async def get_document(doc_id: int, db: Session = Depends(get_db)):
+def get_document(doc_id: int, db: Session = Depends(get_db)):
     return get_document_by_id(db, doc_id)
     """
     ดึงข้อมูลเอกสารตาม doc_id พร้อมข้อมูล meta
@@ -127,7 +223,7 @@ async def get_document(doc_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/summary/counts")
-async def document_counts(
+def document_counts(
     year: int = Query(..., description="ระบุปี พ.ศ."),
     faction_name: str = Query("ทุกฝ่าย", description="ชื่อฝ่าย หรือ 'ทุกฝ่าย'"),
     db: Session = Depends(get_db)
@@ -135,9 +231,23 @@ async def document_counts(
     return get_document_counts_by_year(db, year, faction_name)
 
 
+@router.get("/summary/series")
+def document_count_series(
+    year_from: int = Query(..., description="ปีเริ่มต้น"),
+    year_to: int = Query(..., description="ปีสุดท้าย"),
+    db: Session = Depends(get_db)
+):
+    """
+    จำนวนเอกสารรายปี/รายเดือน แยกตามฝ่ายและประเภท สำหรับ dashboard
+    """
+    if year_to - year_from > 50:
+        raise HTTPException(status_code=400, detail="Year range is too large (max 50 years)")
+    return get_document_count_series(db, year_from, year_to)
+
+
 #-----update-------------------------------------------------------
 @router.put("/update/{doc_id}")
-async def update_document_api(
+def update_document_api(
     doc_id: int,
     doc: str = Form(...),
     file: UploadFile | None = File(None),
@@ -152,14 +262,14 @@ async def update_document_api(
 
 
 @router.delete("/delete/{doc_id}", summary="Soft delete a document")
-async def delete_document_api(
+def delete_document_api(
     doc_id: int,
     db: Session = Depends(get_db)
 ):
     return delete_document(db, doc_id)
 
 @router.put("/status/{doc_id}", summary="Update document status (True/False)")
-async def update_document_status_api(
+def update_document_status_api(
     doc_id: int, 
     body: StatusUpdate, # Use the imported StatusUpdate model
     db: Session = Depends(get_db)
@@ -10,11 +10,11 @@ from schemas.faction import FactionCreate
 router = APIRouter(prefix="/faction", tags=["Faction"])
 
 @router.post("/create")
-async def create_faction_api(faction:FactionCreate, db: Session = Depends(get_db)):
+def create_faction_api(faction:FactionCreate, db: Session = Depends(get_db)):
     return faction_controller.create_faction(db, faction)
 
 @router.get("/all")
-async def get_factions_api(db: Session = Depends(get_db)):
+def get_factions_api(db: Session = Depends(get_db)):
     return faction_controller.get_all_factions(db)
 
 @router.get("/factName")
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from database import get_db
-from controllers.meta_controller import extract_metadata,  save_metadata_to_db
+from controllers.executor_controller import cpu_executor
+from controllers.meta_controller import extract_metadata_own_session,  save_metadata_to_db
 from schemas.meta import OCRTextRequest
 
 
@@ -9,12 +10,13 @@ router = APIRouter(prefix="/metadata", tags=["Metadata"])
 
 
 @router.post("/extract")
-async def extract_metadata_api(request: OCRTextRequest, db: Session = Depends(get_db)):
-    meta_data = extract_metadata(request.ocrText, db)
+def extract_metadata_api(request: OCRTextRequest):
+    # ตัดคำ/fuzzy match ใช้ CPU มาก ให้รันใน pool ที่จำกัดจำนวน (ใช้ Session ของตัวเองใน thread นั้น)
+    meta_data = cpu_executor.run_sync(extract_metadata_own_session, request.ocrText)
     return meta_data
 
 # บันทึก Metadata ที่แก้ไขแล้ว
 @router.post("/save")
-async def save_metadata_api(meta_data: dict, db: Session = Depends(get_db)):
+def save_metadata_api(meta_data: dict, db: Session = Depends(get_db)):
     saved_meta = save_metadata_to_db(db, meta_data)
     return {"metaId": saved_meta.metaId, "message": "Metadata saved successfully"}
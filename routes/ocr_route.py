@@ -1,11 +1,20 @@
 import json
-import asyncio
 import os
 import urllib.parse
 from dotenv import load_dotenv
 from redis import Redis
-from fastapi import APIRouter, UploadFile, File, WebSocket
-from controllers.ocr_controller import find_misspelled_words, richtext_to_plaintext, process_ocr
+from fastapi import APIRouter, Depends, Request, UploadFile, File, Form, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from database import get_db
+from controllers.executor_controller import cpu_executor
+from controllers.ocr_cache_controller import get_cache_stats
+from controllers.ocr_client_controller import get_client_stats
+from controllers.ocr_queue_controller import get_queue_stats, job_identity
+from controllers.ocr_controller import celery_app, enqueue_ocr, find_misspelled_words, richtext_to_plaintext
+from controllers.progress_controller import progress_hub
+from controllers.spellcheck_controller import check_many_html
+from schemas.meta import SpellcheckBatchRequest
 
 load_dotenv()
 
@@ -17,17 +26,35 @@ r = Redis(host=url.hostname, port=url.port, password=url.password, decode_respon
 router = APIRouter(prefix="/ocr", tags=["OCR"])
 
 @router.post("/process")
-async def ocr(file: UploadFile = File(...)):
+async def ocr(
+    request: Request,
+    file: UploadFile = File(...),
+    userId: int | None = Form(None),
+    preprocess: bool | None = Form(None, description="เตรียมภาพก่อน OCR (แก้เอียง/ตัดขอบ/ย่อ) ไม่ส่ง = ค่าเริ่มต้นของ server"),
+    db: Session = Depends(get_db),
+):
     print(f"Received file: {file.filename}")
-    file_name = file.filename
-    file_bytes = await file.read()
     try:
-        task = process_ocr.delay(file_bytes, file_name)
-        return {"task_id": task.id}
+        # โควตาใช้ IP ของ client และฝ่ายจากตาราง user (ไม่รับ factId จาก client)
+        identity = await run_in_threadpool(job_identity, db, request, userId)
+        # ไฟล์ที่เคย OCR แล้วได้ result กลับมาทันที (cached = true)
+        return await run_in_threadpool(enqueue_ocr, file, identity, preprocess)
     except Exception as e:
         print(f"OCR endpoint error: {e}")
         return {"error": str(e)}
     
+@router.get("/admin/queues", summary="OCR queue depth and estimated wait per lane")
+def ocr_queue_stats():
+    return get_queue_stats(celery_app)
+
+@router.get("/cache/stats", summary="OCR cache hit/miss counters")
+def ocr_cache_stats():
+    return get_cache_stats()
+
+@router.get("/client/stats", summary="OCR API client rate-limit and retry counters")
+def ocr_client_stats():
+    return get_client_stats()
+
 @router.post('/cancel-ocr/{task_id}')
 def cancel_ocr(task_id:str):
     r.setex(f'{task_id}_cancel', 600, 1)
@@ -37,31 +64,59 @@ def cancel_ocr(task_id:str):
 
 @router.websocket('/progress/{task_id}')
 async def progress(websocket: WebSocket, task_id: str):
+    """
+    ส่ง progress และข้อความรายหน้า (state "PAGE" พร้อม page/total_page/text) ทันทีที่แต่ละหน้าเสร็จ
+    ข้อความสุดท้าย SUCCESS มีผลทั้งไฟล์ และ complete = true
+    skipped_pages คือหน้าว่างที่ไม่ได้ส่ง OCR
+    """
     await websocket.accept()
-    while True:
-        result = process_ocr.AsyncResult(task_id)
-        if result.state == "SUCCESS":
-            progress = "100"
-            await websocket.send_text(json.dumps({"state": result.state, "progress": progress, "result": result.result}))
-            print('result: ',result.result)
-            break
-        elif result.state == "PROGRESS":
-            progress = result.info.get("progress")
-            await websocket.send_text(json.dumps({"state": result.state, "progress": progress}))
-        elif result.state == "CANCEL":
-            progress = result.info.get("progress")
-            await websocket.send_text(json.dumps({"state": "CANCEL", "progress": progress}))
-            break
-        elif result.state == "FAILURE":
-            await websocket.send_text(json.dumps({"state": "FAILURE", "progress": "0"}))
-            break
-        await asyncio.sleep(0.5)  
+    # worker push event ผ่าน Redis pub/sub ไม่ต้อง poll สถานะ
+    pages_sent = set()
+    total_pages = None
+    skipped = []
+    async with progress_hub.watch(task_id, websocket) as events:
+        while True:
+            event = await events.get()
+            if event is None:
+                return  # client ปิดไปแล้ว
+            state = event["state"]
+            meta = event.get("meta") or {}
+            total_pages = meta.get("total_page", total_pages)
+            skipped = meta.get("skipped_pages", skipped)
+            if state == "PAGE":
+                if meta["page"] not in pages_sent:
+                    pages_sent.add(meta["page"])
+                    await websocket.send_text(json.dumps({"state": state, "page": meta["page"], "total_page": meta["total_page"], "text": meta["text"]}))
+            elif state == "SUCCESS":
+                await websocket.send_text(json.dumps({
+                    "state": state,
+                    "progress": "100",
+                    "result": event["result"],
+                    "complete": True,
+                    "total_page": total_pages,
+                    "pages_streamed": len(pages_sent),
+                    "skipped_pages": skipped,
+                }))
+                break
+            elif state == "PROGRESS":
+                await websocket.send_text(json.dumps({"state": state, "progress": meta.get("progress"), "skipped_pages": skipped}))
+            elif state == "CANCEL":
+                await websocket.send_text(json.dumps({"state": "CANCEL", "progress": meta.get("progress")}))
+                break
+            elif state == "FAILURE":
+                await websocket.send_text(json.dumps({"state": "FAILURE", "progress": "0"}))
+                break
     await websocket.close()
 
 @router.post("/find_misspelled_words")
 async def find_misspelled(text:str):
-    return find_misspelled_words(text)
+    return await cpu_executor.run(find_misspelled_words, text)
+
+@router.post("/find_misspelled_words/batch", summary="Spellcheck many snippets in one call")
+async def find_misspelled_batch(request: SpellcheckBatchRequest):
+    """คืนผลตามลำดับของ texts (บรรทัดที่เคยตรวจแล้วใช้ผลจาก cache)"""
+    return await cpu_executor.run(check_many_html, request.texts)
 
 @router.post("/richtext_to_plaintext")
-async def convert_to_plaintext(text:str):
+def convert_to_plaintext(text:str):
     return richtext_to_plaintext(text)
\ No newline at end of file
@@ -7,11 +7,11 @@ from schemas.type import TypeCreate, TypeOut, TypeUpdate
 router = APIRouter(prefix="/type", tags=["Type"])
 
 @router.post("/create")
-async def create_type_api(type:TypeCreate, db: Session = Depends(get_db)):
+def create_type_api(type:TypeCreate, db: Session = Depends(get_db)):
     return type_controller.create_type(db, type)
 
 @router.get("/all")
-async def get_types_api(db: Session = Depends(get_db)):
+def get_types_api(db: Session = Depends(get_db)):
     return type_controller.get_all_types(db)
 
 @router.get("/get/{type_id}", response_model=TypeOut)
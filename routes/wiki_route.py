@@ -1,7 +1,11 @@
+import asyncio
+import json
+import os
 from typing import List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, WebSocket
 from requests import Session
-from controllers.wiki_controller import delete_wiki, get_all_wiki, get_wiki_by_id, update_wiki
+from controllers.progress_controller import progress_hub
+from controllers.wiki_controller import delete_wiki, get_all_wiki, get_wiki_by_id, get_wiki_task, update_wiki
 from database import get_db
 from schemas.wiki import  WikiOut, WikiUpdate
 
@@ -9,6 +13,9 @@ from schemas.wiki import  WikiOut, WikiUpdate
 
 router = APIRouter(prefix="/wiki", tags=["Wiki"])
 
+# ไม่มี event ใหม่นานเกินนี้ (task id ผิด/ส่งงานไม่สำเร็จ) ส่ง TIMEOUT แล้วปิด websocket
+WIKI_PROGRESS_IDLE_TIMEOUT = float(os.getenv("WIKI_PROGRESS_IDLE_TIMEOUT", "600"))
+
 @router.get("/all", response_model=List[WikiOut])
 def list_wiki(db: Session = Depends(get_db)):
     return get_all_wiki(db)
@@ -28,4 +35,37 @@ def update_wiki_endpoint(
 
 @router.delete("/del/{wiki_id}")
 def remove_wiki(wiki_id: int, db: Session = Depends(get_db)):
-    return delete_wiki(db, wiki_id)
\ No newline at end of file
+    return delete_wiki(db, wiki_id)
+
+@router.get("/task/{task_id}")
+def get_wiki_task_status(task_id: str, db: Session = Depends(get_db)):
+    """
+    สถานะงานสรุป wiki (PENDING/SUCCESS/FAILURE) ใช้ task_id ที่ได้จาก /document/save
+    """
+    return get_wiki_task(task_id, db)
+
+
+@router.websocket("/progress/{task_id}")
+async def wiki_progress(websocket: WebSocket, task_id: str):
+    """แจ้งสถานะงานสรุป wiki จนเสร็จ (SUCCESS/FAILURE) แล้วปิด websocket"""
+    await websocket.accept()
+    async with progress_hub.watch(task_id, websocket) as events:
+        if events.empty():
+            await websocket.send_text(json.dumps({"state": "PENDING"}))
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=WIKI_PROGRESS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await websocket.send_text(json.dumps({"state": "TIMEOUT"}))
+                break
+            if event is None:
+                return  # client ปิดไปแล้ว
+            state = event["state"]
+            if state == "SUCCESS":
+                # result = {"wikiId", "status"} โดย status บอกว่า LLM สรุปสำเร็จหรือยังใช้ wiki แบบ rule-based
+                await websocket.send_text(json.dumps({"state": state, "result": event["result"]}))
+                break
+            await websocket.send_text(json.dumps({"state": state}))
+            if state == "FAILURE":
+                break
+    await websocket.close()
@@ -21,3 +21,6 @@ class MetaSchema(BaseModel):
 
 class OCRTextRequest(BaseModel):
     ocrText: str
+
+class SpellcheckBatchRequest(BaseModel):
+    texts: List[str]
@@ -31,6 +31,8 @@ class WikiOut(BaseModel):
     title: str
     summary: str | None = None
     content: str | None = None
+    status: str | None = None
+    taskId: str | None = None
 
     class Config:
         from_attributes = True 
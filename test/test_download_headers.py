@@ -0,0 +1,84 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from controllers.document_controller import _not_modified, _parse_range
+
+ETAG = '"abc123"'
+# Wed, 01 May 2024 00:00:00 GMT
+LAST_MODIFIED = 1714521600.0
+
+
+def make_request(**headers) -> Request:
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=900-5000", (900, 999)),   # end เกินไฟล์ ตัดที่ไบต์สุดท้าย
+    ("bytes=-100", (900, 999)),       # 100 ไบต์สุดท้าย
+    ("bytes=-5000", (0, 999)),        # suffix ยาวกว่าไฟล์ ได้ทั้งไฟล์
+    ("BYTES = 0-0", (0, 0)),
+])
+def test_parse_range_single(header, expected):
+    assert _parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=0-99,200-299",  # หลายช่วงไม่รองรับ ส่งทั้งไฟล์
+    "items=0-10",
+    "bytes=abc",
+    "bytes=--5",
+])
+def test_parse_range_ignored(header):
+    assert _parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=500-100", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=-10", 0),
+])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(HTTPException) as exc:
+        _parse_range(header, size)
+    assert exc.value.status_code == 416
+    assert exc.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    (ETAG, True),
+    (f"W/{ETAG}", True),
+    (f'"other", {ETAG}', True),
+    ("*", True),
+    ('"other"', False),
+])
+def test_not_modified_if_none_match(if_none_match, expected):
+    request = make_request(if_none_match=if_none_match)
+    assert _not_modified(request, ETAG, LAST_MODIFIED) is expected
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    request = make_request(if_none_match='"other"', if_modified_since="Thu, 02 May 2024 00:00:00 GMT")
+    assert _not_modified(request, ETAG, LAST_MODIFIED) is False
+
+
+@pytest.mark.parametrize("if_modified_since, expected", [
+    ("Wed, 01 May 2024 00:00:00 GMT", True),
+    ("Thu, 02 May 2024 00:00:00 GMT", True),
+    ("Tue, 30 Apr 2024 23:59:59 GMT", False),
+    ("Wed, 01 May 2024 00:00:00 -0000", True),   # parsedate_to_datetime ได้ datetime ไม่มี timezone
+    ("Tue, 30 Apr 2024 23:59:59 -0000", False),
+    ("not a date", False),
+])
+def test_not_modified_if_modified_since(if_modified_since, expected):
+    request = make_request(if_modified_since=if_modified_since)
+    assert _not_modified(request, ETAG, LAST_MODIFIED) is expected
+
+
+def test_not_modified_without_validators():
+    assert _not_modified(make_request(), ETAG, LAST_MODIFIED) is False
+    assert _not_modified(make_request(if_modified_since="Wed, 01 May 2024 00:00:00 GMT"), ETAG, None) is False
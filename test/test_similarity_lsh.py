@@ -0,0 +1,79 @@
+"""
+ตรวจว่าการตั้ง band/row ของ LSH ยังเจอคู่ที่ Jaccard ถึง RELATED_THRESHOLD และไม่ดึงคู่ที่ไม่เกี่ยวข้องมามากเกินไป
+ใช้ข้อความสุ่มจาก seed คงที่ ผลเหมือนกันทุกครั้ง ไม่ต้องใช้ Redis (เทียบ band key ของสอง signature ตรง ๆ)
+"""
+import os
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+
+from controllers.similarity_controller import (  # noqa: E402
+    RELATED_THRESHOLD,
+    _band_keys,
+    _shingle_hashes,
+    compute_signature,
+)
+
+DOC_LENGTH = 2000
+PAIRS = 200
+# พยัญชนะไทย ก-ฮ shingle 5 ตัวจากตัวอักษรสุ่มแทบไม่ซ้ำกันเอง
+ALPHABET = np.array([chr(c) for c in range(0x0E01, 0x0E2F)])
+
+
+def _random_text(rng: np.random.RandomState, length: int) -> str:
+    return "".join(rng.choice(ALPHABET, size=length))
+
+
+def _make_pair(rng: np.random.RandomState, jaccard: float) -> tuple[str, str]:
+    """สองข้อความยาวเท่ากันที่มีส่วนร่วมกันพอให้ Jaccard ของ shingle ~ jaccard (s / (2N - s) = J)"""
+    shared_length = round(2 * DOC_LENGTH * jaccard / (1 + jaccard))
+    shared = _random_text(rng, shared_length)
+    return (
+        shared + _random_text(rng, DOC_LENGTH - shared_length),
+        shared + _random_text(rng, DOC_LENGTH - shared_length),
+    )
+
+
+def _true_jaccard(a: str, b: str) -> float:
+    sa, sb = set(_shingle_hashes(a).tolist()), set(_shingle_hashes(b).tolist())
+    return len(sa & sb) / len(sa | sb)
+
+
+def _is_candidate(a: str, b: str) -> bool:
+    return bool(set(_band_keys(compute_signature(a))) & set(_band_keys(compute_signature(b))))
+
+
+def _candidate_rate(jaccard: float, seed: int) -> float:
+    rng = np.random.RandomState(seed)
+    return sum(_is_candidate(*_make_pair(rng, jaccard)) for _ in range(PAIRS)) / PAIRS
+
+
+def test_pairs_have_requested_jaccard():
+    rng = np.random.RandomState(0)
+    for jaccard in (0.05, RELATED_THRESHOLD, 0.8):
+        assert _true_jaccard(*_make_pair(rng, jaccard)) == pytest.approx(jaccard, abs=0.01)
+
+
+def test_signature_estimates_jaccard():
+    rng = np.random.RandomState(1)
+    for jaccard in (0.05, RELATED_THRESHOLD, 0.5, 0.8):
+        a, b = _make_pair(rng, jaccard)
+        estimate = float(np.mean(compute_signature(a) == compute_signature(b)))
+        # ค่าคลาดเคลื่อนมาตรฐานของ MinHash 384 ค่า ~ sqrt(J(1-J)/384) <= 0.026
+        assert estimate == pytest.approx(_true_jaccard(a, b), abs=0.08)
+
+
+def test_recall_at_related_threshold():
+    # ทฤษฎี 1-(1-0.3^3)^128 ~ 97%
+    assert _candidate_rate(RELATED_THRESHOLD, seed=2) >= 0.9
+
+
+def test_false_candidate_rate_at_low_similarity():
+    # ทฤษฎี ~1.6% ที่ Jaccard 0.05 ถ้าเกินนี้ bucket จะโตตามจำนวนเอกสารจนถึง MAX_CANDIDATES บ่อย
+    assert _candidate_rate(0.05, seed=3) <= 0.05
+
+
+def test_unrelated_documents_rarely_collide():
+    assert _candidate_rate(0.0, seed=4) <= 0.01